@@ -1,29 +1,25 @@
 import sys
 import os
 import json
-import requests
 import logging
 import urllib
 import lxml.etree
 import defusedxml.lxml
 
 try:
-    from version import __version__, useragentname, useragentcomment
-    from util import now_local, xml_escape, meta_from_xsl, xml_str_param
+    from fetch import get
+    from util import now_local, xml_escape, meta_from_xsl, xml_str_param, compiled_xslt
 except ModuleNotFoundError:
     include = os.path.relpath(os.path.join(os.path.dirname(__file__), '..'))
     sys.path.insert(0, include)
-    from version import __version__, useragentname, useragentcomment
-    from util import now_local, xml_escape, meta_from_xsl, xml_str_param
+    from fetch import get
+    from util import now_local, xml_escape, meta_from_xsl, xml_str_param, compiled_xslt
 
 
 class Parser:
     canteen_json = os.path.join(os.path.dirname(__file__), "canteens.json")
     meta_xslt = os.path.join(os.path.dirname(__file__), "../meta.xsl")
     feed_xslt = os.path.join(os.path.dirname(__file__), "feed.xsl")
-    headers = {
-        'User-Agent': f'{useragentname}/{__version__} ({useragentcomment}) {requests.utils.default_user_agent()}'
-    }
     meals_current_week = 'https://menuplan.eurest.at/CurrentWeek/{ref}.xml'
     meals_next_week = 'https://menuplan.eurest.at/NextWeek/{ref}.xml'
     source_url = 'https://menuplan.eurest.at/menu.html?current_url=%2FCurrentWeek%2F{ref}.xml'
@@ -41,18 +37,16 @@ class Parser:
         else:
             first_url, second_url = this_week, next_week
 
-        source = requests.get(first_url, headers=self.headers, stream=True).raw
+        source = get(first_url, stream=True).raw
         try:
             dom = defusedxml.lxml.parse(source)
         except lxml.etree.XMLSyntaxError as e:
             logging.debug(e)
             # try other week if one is empty
-            source = requests.get(
-                second_url, headers=self.headers, stream=True).raw
+            source = get(second_url, stream=True).raw
             dom = defusedxml.lxml.parse(source)
 
-        xslt_tree = defusedxml.lxml.parse(self.feed_xslt)
-        xslt = lxml.etree.XSLT(xslt_tree)
+        xslt = compiled_xslt(self.feed_xslt)
         new_dom = xslt(dom)
         return lxml.etree.tostring(new_dom,
                                    pretty_print=True,
@@ -0,0 +1,664 @@
+#!/usr/bin/env python
+
+"""
+Shared HTTP layer of all parsers
+
+One pooled keep-alive session per host, so a run doesn't open a new
+connection for every request, and a LRU cache of responses keyed by URL.
+With a cache directory, responses that carry an ETag or Last-Modified
+header are also stored on disk and revalidated with conditional requests
+in the next run.
+
+With set_fixtures(), all HTTP exchanges of a run are recorded to a zip
+file or replayed from it without network access. With set_upstream(), all
+requests are sent to a stand-in server instead, e.g. tests/mock_upstream.py.
+
+All requests to a host go through its HostLimiter, which limits the
+requests per second and the requests in flight and pauses the host after
+a 429/503 response.
+
+Independent requests can run concurrently on an asyncio event loop with
+get_async()/get_many(). The requests itself run on worker threads, so they
+share the sessions, caches and dependency tracking with the blocking API.
+"""
+
+import io
+import os
+import json
+import time
+import hashlib
+import logging
+import itertools
+import tempfile
+import threading
+import contextlib
+import contextvars
+import zipfile
+import datetime
+import urllib.parse
+import email.utils
+from collections import OrderedDict
+
+import urllib3
+import requests
+import requests.adapters
+
+import timing
+import metrics
+from version import __version__, useragentname, useragentcomment
+
+__all__ = ['user_agent', 'session', 'get', 'post', 'get_cached', 'clear_cache',
+           'get_async', 'run_async', 'get_many', 'set_host_limits', 'host_limiter',
+           'set_cache_dir', 'prune_cache', 'load_state', 'save_state', 'fingerprint',
+           'track_dependencies', 'depends_on', 'unchanged', 'FixtureStore', 'set_fixtures', 'close_fixtures',
+           'set_upstream']
+
+user_agent = f'{useragentname}/{__version__} ({useragentcomment}) {requests.utils.default_user_agent()}'
+default_timeout = 30
+pool_maxsize = 10
+cache_max_bytes = 64 * 1024 * 1024
+cache_dir = None
+disk_cache_max_age = 14 * 24 * 60 * 60
+host_rate = None  # requests per second and host, None for no limit
+host_max_in_flight = 4
+host_limits = {}  # "scheme://host" -> {"rate": ..., "max_in_flight": ...}
+retry_status = (429, 503)
+max_retries = 3
+max_retry_delay = 60
+upstream = None  # "http://127.0.0.1:8080" sends https://host/path to http://127.0.0.1:8080/host/path
+
+
+class LRUCache:
+    """Thread-safe LRU cache with a budget in bytes instead of a number of entries"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, size):
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, oldSize) = self._entries.popitem(last=False)
+                self.size -= oldSize
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class HostLimiter:
+    """Politeness for one host: at most `rate` requests per second, at most
+    `max_in_flight` concurrent requests and no requests during a pause"""
+
+    def __init__(self, rate=None, max_in_flight=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._in_flight = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def _wait_for_slot(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    @contextlib.contextmanager
+    def slot(self):
+        if self._in_flight:
+            self._in_flight.acquire()
+        try:
+            self._wait_for_slot()
+            yield
+        finally:
+            if self._in_flight:
+                self._in_flight.release()
+
+    def pause(self, seconds):
+        """No new requests to the host for `seconds`"""
+        with self._lock:
+            self._next = max(self._next, time.monotonic() + seconds)
+
+
+def _retry_delay(response, attempt):
+    """Seconds to wait from the Retry-After header or exponential backoff"""
+    retry_after = response.headers.get('Retry-After')
+    if retry_after:
+        if retry_after.strip().isdigit():
+            return int(retry_after)
+        with contextlib.suppress(TypeError, ValueError):
+            return email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time()
+    return 2 ** attempt
+
+
+class FixtureStore:
+    """HTTP exchanges in a zip file, keyed by method, URL and request body.
+
+    Bodies are stored once per content. A request that was not recorded is
+    answered with the exchange of the same method and URL with another body,
+    or else of the same URL without the query, so that requests that contain
+    the current date still find the recorded response on a later day."""
+
+    _dropHeaders = ('content-encoding', 'content-length', 'transfer-encoding')
+
+    def __init__(self, filename, recording=False):
+        self.filename = filename
+        self.recording = recording
+        self.exchanges = {}
+        self.bodies = {}
+        self.recorded = None
+        self._lock = threading.Lock()
+        if not recording:
+            with zipfile.ZipFile(filename) as archive:
+                index = json.loads(archive.read('index.json'))
+                self.recorded = index['recorded']
+                self.exchanges = index['exchanges']
+                self.bodies = {name[len('bodies/'):]: archive.read(name)
+                               for name in archive.namelist() if name.startswith('bodies/')}
+        self._loose = {}
+        for key, exchange in self.exchanges.items():
+            self._index_loose(key, exchange)
+
+    @staticmethod
+    def key(method, url, body):
+        if body is None:
+            body = b''
+        elif isinstance(body, str):
+            body = body.encode('utf8')
+        elif not isinstance(body, bytes):
+            # Generators and file objects can't be read twice
+            body = repr(body).encode('utf8')
+        return hashlib.sha1(f"{method} {url}\n".encode('utf8') + body).hexdigest()
+
+    @staticmethod
+    def _without_query(url):
+        return urllib.parse.urlsplit(url)._replace(query='', fragment='').geturl()
+
+    def _index_loose(self, key, exchange):
+        self._loose[(exchange['method'], exchange['url'])] = key
+        self._loose[(exchange['method'], self._without_query(exchange['url']))] = key
+
+    @staticmethod
+    def _raw(body, headers, status, reason):
+        """A raw response that still has the body, for callers that read `response.raw`"""
+        return urllib3.HTTPResponse(body=io.BytesIO(body), headers=headers, status=status, reason=reason,
+                                    preload_content=False, decode_content=False)
+
+    def record(self, request, response):
+        content = response.content
+        contentKey = hashlib.sha1(content).hexdigest()
+        exchange = {
+            'method': request.method,
+            'url': request.url,
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': {name: value for name, value in response.headers.items()
+                        if name.lower() not in self._dropHeaders},
+            'body': contentKey,
+        }
+        key = self.key(request.method, request.url, request.body)
+        with self._lock:
+            # The last response wins, e.g. the 200 after a retried 503
+            self.exchanges[key] = exchange
+            self.bodies[contentKey] = content
+            self._index_loose(key, exchange)
+        # Reading the content consumed the raw stream of stream=True requests
+        response.raw = self._raw(content, exchange['headers'], response.status_code, response.reason)
+
+    def find(self, request):
+        key = self.key(request.method, request.url, request.body)
+        with self._lock:
+            exchange = self.exchanges.get(key)
+            if exchange is None:
+                key = (self._loose.get((request.method, request.url)) or
+                       self._loose.get((request.method, self._without_query(request.url))))
+                exchange = self.exchanges.get(key)
+                if exchange is not None:
+                    logging.debug("Replaying %s %s for %s", exchange['method'], exchange['url'], request.url)
+            return exchange
+
+    def replay(self, adapter, request):
+        exchange = self.find(request)
+        if exchange is None:
+            raise requests.ConnectionError(f"Not in the fixtures {self.filename}: {request.method} {request.url}",
+                                           request=request)
+        body = self.bodies[exchange['body']]
+        raw = self._raw(body, exchange['headers'], exchange['status'], exchange['reason'])
+        response = adapter.build_response(request, raw)
+        response._content = body
+        response._content_consumed = True
+        return response
+
+    def save(self):
+        with self._lock:
+            index = {
+                'recorded': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+                'exchanges': self.exchanges,
+            }
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.filename)), suffix='.tmp')
+            os.close(fd)
+            try:
+                with zipfile.ZipFile(tmp, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+                    archive.writestr('index.json', json.dumps(index, indent=1, sort_keys=True))
+                    for contentKey, content in sorted(self.bodies.items()):
+                        archive.writestr(f'bodies/{contentKey}', content)
+                os.replace(tmp, self.filename)
+            except BaseException:
+                with contextlib.suppress(OSError):
+                    os.remove(tmp)
+                raise
+
+
+_fixtures = None
+
+
+def set_fixtures(filename, recording=False):
+    """Record all HTTP exchanges to the zip file `filename` or replay them from it.
+    A recording is written by close_fixtures()."""
+    global _fixtures
+    close_fixtures()
+    _fixtures = FixtureStore(filename, recording) if filename else None
+
+
+def close_fixtures():
+    global _fixtures
+    if _fixtures is not None and _fixtures.recording:
+        _fixtures.save()
+    _fixtures = None
+
+
+class _PoliteAdapter(requests.adapters.HTTPAdapter):
+    """Sends every request through the HostLimiter and retries on 429/503"""
+
+    def send(self, request, **kwargs):
+        fixtures = _fixtures
+        with timing.phase('fetch'):
+            if fixtures is not None and not fixtures.recording:
+                return fixtures.replay(self, request)
+            response = self._send(request, **kwargs)
+            if fixtures is not None:
+                fixtures.record(request, response)
+            return response
+
+    def _send(self, request, **kwargs):
+        host = urllib.parse.urlsplit(request.url).hostname or ''
+        limiter = host_limiter(request.url)
+        if upstream:
+            request = request.copy()
+            request.url = _upstream_url(request.url)
+        for attempt in itertools.count():
+            with limiter.slot():
+                response = super().send(request, **kwargs)
+                if not kwargs.get('stream'):
+                    # The session would read the body right after, read it here to count the bytes
+                    metrics.http_bytes.inc(len(response.content), host=host)
+            metrics.http_requests.inc(host=host, status=response.status_code)
+            if response.status_code not in retry_status or attempt >= max_retries:
+                return response
+            delay = max(0, _retry_delay(response, attempt))
+            if delay > max_retry_delay:
+                return response
+            logging.info("%d from %s, retrying in %.1fs", response.status_code, request.url, delay)
+            response.close()
+            limiter.pause(delay)
+
+
+_sessions = {}
+_sessionsLock = threading.Lock()
+_limiters = {}
+_limitersLock = threading.Lock()
+_cache = LRUCache(cache_max_bytes)
+_inflight = {}
+_inflightLock = threading.Lock()
+_dependencies = contextvars.ContextVar('dependencies', default=None)
+
+
+class Dependencies:
+    """URLs and the fingerprints of their content that a feed was generated from"""
+
+    def __init__(self):
+        self.urls = {}
+        self.complete = True
+
+
+@contextlib.contextmanager
+def track_dependencies():
+    """Record all URLs that are requested in this context.
+    `complete` is False if a request could not be recorded, e.g. a POST request."""
+    dependencies = Dependencies()
+    token = _dependencies.set(dependencies)
+    try:
+        yield dependencies
+    finally:
+        _dependencies.reset(token)
+
+
+def _track(url, response):
+    dependencies = _dependencies.get()
+    if dependencies is None:
+        return
+    if response is None or not response.ok:
+        dependencies.complete = False
+    else:
+        dependencies.urls[url] = fingerprint(response)
+
+
+def _untracked():
+    dependencies = _dependencies.get()
+    if dependencies is not None:
+        dependencies.complete = False
+
+
+def depends_on(url):
+    """Declare that the current feed depends on `url`, even though
+    the response was already processed earlier in this run"""
+    _track(url, _cache.get(url))
+
+
+def fingerprint(response):
+    value = getattr(response, 'content_sha1', None)
+    if value is None:
+        value = hashlib.sha1(response.content).hexdigest()
+        response.content_sha1 = value
+    return value
+
+
+def set_cache_dir(path):
+    """Enable the persistent cache in the directory `path`, None to disable it"""
+    global cache_dir
+    cache_dir = path
+    if path:
+        os.makedirs(os.path.join(path, 'http'), exist_ok=True)
+
+
+def _write_atomic(filename, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, filename)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        raise
+
+
+def _disk_paths(url):
+    key = hashlib.sha1(url.encode('utf8')).hexdigest()
+    base = os.path.join(cache_dir, 'http', key)
+    return base + '.json', base + '.body'
+
+
+def _disk_load(url):
+    if not cache_dir:
+        return None
+    metaPath, bodyPath = _disk_paths(url)
+    try:
+        with open(metaPath, 'r', encoding='utf8') as f:
+            meta = json.load(f)
+        if meta.get('url') != url:
+            return None
+        with open(bodyPath, 'rb') as f:
+            body = f.read()
+    except (OSError, ValueError):
+        return None
+    return meta, body
+
+
+def _disk_store(url, response):
+    if not cache_dir:
+        return
+    if not response.headers.get('ETag') and not response.headers.get('Last-Modified'):
+        return
+    metaPath, bodyPath = _disk_paths(url)
+    meta = {
+        'url': url,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'headers': {key: value for key, value in response.headers.items()
+                    if key.lower() in ('content-type', 'etag', 'last-modified')},
+        'encoding': response.encoding,
+        'sha1': fingerprint(response),
+    }
+    try:
+        _write_atomic(bodyPath, response.content)
+        _write_atomic(metaPath, json.dumps(meta).encode('utf8'))
+    except OSError as e:
+        logging.warning("Could not write %s to the cache: %s", url, e)
+
+
+def _response_from_disk(url, meta, body):
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response.headers = requests.structures.CaseInsensitiveDict(meta['headers'])
+    response.encoding = meta['encoding']
+    response._content = body
+    response.content_sha1 = meta['sha1']
+    response.not_modified = True
+    return response
+
+
+def prune_cache(max_age=None):
+    """Remove entries from the cache directory that were not used for `max_age` seconds"""
+    if not cache_dir:
+        return
+    if max_age is None:
+        max_age = disk_cache_max_age
+    folder = os.path.join(cache_dir, 'http')
+    limit = time.time() - max_age
+    for entry in os.scandir(folder):
+        with contextlib.suppress(OSError):
+            mtime = entry.stat().st_mtime
+            if entry.name.endswith('.body'):
+                # A body is used as long as its meta file is
+                metaPath = entry.path[:-len('.body')] + '.json'
+                if os.path.exists(metaPath):
+                    mtime = os.stat(metaPath).st_mtime
+            if mtime < limit:
+                os.remove(entry.path)
+
+
+def load_state(name, default=None):
+    """Load JSON data that was stored with save_state() in an earlier run"""
+    if not cache_dir:
+        return default
+    try:
+        with open(os.path.join(cache_dir, f'{name}.json'), 'r', encoding='utf8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def save_state(name, data):
+    if not cache_dir:
+        return
+    _write_atomic(os.path.join(cache_dir, f'{name}.json'),
+                  json.dumps(data, indent=1, sort_keys=True).encode('utf8'))
+
+
+def _host_key(url):
+    parts = urllib.parse.urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def set_upstream(url):
+    """Send all requests to the server at `url` instead of the real hosts, None to disable it"""
+    global upstream
+    upstream = url.rstrip('/') if url else None
+
+
+def _upstream_url(url):
+    parts = urllib.parse.urlsplit(url)
+    return f"{upstream}/{parts.netloc}{parts.path or '/'}" + (f"?{parts.query}" if parts.query else "")
+
+
+def set_host_limits(rate=None, max_in_flight=None, hosts=None):
+    """Set the default limits for all hosts and optionally per host, e.g.
+    hosts={"https://login.mampf1a.de": {"rate": 2, "max_in_flight": 2}}"""
+    global host_rate, host_max_in_flight
+    host_rate = rate
+    host_max_in_flight = max_in_flight
+    host_limits.clear()
+    if hosts:
+        host_limits.update({_host_key(host): limits for host, limits in hosts.items()})
+    with _limitersLock:
+        _limiters.clear()
+
+
+def host_limiter(url):
+    """Return the HostLimiter for the host of `url`"""
+    key = _host_key(url)
+    with _limitersLock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limits = host_limits.get(key, {})
+            limiter = HostLimiter(limits.get('rate', host_rate),
+                                  limits.get('max_in_flight', host_max_in_flight))
+            _limiters[key] = limiter
+    return limiter
+
+
+def session(url):
+    """Return the pooled session for the host of `url`"""
+    key = _host_key(url)
+    with _sessionsLock:
+        s = _sessions.get(key)
+        if s is None:
+            s = requests.Session()
+            adapter = _PoliteAdapter(
+                pool_connections=1, pool_maxsize=pool_maxsize)
+            s.mount('https://', adapter)
+            s.mount('http://', adapter)
+            s.headers['User-Agent'] = user_agent
+            _sessions[key] = s
+    return s
+
+
+def _get(url, **kwargs):
+    kwargs.setdefault('timeout', default_timeout)
+    return session(url).get(url, **kwargs)
+
+
+def get(url, **kwargs):
+    _untracked()
+    return _get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    _untracked()
+    kwargs.setdefault('timeout', default_timeout)
+    return session(url).post(url, **kwargs)
+
+
+def _download(url, **kwargs):
+    # Recordings must contain complete responses, not 304s
+    stored = _disk_load(url) if _fixtures is None else None
+    if stored is not None:
+        meta, body = stored
+        headers = dict(kwargs.pop('headers', None) or {})
+        if meta['etag']:
+            headers['If-None-Match'] = meta['etag']
+        if meta['last_modified']:
+            headers['If-Modified-Since'] = meta['last_modified']
+        kwargs['headers'] = headers
+
+    response = _get(url, **kwargs)
+
+    if response.status_code == 304 and stored is not None:
+        logging.debug("Not modified: %s", url)
+        for path in _disk_paths(url):
+            with contextlib.suppress(OSError):
+                os.utime(path)
+        metrics.cache_requests.inc(result='revalidated')
+        return _response_from_disk(url, *stored)
+    metrics.cache_requests.inc(result='miss')
+    if response.ok:
+        _disk_store(url, response)
+    return response
+
+
+def get_cached(url, **kwargs):
+    """GET `url` or return the response from the cache.
+    Concurrent calls for the same URL wait for the first download."""
+    response = _cache.get(url)
+    if response is not None:
+        logging.debug("Retrieved from cache: %s", url)
+        metrics.cache_requests.inc(result='hit')
+        _track(url, response)
+        return response
+
+    with _inflightLock:
+        lock = _inflight.setdefault(url, threading.Lock())
+    try:
+        with timing.phase('fetch'), lock:
+            response = _cache.get(url)
+            if response is None:
+                response = _download(url, **kwargs)
+                if response.ok:
+                    _cache.put(url, response, len(response.content))
+            else:
+                logging.debug("Retrieved from cache: %s", url)
+                metrics.cache_requests.inc(result='hit')
+    finally:
+        with _inflightLock:
+            if _inflight.get(url) is lock:
+                del _inflight[url]
+    _track(url, response)
+    return response
+
+
+async def get_async(url, cached=False, **kwargs):
+    """Awaitable get() or get_cached() that runs on a worker thread"""
+    import asyncio
+    return await asyncio.to_thread(get_cached if cached else get, url, **kwargs)
+
+
+def run_async(*awaitables):
+    """Run the awaitables concurrently on a new event loop and return their results in order.
+    This is the blocking entry point for code that is not async itself."""
+    import asyncio  # not imported at startup, most runs don't need it
+
+    async def gather():
+        return await asyncio.gather(*awaitables)
+    return asyncio.run(gather())
+
+
+def get_many(urls, cached=False, **kwargs):
+    """Fetch the URLs concurrently and return the responses in the same order"""
+    return run_async(*(get_async(url, cached, **kwargs) for url in urls))
+
+
+def unchanged(dependencies):
+    """Revalidate the URLs of `dependencies` (url -> fingerprint).
+    True if all responses still have the same content."""
+    for url, recorded in dependencies.items():
+        response = get_cached(url)
+        if not response.ok or fingerprint(response) != recorded:
+            return False
+    return True
+
+
+def clear_cache():
+    _cache.clear()
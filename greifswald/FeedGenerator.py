@@ -7,34 +7,35 @@ Modified 2022-03-22 by cvzi (cuzi@openmail.cc)
 
 import sys
 import os
-import requests
-from bs4 import BeautifulSoup
 import bs4.element
 from datetime import date, timedelta
 
 try:
-    from version import __version__, useragentname, useragentcomment
-    from util import StyledLazyBuilder
+    from fetch import get, get_many
+    from util import StyledLazyBuilder, parse_html
 except ModuleNotFoundError:
     include = os.path.relpath(os.path.join(os.path.dirname(__file__), '..'))
     sys.path.insert(0, include)
-    from version import __version__, useragentname, useragentcomment
-    from util import StyledLazyBuilder
+    from fetch import get, get_many
+    from util import StyledLazyBuilder, parse_html
 
-headers = {
-    'User-Agent': f'{useragentname}/{__version__} ({useragentcomment}) {requests.utils.default_user_agent()}'
-}
+# Number of days that are requested at once in buildFull()
+prefetchDays = 7
 
 
-def getMealsForDay(mensa: StyledLazyBuilder, day: str, canteen: str):
+def dayUrl(canteen: str, day: str):
+    return "https://www.stw-greifswald.de/essen/speiseplaene/" + canteen + "/?datum=" + day
+
+
+def getMealsForDay(mensa: StyledLazyBuilder, day: str, canteen: str, html: str = None):
 
     if date.fromisoformat(day).weekday() > 4:  # Saturday or Sunday
         mensa.setDayClosed(date.fromisoformat(day))
         return True
 
-    html = requests.get("https://www.stw-greifswald.de/essen/speiseplaene/" +
-                        canteen + "/?datum=" + day, headers=headers).text
-    soup = BeautifulSoup(html, 'html.parser')
+    if html is None:
+        html = get(dayUrl(canteen, day)).text
+    soup = parse_html(html, 'greifswald')
 
     if mensa.legendData is None:
         for div in soup.find_all('div', {'class': 'col-12'}):
@@ -61,25 +62,39 @@ def getMealsForDay(mensa: StyledLazyBuilder, day: str, canteen: str):
     return mensa.hasMealsFor(date.fromisoformat(day))
 
 
-def generateToday(canteen_name: str):
+def buildToday(canteen_name: str) -> StyledLazyBuilder:
     mensa = StyledLazyBuilder()
 
     day = date.today()
 
     getMealsForDay(mensa, day.isoformat(), canteen_name)
 
-    return mensa.toXMLFeed()
+    return mensa
 
 
-def generateFull(canteen_name: str):
+def buildFull(canteen_name: str) -> StyledLazyBuilder:
     mensa = StyledLazyBuilder()
 
     day = date.today()
 
-    while getMealsForDay(mensa, day.isoformat(), canteen_name):
-        day = day + timedelta(days=1)
+    # Request a week at once and stop at the first weekday without meals
+    while True:
+        days = [(day + timedelta(days=i)).isoformat() for i in range(prefetchDays)]
+        weekdays = [d for d in days if date.fromisoformat(d).weekday() <= 4]
+        pages = dict(zip(weekdays, get_many([dayUrl(canteen_name, d) for d in weekdays])))
+        for d in days:
+            html = pages[d].text if d in pages else None
+            if not getMealsForDay(mensa, d, canteen_name, html):
+                return mensa
+        day = day + timedelta(days=prefetchDays)
+
 
-    return mensa.toXMLFeed()
+def generateToday(canteen_name: str):
+    return buildToday(canteen_name).toXMLFeed()
+
+
+def generateFull(canteen_name: str):
+    return buildFull(canteen_name).toXMLFeed()
 
 
 if __name__ == "__main__":
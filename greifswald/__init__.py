@@ -7,13 +7,13 @@ import urllib
 try:
     from version import __version__
     from util import xml_escape, meta_from_xsl, xml_str_param
-    from greifswald.FeedGenerator import generateToday, generateFull
+    from greifswald.FeedGenerator import generateToday, generateFull, buildToday, buildFull
 except ModuleNotFoundError:
     include = os.path.relpath(os.path.join(os.path.dirname(__file__), '..'))
     sys.path.insert(0, include)
     from version import __version__
     from util import xml_escape, meta_from_xsl, xml_str_param
-    from FeedGenerator import generateToday, generateFull
+    from FeedGenerator import generateToday, generateFull, buildToday, buildFull
 
 
 class Parser:
@@ -26,12 +26,26 @@ class Parser:
 
         return generateToday(ref)
 
+    def write_feed_today(self, ref: str, fileobj):
+        if ref not in self.canteens:
+            fileobj.write(f"Unkown canteen with ref='{xml_escape(ref)}'")
+            return
+
+        buildToday(ref).writeXMLFeed(fileobj)
+
     def feed_all(self, ref: str) -> str:
         if ref not in self.canteens:
             return f"Unkown canteen with ref='{xml_escape(ref)}'"
 
         return generateFull(ref)
 
+    def write_feed_all(self, ref: str, fileobj):
+        if ref not in self.canteens:
+            fileobj.write(f"Unkown canteen with ref='{xml_escape(ref)}'")
+            return
+
+        buildFull(ref).writeXMLFeed(fileobj)
+
     def meta(self, ref):
         """Generate an openmensa XML meta feed using XSLT"""
         if ref not in self.canteens:
@@ -4,24 +4,70 @@ import json
 import logging
 import urllib
 import re
-import requests
 import bs4
 import pyopenmensa
 
 try:
-    from version import __version__, useragentname, useragentcomment
-    from util import StyledLazyBuilder, xml_escape, meta_from_xsl, xml_str_param
+    from fetch import get_cached
+    from util import StyledLazyBuilder, xml_escape, meta_from_xsl, xml_str_param, parse_html
 except ModuleNotFoundError:
     include = os.path.relpath(os.path.join(os.path.dirname(__file__), '..'))
     sys.path.insert(0, include)
-    from version import __version__, useragentname, useragentcomment
-    from util import StyledLazyBuilder, xml_escape, meta_from_xsl, xml_str_param
+    from fetch import get_cached
+    from util import StyledLazyBuilder, xml_escape, meta_from_xsl, xml_str_param, parse_html
+
+
+class CategoryIndex:
+    """Category rules of a canteen: exact image urls and wildcard rules with
+    "$" suffix, "^" prefix and "*" substring. If several wildcard rules match,
+    the last one wins. Results are memoized per image url"""
+
+    def __init__(self, rules):
+        self.exact = dict(rules)
+        self.prefixes = {}
+        self.suffixes = {}
+        self.substrings = []
+        for order, (query, category) in enumerate(rules.items()):
+            if query.startswith("^"):
+                self.prefixes[query[1:]] = (order, category)
+            elif query.startswith("$"):
+                self.suffixes[query[1:]] = (order, category)
+            elif query.startswith("*"):
+                self.substrings.append((query[1:], order, category))
+        self.prefix_lengths = sorted({len(prefix) for prefix in self.prefixes})
+        self.suffix_lengths = sorted({len(suffix) for suffix in self.suffixes})
+        self.memo = {}
+
+    def resolve(self, url):
+        """Category name for the image `url` or None"""
+        try:
+            return self.memo[url]
+        except KeyError:
+            pass
+        if url in self.exact:
+            result = self.exact[url]
+        else:
+            matches = []
+            for length in self.prefix_lengths:
+                if length <= len(url) and url[:length] in self.prefixes:
+                    matches.append(self.prefixes[url[:length]])
+            for length in self.suffix_lengths:
+                if length <= len(url) and url[len(url) - length:] in self.suffixes:
+                    matches.append(self.suffixes[url[len(url) - length:]])
+            for substring, order, category in self.substrings:
+                if substring in url:
+                    matches.append((order, category))
+            result = max(matches)[1] if matches else None
+        self.memo[url] = result
+        return result
 
 
 class Parser:
     canteen_json = os.path.join(os.path.dirname(__file__), "canteenDict.json")
     meta_xslt = os.path.join(os.path.dirname(__file__), "../meta.xsl")
     price_pattern = re.compile(r'\d+,\d{2}')
+    # Parts of the menu page that parseMealsFS() and parseMealsSF() use
+    html_subtrees = ('#week-content', '.week_table', '#day-tabs')
     global_categories = {
         "https://cdn.inetmenue.de/media%2F00512471%2Fcdd3290ac929fba511b3d2f5497f4172560ece12.jpg": "*closed*",
         "*schneemann.gif": "*closed*",
@@ -52,7 +98,7 @@ class Parser:
         # This week
         url_parts = urllib.parse.urlsplit(
             self.canteens[ref]['source'], scheme="https")
-        resp = self._get_cached(url_parts.geturl())
+        resp = get_cached(url_parts.geturl())
         next_week_path = self.parseMeals(ref, builder, resp.text)
 
         # Next week
@@ -62,7 +108,7 @@ class Parser:
             url_parts[2] = next_week_path
             url = urllib.parse.urlunsplit(url_parts)
             if url != this_week_url:
-                resp = self._get_cached(url)
+                resp = get_cached(url)
                 logging.debug("This week url='%s'", this_week_url)
                 logging.debug("Next week url='%s'", url)
                 self.parseMeals(ref, builder, resp.text)
@@ -74,12 +120,15 @@ class Parser:
         return builder.toXMLFeed()
 
     def parseMeals(self, ref: str, builder: pyopenmensa.feed.LazyBuilder, html: str) -> str:
-        document = bs4.BeautifulSoup(html, "html.parser")
+        document = parse_html(html, 'inetmenue', self.html_subtrees)
         if document.find(id='week-content'):
             return self.parseMealsFS(ref, builder, document)
         elif document.find(class_='week_table'):
             return self.parseMealsSF(ref, builder, document)
-        elif document.find(class_='oops'):
+
+        # No menu, parse the whole page for the error message
+        document = parse_html(html, 'inetmenue')
+        if document.find(class_='oops'):
             oops = document.find(class_='oops')
             raise RuntimeError(oops.text.strip())
         elif document.select('.page_content h1'):
@@ -131,8 +180,7 @@ class Parser:
 
     def parseMealsFS(self, ref: str, builder: pyopenmensa.feed.LazyBuilder, document: bs4.BeautifulSoup) -> str:
         # parse http://{name}.inetmenue.de/fs/menu/week
-        predefined_categories = self.canteens[ref].get(
-            "categories", {}) | self.global_categories
+        categories = self.category_index(ref)
 
         category_prefix = ''
         category_index = 0
@@ -192,22 +240,14 @@ class Parser:
                             if not category_name:
                                 category_name = icon["title"].strip()
 
-                    elif day_div.select('.product .image') and day_div.select('.product .image')[0]['style']:
-                        category_img = day_div.select('.product .image')[
-                            0]['style'].split("url(")[1].split(")")[0]
-                        if category_img in predefined_categories:
-                            category_name = predefined_categories[category_img]
-                        else:
-                            for query in predefined_categories:
-                                if query.startswith("$") and category_img.endswith(query[1:]):
-                                    category_name = predefined_categories[query]
-                                if query.startswith("^") and category_img.startswith(query[1:]):
-                                    category_name = predefined_categories[query]
-                                if query.startswith("*") and query[1:] in category_img:
-                                    category_name = predefined_categories[query]
-                            if not category_name:
-                                logging.debug(
-                                    f"Unknown category image: {category_img}")
+                    elif (image := day_div.select_one('.product .image')) and image['style']:
+                        category_img = image['style'].split("url(")[1].split(")")[0]
+                        predefined = categories.resolve(category_img)
+                        if predefined is not None:
+                            category_name = predefined
+                        elif not category_name:
+                            logging.debug(
+                                f"Unknown category image: {category_img}")
 
                     if category_name == "*remove*":
                         continue
@@ -244,6 +284,15 @@ class Parser:
 
         return next_week_url
 
+    def category_index(self, ref):
+        """CategoryIndex of the canteen's and the global categories, shared by
+        all canteens with the same rules"""
+        rules = self.canteens[ref].get("categories", {}) | self.global_categories
+        key = tuple(rules.items())
+        if key not in self.category_indexes:
+            self.category_indexes[key] = CategoryIndex(rules)
+        return self.category_indexes[key]
+
     def meta(self, ref):
         """Generate an openmensa XML meta feed using XSLT"""
         if ref not in self.canteens:
@@ -274,23 +323,7 @@ class Parser:
             self.canteens = json.load(f)
 
         self.url_template = url_template
-        self.session = requests.Session()
-        self.session.headers = {
-            'User-Agent': f'{useragentname}/{__version__} ({useragentcomment}) {requests.utils.default_user_agent()}',
-            'Accept-Encoding': 'utf-8'
-        }
-        self._cache = []
-
-    def _get_cached(self, url):
-        for key, content in self._cache:
-            if key == url:
-                logging.debug("Retrieved from cache: %s", url)
-                return content
-        content = self.session.get(url)
-        self._cache.append((url, content))
-        if len(self._cache) > 20:
-            self._cache.pop(0)
-        return content
+        self.category_indexes = {}
 
     def json(self):
         tmp = {}
@@ -5,15 +5,15 @@ import json5
 import logging
 import urllib
 import re
-import requests
+import threading
 
 try:
-    from version import __version__, useragentname, useragentcomment
+    from fetch import get_cached, depends_on
     from util import StyledLazyBuilder, xml_escape, meta_from_xsl, xml_str_param
 except ModuleNotFoundError:
     include = os.path.relpath(os.path.join(os.path.dirname(__file__), '..'))
     sys.path.insert(0, include)
-    from version import __version__, useragentname, useragentcomment
+    from fetch import get_cached, depends_on
     from util import StyledLazyBuilder, xml_escape, meta_from_xsl, xml_str_param
 
 
@@ -22,56 +22,97 @@ class Parser:
     meta_xslt = os.path.join(os.path.dirname(__file__), "../meta.xsl")
     script_src_pattern = re.compile(r'<script src="([^"]+)"></script>')
     roles = ("student", "employee", "other")
+    menu_url = "https://www.studierendenwerk-kaiserslautern.de/fileadmin/templates/stw-kl/loadcsv/load_db_speiseplan.php?canteens=1&days=30"
+    default_price = ("5,55 €", "5,55 €", "5,55 €")
 
     def _load_prices(self):
         # Load prices
-        if self._price_relations is not None:
-            return
-
-        html = self._get_cached(
-            "https://www.studierendenwerk-kaiserslautern.de/de/essen/speiseplaene").text
+        if self._price_relations is None:
+            with self._prices_lock:
+                if self._price_relations is None:
+                    self._download_prices()
+                    return
+        # The feed still depends on the pages that the prices were loaded from
+        for url in self._price_sources:
+            depends_on(url)
+
+    def _download_prices(self):
+        """Find and parse the priceRelations variable. The results are
+        published when they are complete, _price_relations last"""
+        url = "https://www.studierendenwerk-kaiserslautern.de/de/essen/speiseplaene"
+        sources = [url]
+        # In case we can't find or parse the priceRelations variable, we use a default value to prevent reloading the prices every time
+        price_relations = {}
+        html = get_cached(url).text
         # Open all .js files that are listed in <script> tags to find the one that contains the priceRelations variable
         # At the time of writing the last <script> contains the priceRelations variable, therefore we iterate in reverse order
         for m in reversed(list(self.script_src_pattern.finditer(html))):
             url = f"https://www.studierendenwerk-kaiserslautern.de/{m.group(1)}"
-            js = self._get_cached(url).text
+            sources.append(url)
+            js = get_cached(url).text
             if "priceRelations =" in js:
                 try:
                     js_str = js.split("priceRelations =")[1].split("};")[0]
-                    self._price_relations = json5.loads(js_str + "}")
-                    return
+                    price_relations = json5.loads(js_str + "}")
                 except (IndexError, ValueError):
                     logging.exception("Failed to parse priceRelations")
-                    break
-        # In case we can't find or parse the priceRelations variable, we use a default value to prevent reloading the prices every time
-        self._price_relations = {}
-
-    def _get_price(self, meal):
-        self._load_prices()
-        p_key = meal["artgebname"]
-        for k, price in self._price_relations.items():
-            if k == p_key:
-                if 'price' in price:
-                    return (price['price'], price['price'], price['price'])
-                if 'stu' in price and 'bed' in price and 'gas' in price:
-                    return (price['stu'], price['bed'], price['gas'])
-                if 'stu' in price:
-                    return (price['stu'], price['stu'], price['stu'])
-        return ("5,55 €", "5,55 €", "5,55 €")
+                break
+
+        self._price_sources = sources
+        self._prices = self._price_table(price_relations)
+        self._price_relations = price_relations
+
+    @staticmethod
+    def _price_table(price_relations):
+        """{artgebname: (student, employee, other)} from the priceRelations variable"""
+        prices = {}
+        for k, price in price_relations.items():
+            if 'price' in price:
+                prices[k] = (price['price'], price['price'], price['price'])
+            elif 'stu' in price and 'bed' in price and 'gas' in price:
+                prices[k] = (price['stu'], price['bed'], price['gas'])
+            elif 'stu' in price:
+                prices[k] = (price['stu'], price['stu'], price['stu'])
+        return prices
+
+    def clear_cache(self):
+        """Load the prices again in the next run"""
+        with self._prices_lock:
+            self._price_relations = None
+            self._prices = {}
+            self._price_sources = []
 
     def feed(self, ref: str) -> str:
         if ref not in self.canteens:
             return f"Unkown canteen with ref='{xml_escape(ref)}'"
+        return self._build(ref).toXMLFeed()
 
-        builder = StyledLazyBuilder()
-
-        resp = self._get_cached(
-            "https://www.studierendenwerk-kaiserslautern.de/fileadmin/templates/stw-kl/loadcsv/load_db_speiseplan.php?canteens=1&days=30")
+    def write_feed(self, ref: str, fileobj):
+        if ref not in self.canteens:
+            fileobj.write(f"Unkown canteen with ref='{xml_escape(ref)}'")
+            return
+        self._build(ref).writeXMLFeed(fileobj)
 
+    def _build(self, ref: str) -> StyledLazyBuilder:
+        builder = StyledLazyBuilder()
+        meals = self._meals_by_canteen().get(self.canteens[ref]["dportname"])
+        if meals:
+            self._load_prices()
+        for date, category, name, notes, price_key in meals or []:
+            builder.addMeal(date, category, name, list(notes), self._prices.get(price_key, self.default_price),
+                            self.roles)
+        return builder
+
+    def _meals_by_canteen(self) -> dict:
+        """{dportname: [(date, category, name, notes, artgebname), ...]}, the menu of all canteens
+        decoded and grouped once per downloaded response"""
+        resp = get_cached(self.menu_url)
+        grouped = self._grouped
+        if grouped is not None and grouped[0] is resp:
+            return grouped[1]
+
+        meals_by_canteen = {}
         for meal in resp.json():
-            if meal["dportname"] != self.canteens[ref]["dportname"]:
-                continue
-
             category = meal["artname1"] or meal["dpartname"]
 
             name_key = "atextohnezsz%d"
@@ -89,12 +130,11 @@ class Parser:
             notes.append(meal.get("frei2", None))
             notes.append(meal.get("frei3", None))
 
-            prices = self._get_price(meal)
+            meals_by_canteen.setdefault(meal["dportname"], []).append(
+                (meal["proddatum"], category, name, [note for note in notes if note], meal["artgebname"]))
 
-            builder.addMeal(meal["proddatum"], category, name, [
-                            note for note in notes if note], prices, self.roles)
-
-        return builder.toXMLFeed()
+        self._grouped = (resp, meals_by_canteen)
+        return meals_by_canteen
 
     def meta(self, ref):
         """Generate an openmensa XML meta feed using XSLT"""
@@ -125,24 +165,11 @@ class Parser:
             self.canteens = json.load(f)
 
         self.url_template = url_template
-        self.session = requests.Session()
-        self.session.headers = {
-            'User-Agent': f'{useragentname}/{__version__} ({useragentcomment}) {requests.utils.default_user_agent()}',
-            'Accept-Encoding': 'utf-8'
-        }
-        self._cache = []
         self._price_relations = None
-
-    def _get_cached(self, url):
-        for key, content in self._cache:
-            if key == url:
-                logging.debug("Retrieved from cache: %s", url)
-                return content
-        content = self.session.get(url)
-        self._cache.append((url, content))
-        if len(self._cache) > 20:
-            self._cache.pop(0)
-        return content
+        self._prices = {}
+        self._price_sources = []
+        self._prices_lock = threading.Lock()
+        self._grouped = None
 
     def json(self):
         tmp = {}
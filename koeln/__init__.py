@@ -1,15 +1,17 @@
 import datetime as dt
 import os
 import json
+import time
 import urllib
 import logging
-from threading import Lock
+from threading import Lock, Thread
 import string
 import re
 
-from requests import RequestException
+from requests import HTTPError, RequestException
 
 try:
+    from fetch import load_state, save_state
     from util import StyledLazyBuilder, meta_from_xsl, now_local, xml_str_param
     from koeln.cloudmensa import (
         get_organization_data,
@@ -26,6 +28,7 @@ except ModuleNotFoundError:
 
     include = os.path.relpath(os.path.join(os.path.dirname(__file__), ".."))
     sys.path.insert(0, include)
+    from fetch import load_state, save_state
     from util import StyledLazyBuilder, meta_from_xsl, now_local, xml_str_param
     from cloudmensa import (
         get_organization_data,
@@ -42,14 +45,20 @@ metaJson = os.path.join(os.path.dirname(__file__), "koeln.json")
 
 metaTemplateFile = os.path.join(os.path.dirname(__file__), "metaTemplate_koeln.xml")
 
-
-with open(metaJson, "r", encoding="utf8") as meta_file:
-    canteenDict = json.load(meta_file)
-
 sourceUrl = "https://www.kstw.de/speiseplan"
 
 weekSpanDays = 14
 
+# Downloaded menus are reused for this many seconds, also by the next run if
+# a cache directory is set, see fetch.set_cache_dir()
+menuCacheTtl = 6 * 60 * 60
+
+# The API configuration from the CloudMensa website is stored in the cache
+# directory and refreshed in the background when it is older than this
+apiConfigTtl = 24 * 60 * 60
+# After a failed discovery the website is not asked again for this many seconds
+apiConfigRetryInterval = 60 * 60
+
 genericNames = {
     "beilage",
     "dessert",
@@ -74,10 +83,18 @@ defaultFoodIconLabels = {
 allAllergens = {}
 
 _apiConfigLock = Lock()
+_apiConfigRefreshLock = Lock()
 _apiConfigCache = None
+_apiConfigFetched = 0
+_apiConfigAttempted = 0
+_apiConfigRefreshing = False
 
 _menuDataLock = Lock()
-_menuDataCache = {}
+_menuWindows = []
+_menuWindowsLoaded = False
+_menuSlices = {}
+
+_routingIndexCache = {}
 
 
 def _normalize_text(value):
@@ -258,74 +275,215 @@ def _get_food_icon_labels(settings):
     return labels
 
 
-def _get_api_config():
-    global _apiConfigCache
+def _discover_api_config():
+    """API configuration from the CloudMensa website, None if that failed"""
+    try:
+        org = get_organization_data("kstw")
+    except (RequestException, RuntimeError, ValueError) as exc:
+        logging.warning("Failed to refresh CloudMensa API metadata: %s", exc)
+        return None
 
-    if _apiConfigCache is not None:
-        return _apiConfigCache
+    settings = org.get("settings") if isinstance(org, dict) else {}
+    config = {
+        "api_key": org.get("api_key"),
+        "organization_id": org.get("organization_id"),
+        "dedup_fields": list(DEFAULT_DEDUP_FIELDS),
+        "food_icon_labels": dict(defaultFoodIconLabels),
+    }
+    if settings:
+        config["dedup_fields"] = (
+            settings.get("public_menu_dedup_custom_fields") or config["dedup_fields"]
+        )
+        config["food_icon_labels"] = _get_food_icon_labels(settings)
+    return config
+
+
+def _effective_api_config(discovered):
+    """The environment variables take precedence over the discovered configuration"""
+    discovered = discovered or {}
+    return {
+        "api_key": os.environ.get("KOELN_SUPABASE_API_KEY")
+        or discovered.get("api_key")
+        or DEFAULT_API_KEY,
+        "organization_id": os.environ.get("KOELN_ORGANIZATION_ID")
+        or discovered.get("organization_id")
+        or DEFAULT_ORGANIZATION_ID,
+        "dedup_fields": discovered.get("dedup_fields") or list(DEFAULT_DEDUP_FIELDS),
+        "food_icon_labels": discovered.get("food_icon_labels")
+        or dict(defaultFoodIconLabels),
+    }
+
+
+def _api_config_backoff(now):
+    """True if the last discovery failed less than apiConfigRetryInterval ago"""
+    return _apiConfigAttempted > _apiConfigFetched and now - _apiConfigAttempted < apiConfigRetryInterval
+
+
+def _refresh_api_config(ifMissing=False):
+    """Discover the API configuration again and store it, keeps the current one on failure"""
+    global _apiConfigCache, _apiConfigFetched, _apiConfigAttempted, _apiConfigRefreshing
+    with _apiConfigRefreshLock:
+        if ifMissing and _apiConfigCache is not None:
+            return _apiConfigCache
+        try:
+            attempted = time.time()
+            discovered = _discover_api_config()
+            with _apiConfigLock:
+                _apiConfigAttempted = attempted
+                if discovered is not None:
+                    _apiConfigFetched = attempted
+                    save_state("koeln_api_config", {"fetched": _apiConfigFetched, "config": discovered})
+                    _apiConfigCache = _effective_api_config(discovered)
+                elif _apiConfigCache is None:
+                    _apiConfigCache = _effective_api_config(None)
+                return _apiConfigCache
+        finally:
+            _apiConfigRefreshing = False
+
+
+def _get_api_config(refresh=False):
+    """The CloudMensa API configuration. It is discovered on the website once,
+    then reused from the cache directory and refreshed in the background after
+    apiConfigTtl. With `refresh`, e.g. after an authentication error, it is
+    discovered again before returning."""
+    global _apiConfigCache, _apiConfigFetched, _apiConfigRefreshing
+
+    if refresh:
+        with _apiConfigLock:
+            if _apiConfigCache is not None and _api_config_backoff(time.time()):
+                return _apiConfigCache
+        return _refresh_api_config()
 
     with _apiConfigLock:
+        if _apiConfigCache is None:
+            stored = load_state("koeln_api_config")
+            if stored and stored.get("config"):
+                _apiConfigCache = _effective_api_config(stored["config"])
+                _apiConfigFetched = stored.get("fetched", 0)
+
         if _apiConfigCache is not None:
+            now = time.time()
+            if now - _apiConfigFetched >= apiConfigTtl and not _api_config_backoff(now) and not _apiConfigRefreshing:
+                _apiConfigRefreshing = True
+                Thread(target=_refresh_api_config, name="koeln-api-config", daemon=True).start()
             return _apiConfigCache
 
-        apiKey = os.environ.get("KOELN_SUPABASE_API_KEY")
-        organizationId = os.environ.get("KOELN_ORGANIZATION_ID")
-        dedupFields = list(DEFAULT_DEDUP_FIELDS)
-        foodIconLabels = dict(defaultFoodIconLabels)
+    return _refresh_api_config(ifMissing=True)
+
 
+def _fetch_week_menu(startDate, endDate):
+    """(menuData, cfg) from fetch_week_menu() with the current API configuration.
+    After an authentication error the configuration is discovered again and the
+    request is repeated once."""
+    cfg = _get_api_config()
+    for attempt in range(2):
         try:
-            org = get_organization_data("kstw")
-            settings = org.get("settings") if isinstance(org, dict) else {}
-
-            apiKey = apiKey or org.get("api_key")
-            organizationId = organizationId or org.get("organization_id")
-
-            if settings:
-                dedupFields = (
-                    settings.get("public_menu_dedup_custom_fields") or dedupFields
-                )
-                foodIconLabels = _get_food_icon_labels(settings)
-        except (RequestException, RuntimeError, ValueError) as exc:
-            logging.warning("Failed to refresh CloudMensa API metadata: %s", exc)
-
-        _apiConfigCache = {
-            "api_key": apiKey or DEFAULT_API_KEY,
-            "organization_id": organizationId or DEFAULT_ORGANIZATION_ID,
-            "dedup_fields": dedupFields,
-            "food_icon_labels": foodIconLabels,
-        }
-        return _apiConfigCache
+            return cfg, fetch_week_menu(
+                start_date=startDate,
+                end_date=endDate,
+                api_key=cfg["api_key"],
+                organization_id=cfg["organization_id"],
+                dedup_fields=cfg["dedup_fields"],
+            )
+        except HTTPError as exc:
+            if attempt or exc.response is None or exc.response.status_code not in (401, 403):
+                raise
+            logging.warning("CloudMensa API returned %d, refreshing the API configuration",
+                            exc.response.status_code)
+            cfg = _get_api_config(refresh=True)
+
+
+def _load_menu_windows():
+    """Load the menus of an earlier run once, call with _menuDataLock held"""
+    global _menuWindowsLoaded
+    if _menuWindowsLoaded:
+        return
+    _menuWindowsLoaded = True
+    for window in load_state("koeln_menu", []):
+        if time.time() - window.get("fetched", 0) < menuCacheTtl:
+            build_allergens(window["menu"], allAllergens)
+            _menuWindows.append(window)
+
+
+def _find_menu_window(cfg, startDate, endDate):
+    """The newest fresh window that covers startDate to endDate, call with _menuDataLock held"""
+    now = time.time()
+    for window in reversed(_menuWindows):
+        if (
+            window["organization_id"] == cfg["organization_id"]
+            and window["dedup_fields"] == list(cfg["dedup_fields"] or [])
+            and window["start"] <= startDate.isoformat()
+            and window["end"] >= endDate.isoformat()
+            and now - window["fetched"] < menuCacheTtl
+        ):
+            return window
+    return None
+
+
+def _menu_slice(window, startDate, endDate):
+    """The days from startDate to endDate of a cached window. The same list
+    is returned for the same range, so the routing index is reused."""
+    if window["start"] == startDate.isoformat() and window["end"] == endDate.isoformat():
+        return window["menu"]
+    key = (id(window["menu"]), startDate.isoformat(), endDate.isoformat())
+    with _menuDataLock:
+        cached = _menuSlices.get(key)
+        if cached is not None and cached[0] is window["menu"]:
+            return cached[1]
+        days = [
+            day
+            for day in window["menu"]
+            if startDate.isoformat() <= str(day.get("date") or "").strip() <= endDate.isoformat()
+        ]
+        _menuSlices[key] = (window["menu"], days)
+        return days
 
 
 def _get_week_menu_data(startDate, endDate):
+    """Menu from startDate to endDate. Ranges within a fresh, already downloaded
+    window are answered from it. Otherwise the two weeks from the Monday of
+    startDate (or more, if the range is longer) are downloaded."""
     cfg = _get_api_config()
-    cacheKey = (
-        startDate.isoformat(),
-        endDate.isoformat(),
-        cfg["organization_id"],
-        tuple(cfg["dedup_fields"] or []),
-    )
 
     with _menuDataLock:
-        if cacheKey in _menuDataCache:
-            return _menuDataCache[cacheKey]
-
-    menuData = fetch_week_menu(
-        start_date=startDate,
-        end_date=endDate,
-        api_key=cfg["api_key"],
-        organization_id=cfg["organization_id"],
-        dedup_fields=cfg["dedup_fields"],
-    )
+        _load_menu_windows()
+        window = _find_menu_window(cfg, startDate, endDate)
+    if window is not None:
+        return _menu_slice(window, startDate, endDate)
+
+    fetchStart = min(startDate, monday_for(startDate))
+    fetchEnd = max(endDate, fetchStart + dt.timedelta(days=weekSpanDays - 1))
+    fetched = time.time()
+    cfg, menuData = _fetch_week_menu(fetchStart, fetchEnd)
 
     # Allergens explanation mapping is not present for all dishes
     # So we build a global mapping for the week to be able to fill
     # in missing explanations later when processing individual dishes
     build_allergens(menuData, allAllergens)
 
+    window = {
+        "organization_id": cfg["organization_id"],
+        "dedup_fields": list(cfg["dedup_fields"] or []),
+        "start": fetchStart.isoformat(),
+        "end": fetchEnd.isoformat(),
+        "fetched": fetched,
+        "menu": menuData,
+    }
     with _menuDataLock:
-        _menuDataCache[cacheKey] = menuData
-    return menuData
+        # Keep the fresh windows that the new one doesn't cover
+        _menuWindows[:] = [
+            other
+            for other in _menuWindows
+            if fetched - other["fetched"] < menuCacheTtl
+            and not (
+                other["organization_id"] == window["organization_id"]
+                and other["dedup_fields"] == window["dedup_fields"]
+                and window["start"] <= other["start"]
+                and other["end"] <= window["end"]
+            )
+        ] + [window]
+        save_state("koeln_menu", _menuWindows)
+    return _menu_slice(window, startDate, endDate)
 
 
 def _canteen_screen_set(c):
@@ -344,51 +502,70 @@ def _dish_screen_set(d, customFields):
     return s
 
 
-def _dish_matches_canteen(dish, canteen, customFields=None, outName=None):
-    """Return True if `dish` should be assigned to `canteen`.
+def _routing_index(menuData, canteens):
+    """Assign every dish in `menuData` to its canteens in a single pass.
 
-    This mirrors the matching logic used by `_add_dish` but is kept
-    side-effect free so callers can test assignment without building
-    meals.
+    The ort_id of a dish is authoritative: it only matches canteens with the
+    same ort_id. Dishes without ort_id are matched by their screen locations.
+    Dishes without a meal name are not assigned to any canteen. Returns
+    {"occurrences": [(date, index, dish, customFields, mealName, [canteen keys])],
+    "byCanteen": {canteen key: [(date, dish, customFields, mealName)]}}.
+    The index is built once for each `menuData` list.
     """
-    if customFields is None:
-        customFields = custom_fields_to_dict(dish.get("custom_fields"))
-
-    # Match dishes to canteens using ort_id primarily; fall back to screen locations.
-    dishOrtId = str(customFields.get("ort_id") or "").strip()
-    canteenOrdId = str(canteen.get("ort_id") or "").strip()
-
-    # If the dish provides an ort_id consider it authoritative: only match
-    # canteens that have the same ort_id. This prevents matching to canteens
-    # that lack an ort_id (but might share similar screen names)
-    if dishOrtId:
-        if canteenOrdId != dishOrtId:
-            return False
-    else:
-        # Fallback: match dish screen locations
-        canteen_screens = _canteen_screen_set(canteen)
-        dish_screens = _dish_screen_set(dish, customFields)
-        if not (canteen_screens and dish_screens and (canteen_screens & dish_screens)):
-            return False
-
-    mealName = _pick_meal_name(dish, customFields)
-    if outName is not None:
-        outName.append(mealName)
-    if not mealName:
-        return False
-
-    return True
-
-
-def _add_dish(builder, dateValue, canteen, dish):
-    customFields = custom_fields_to_dict(dish.get("custom_fields"))
-    outName = []
-    # Use the predicate to determine whether this dish belongs to the canteen
-    if not _dish_matches_canteen(dish, canteen, customFields, outName):
-        return False
+    cacheKey = (id(menuData), id(canteens))
+    with _menuDataLock:
+        cached = _routingIndexCache.get(cacheKey)
+    if cached is not None and cached[0] is menuData and cached[1] is canteens:
+        return cached[2]
+
+    byOrtId = {}
+    byScreen = {}
+    for canteenKey, canteen in canteens.items():
+        ortId = str(canteen.get("ort_id") or "").strip()
+        if ortId:
+            byOrtId.setdefault(ortId, []).append(canteenKey)
+        for screen in _canteen_screen_set(canteen):
+            byScreen.setdefault(screen, []).append(canteenKey)
+    canteenOrder = {canteenKey: i for i, canteenKey in enumerate(canteens)}
+
+    occurrences = []
+    byCanteen = {canteenKey: [] for canteenKey in canteens}
+    for day in menuData:
+        dayDate = str(day.get("date") or "").strip()
+        for idx, dish in enumerate(day.get("dishes", [])):
+            customFields = None
+            mealName = None
+            canteenKeys = []
+            try:
+                customFields = custom_fields_to_dict(dish.get("custom_fields"))
+                dishOrtId = str(customFields.get("ort_id") or "").strip()
+                if dishOrtId:
+                    canteenKeys = byOrtId.get(dishOrtId, [])
+                else:
+                    matched = set()
+                    for screen in _dish_screen_set(dish, customFields):
+                        matched.update(byScreen.get(screen, ()))
+                    canteenKeys = sorted(matched, key=canteenOrder.get)
+                if canteenKeys:
+                    mealName = _pick_meal_name(dish, customFields)
+                    if not mealName:
+                        canteenKeys = []
+            except Exception:
+                logging.exception("Error routing dish %s on %s", dish.get("id"), dayDate)
+                canteenKeys = []
+
+            occurrences.append((dayDate, idx, dish, customFields, mealName, list(canteenKeys)))
+            for canteenKey in canteenKeys:
+                byCanteen[canteenKey].append((dayDate, dish, customFields, mealName))
+
+    index = {"occurrences": occurrences, "byCanteen": byCanteen}
+    with _menuDataLock:
+        _routingIndexCache[cacheKey] = (menuData, canteens, index)
+    return index
 
-    mealName = outName[0]
 
+def _add_dish(builder, dateValue, dish, customFields, mealName):
+    """Add a dish that `_routing_index` assigned to the canteen of `builder`"""
     category = _normalize_category(
         menuType=customFields.get("menu_type") or dish.get("category"),
         dishInfo=customFields.get("dish_info"),
@@ -453,10 +630,9 @@ def _add_dish(builder, dateValue, canteen, dish):
         prices if prices else None,
         roles if roles else None,
     )
-    return True
 
 
-def _parse_menu(builder, canteen, days=None):
+def _parse_menu(builder, canteens, ref, days=None):
     today = now_local().date()
     if days is None:
         # Two week range similar to website
@@ -471,20 +647,12 @@ def _parse_menu(builder, canteen, days=None):
     hasMealsByDate = set()
     lastDateWithMeals = None
 
-    for day in menuData:
-        dayDate = str(day.get("date") or "").strip()
+    for dayDate, dish, customFields, mealName in _routing_index(menuData, canteens)["byCanteen"][ref]:
         if not dayDate:
             continue
-
-        addedForDate = False
-        for dish in day.get("dishes", []):
-            if _add_dish(builder, dayDate, canteen, dish):
-                addedForDate = True
-
-        if addedForDate:
-            lastDateWithMeals = dayDate
-            if dayDate:
-                hasMealsByDate.add(dayDate)
+        _add_dish(builder, dayDate, dish, customFields, mealName)
+        lastDateWithMeals = dayDate
+        hasMealsByDate.add(dayDate)
 
     # mark days without meals as closed until the last date with meals
     # don't mark days after the last date with meals as closed
@@ -503,7 +671,16 @@ class Parser:
     def __init__(self, urlTemplate):
         self.urlTemplate = urlTemplate
         self.meta_xslt = os.path.join(os.path.dirname(__file__), "../meta.xsl")
-        self.canteens = {key: dict(value) for key, value in canteenDict.items()}
+        with open(metaJson, "r", encoding="utf8") as f:
+            self.canteens = json.load(f)
+
+    def clear_cache(self):
+        """Fetch the menus again in the next run, unless they are younger than menuCacheTtl"""
+        with _menuDataLock:
+            now = time.time()
+            _menuWindows[:] = [window for window in _menuWindows if now - window["fetched"] < menuCacheTtl]
+            _menuSlices.clear()
+            _routingIndexCache.clear()
 
     def verify_menu_usage(self, menuData):
         """Verify which canteens would consume each dish in `menuData`.
@@ -512,23 +689,12 @@ class Parser:
         `menuData` should be the list of day dicts returned by `fetch_week_menu`.
         """
         usage = {}
-        for day in menuData:
-            for dish in day.get("dishes", []):
-                dish_id = dish.get("id") or dish.get("dish_id")
-                if dish_id is None:
-                    # skip unidentifiable
-                    continue
-                usage.setdefault(dish_id, [])
-                for canteen_key, canteen in self.canteens.items():
-                    try:
-                        if _dish_matches_canteen(dish, canteen):
-                            usage[dish_id].append(canteen_key)
-                    except Exception:
-                        logging.exception(
-                            "Error matching dish %s against canteen %s",
-                            dish_id,
-                            canteen_key,
-                        )
+        for _, _, dish, _, _, canteenKeys in _routing_index(menuData, self.canteens)["occurrences"]:
+            dish_id = dish.get("id") or dish.get("dish_id")
+            if dish_id is None:
+                # skip unidentifiable
+                continue
+            usage.setdefault(dish_id, []).extend(canteenKeys)
         return usage
 
     def json(self):
@@ -560,21 +726,32 @@ class Parser:
 
         return meta_from_xsl(self.meta_xslt, data)
 
+    def _build(self, ref, **kwargs):
+        lazyBuilder = StyledLazyBuilder()
+        _parse_menu(lazyBuilder, self.canteens, ref, **kwargs)
+        return lazyBuilder
+
     def feed_all(self, ref):
         if ref not in self.canteens:
             return "Unknown canteen"
-        mensa = self.canteens[ref]
-        lazyBuilder = StyledLazyBuilder()
-        _parse_menu(lazyBuilder, mensa)
-        return lazyBuilder.toXMLFeed()
+        return self._build(ref).toXMLFeed()
+
+    def write_feed_all(self, ref, fileobj):
+        if ref not in self.canteens:
+            fileobj.write("Unknown canteen")
+            return
+        self._build(ref).writeXMLFeed(fileobj)
 
     def feed_today(self, ref):
         if ref not in self.canteens:
             return "Unknown canteen"
-        mensa = self.canteens[ref]
-        lazyBuilder = StyledLazyBuilder()
-        _parse_menu(lazyBuilder, mensa, days=1)  # today and tomorrow
-        return lazyBuilder.toXMLFeed()
+        return self._build(ref, days=1).toXMLFeed()  # today and tomorrow
+
+    def write_feed_today(self, ref, fileobj):
+        if ref not in self.canteens:
+            fileobj.write("Unknown canteen")
+            return
+        self._build(ref, days=1).writeXMLFeed(fileobj)
 
 
 if __name__ == "__main__":
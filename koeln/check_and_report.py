@@ -21,12 +21,12 @@ import requests
 
 # Try importing koeln helpers
 try:
-    from koeln import Parser, _get_week_menu_data, monday_for, now_local, weekSpanDays, _dish_matches_canteen
+    from koeln import Parser, _get_week_menu_data, monday_for, now_local, weekSpanDays, _routing_index
 except Exception:
     here = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
     if here not in sys.path:
         sys.path.insert(0, here)
-    from koeln import Parser, _get_week_menu_data, monday_for, now_local, weekSpanDays, _dish_matches_canteen  # type: ignore
+    from koeln import Parser, _get_week_menu_data, monday_for, now_local, weekSpanDays, _routing_index  # type: ignore
 
 
 ISSUE_TITLE = "Köln parser: unused or duplicated dishes found"
@@ -44,22 +44,10 @@ def build_occurrence_index(menuData) -> Dict[str, Tuple[str, int, dict]]:
 
 
 def build_usage(menuData, parser: Parser) -> Dict[str, List[str]]:
-    occurrences = []
-    for day in menuData:
-        dayDate = str(day.get("date") or "").strip()
-        for idx, dish in enumerate(day.get("dishes", [])):
-            occ_id = f"{dayDate}::{idx}::{dish.get('id') or ''}"
-            occurrences.append((occ_id, dayDate, dish))
-
     usage: Dict[str, List[str]] = {}
-    for occ_id, dayDate, dish in occurrences:
-        usage.setdefault(occ_id, [])
-        for canteen_key, canteen in parser.canteens.items():
-            try:
-                if _dish_matches_canteen(dish, canteen):
-                    usage[occ_id].append(canteen_key)
-            except Exception:
-                logging.exception("Error matching occurrence %s", occ_id)
+    for dayDate, idx, dish, _, _, canteenKeys in _routing_index(menuData, parser.canteens)["occurrences"]:
+        occ_id = f"{dayDate}::{idx}::{dish.get('id') or ''}"
+        usage.setdefault(occ_id, []).extend(canteenKeys)
     return usage
 
 
@@ -7,7 +7,15 @@ and fetch the weekly menu JSON.
 import os
 import re
 import datetime as dt
-import requests
+
+try:
+    from fetch import get, post
+except ModuleNotFoundError:
+    import sys
+
+    include = os.path.relpath(os.path.join(os.path.dirname(__file__), ".."))
+    sys.path.insert(0, include)
+    from fetch import get, post
 
 WEBSITE_BASE = "https://app.cloudmensa.io/"
 API_URL = "https://axxiebkvmfjmiaanviob.supabase.co/rest/v1/rpc/public_get_week_menu"
@@ -20,7 +28,7 @@ DEFAULT_DEDUP_FIELDS = ["name_de", "location", "ort_id", ""]
 
 
 def _safe_request(url, timeout=10):
-    response = requests.get(url, timeout=timeout)
+    response = get(url, timeout=timeout)
     response.raise_for_status()
     return response
 
@@ -65,7 +73,7 @@ def get_organization_data(slug):
     }
     payload = {"p_slug": slug}
 
-    rpc_response = requests.post(rpc_endpoint, headers=headers, json=payload, timeout=10)
+    rpc_response = post(rpc_endpoint, headers=headers, json=payload, timeout=10)
     rpc_response.raise_for_status()
     org_data = rpc_response.json()
 
@@ -130,7 +138,7 @@ def fetch_week_menu(
     if dedup_fields is not None:
         payload["p_dedup_fields"] = dedup_fields
 
-    response = requests.post(API_URL, headers=headers, json=payload, timeout=timeout)
+    response = post(API_URL, headers=headers, json=payload, timeout=timeout)
     response.raise_for_status()
     return response.json()
 
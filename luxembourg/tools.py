@@ -1,6 +1,7 @@
 import os
 import re
 import time
+import asyncio
 import datetime
 import logging
 import textwrap
@@ -8,33 +9,40 @@ from collections.abc import Iterable
 
 import requests
 import bs4
-from bs4 import BeautifulSoup
 
 try:
-    from version import __version__, useragentname, useragentcomment
-    from util import StyledLazyBuilder, now_local
+    from fetch import session, run_async
+    from util import StyledLazyBuilder, now_local, parse_html
 except ModuleNotFoundError:
     import sys
     include = os.path.relpath(os.path.join(os.path.dirname(__file__), '..'))
     sys.path.insert(0, include)
-    from version import __version__, useragentname, useragentcomment
-    from util import xml_escape, StyledLazyBuilder, now_local
+    from fetch import session, run_async
+    from util import xml_escape, StyledLazyBuilder, now_local, parse_html
 
 __all__ = ['getMenu', 'askRestopolis']
 
 url = "https://ssl.education.lu/eRestauration/CustomerServices/Menu"
-s = requests.Session()
+_sessionReady = False
+
+
+def restopolisSession():
+    """The pooled session with the language and allergen settings of Restopolis,
+    configured on first use instead of at import"""
+    global _sessionReady
+    s = session(url)
+    if not _sessionReady:
+        s.headers.update({
+            'Accept-Language': 'fr-LU,fr,lb-LU,lb,de-LU,de,en',
+            'Accept-Encoding': 'utf-8'
+        })
+        requests.utils.add_dict_to_cookiejar(s.cookies, {
+            ".AspNetCore.Culture":  "c=fr|uic=fr",
+            "CustomerServices.Restopolis.DisplayAllergens": "True"
+        })
+        _sessionReady = True
+    return s
 
-s.headers = {
-    'User-Agent': f'{useragentname}/{__version__} ({useragentcomment}) {requests.utils.default_user_agent()}',
-    'Accept-Language': 'fr-LU,fr,lb-LU,lb,de-LU,de,en',
-    'Accept-Encoding': 'utf-8'
-}
-
-requests.utils.add_dict_to_cookiejar(s.cookies, {
-    ".AspNetCore.Culture":  "c=fr|uic=fr",
-    "CustomerServices.Restopolis.DisplayAllergens": "True"
-})
 
 allergens = {
     1: "Céréales contenant du gluten et produits à base de ces céréales",
@@ -92,7 +100,7 @@ def askRestopolis(restaurant=None, service=None, date=None):
         cookies["CustomerServices.Restopolis.SelectedDate"] = date.strftime(
             "%d.%m.%Y")
 
-    r = s.get(url, cookies=cookies, timeout=10.0)
+    r = restopolisSession().get(url, cookies=cookies, timeout=10.0)
 
     r.duration = time.time() - startTime
     return r
@@ -134,11 +142,22 @@ def getMenu(restaurantId, datetimeDay=None, serviceIds=None):
     repeat = len(serviceIds) == 1
     repeatCounter = 0
     mealCounterLast = mealCounter
-    for service in serviceIds:
+
+    # Request all services at once, only a single service is repeated for the next weeks
+    prefetched = []
+    if len(serviceIds) > 1:
+        prefetched = run_async(*(asyncio.to_thread(askRestopolis, restaurant=restaurantId,
+                                                   service=service[0], date=datetimeDay)
+                                 for service in serviceIds))
+
+    for index, service in enumerate(serviceIds):
         serviceSuffix = f"({service[1]})" if service[1] and len(
             serviceIds) > 1 else ""
-        r = askRestopolis(restaurant=restaurantId,
-                          service=service[0], date=datetimeDay)
+        if index < len(prefetched):
+            r = prefetched[index]
+        else:
+            r = askRestopolis(restaurant=restaurantId,
+                              service=service[0], date=datetimeDay)
         if r.status_code != 200:
             status = f'Could not open restopolis Error{r.status_code}'
             if 'status' in r.headers:
@@ -153,7 +172,8 @@ def getMenu(restaurantId, datetimeDay=None, serviceIds=None):
                 f"Restaurant [id={restaurantId}, service={service}]: No HTML in response body: `{r.text}`")
             break
 
-        document = BeautifulSoup(r.text, "html.parser")
+        document = parse_html(r.text, 'luxembourg', ('.daily-menu', '.date-selector-desktop',
+                                                     '.date-selector-mobile-indicator', '#date-selector'))
 
         # Extract available dates from date selector
         dateSelector = document.find("div", {"class": "date-selector-desktop"})
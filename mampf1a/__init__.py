@@ -6,18 +6,16 @@ import urllib
 import re
 import textwrap
 
-import requests
 import bs4
-from bs4 import BeautifulSoup
 
 try:
-    from version import __version__, useragentname, useragentcomment
-    from util import StyledLazyBuilder, now_local, xml_escape, weekdays_map
+    from fetch import get_cached
+    from util import StyledLazyBuilder, now_local, xml_escape, weekdays_map, parse_html
 except ModuleNotFoundError:
     include = os.path.relpath(os.path.join(os.path.dirname(__file__), '..'))
     sys.path.insert(0, include)
-    from version import __version__, useragentname, useragentcomment
-    from util import StyledLazyBuilder, now_local, xml_escape, weekdays_map
+    from fetch import get_cached
+    from util import StyledLazyBuilder, now_local, xml_escape, weekdays_map, parse_html
 
 metaJson = os.path.join(os.path.dirname(__file__), "canteenDict.json")
 
@@ -59,8 +57,8 @@ class Parser:
 
         lazyBuilder = StyledLazyBuilder()
 
-        r = self._get_cached(url)
-        document = BeautifulSoup(r.text, "html.parser")
+        r = get_cached(url)
+        document = parse_html(r.text, 'mampf1a', ('table.std', 'div[style="padding-bottom: 8px;"]', 'title'))
 
         # Generate legend (unique for each canteen)
         legend = {}
@@ -168,8 +166,8 @@ class Parser:
         trs = document.select('table.std>tr')
         if not trs:
             logging.warning("No tr found")
-            if document.select('head title'):
-                logging.debug("Title: %s", document.select('head title')[0].text)
+            if document.title:
+                logging.debug("Title: %s", document.title.text)
             return
 
         categories = [td.text.strip()
@@ -296,23 +294,6 @@ class Parser:
             self.canteens = json.load(f)
 
         self.urlTemplate = urlTemplate
-        self.session = requests.Session()
-        self.session.headers = {
-            'User-Agent': f'{useragentname}/{__version__} ({useragentcomment}) {requests.utils.default_user_agent()}',
-            'Accept-Encoding': 'utf-8'
-        }
-        self._cache = []
-
-    def _get_cached(self, url):
-        for key, content in self._cache:
-            if key == url:
-                logging.debug("Retrieved from cache: %s", url)
-                return content
-        content = self.session.get(url)
-        self._cache.append((url, content))
-        if len(self._cache) > 30:
-            self._cache.pop(0)
-        return content
 
     def json(self):
         tmp = {}
@@ -7,17 +7,14 @@ import re
 import textwrap
 import datetime
 
-import requests
-from bs4 import BeautifulSoup
-
 try:
-    from version import __version__
-    from util import StyledLazyBuilder, now_local, weekdays_map, xml_escape
+    from fetch import get
+    from util import StyledLazyBuilder, now_local, weekdays_map, xml_escape, parse_html
 except ModuleNotFoundError:
     include = os.path.relpath(os.path.join(os.path.dirname(__file__), '..'))
     sys.path.insert(0, include)
-    from version import __version__, useragentname, useragentcomment
-    from util import StyledLazyBuilder, now_local, weekdays_map, xml_escape
+    from fetch import get
+    from util import StyledLazyBuilder, now_local, weekdays_map, xml_escape, parse_html
 
 metaJson = os.path.join(os.path.dirname(__file__), "canteenDict.json")
 
@@ -44,13 +41,13 @@ class Parser:
             path = path.format(timestamp=int(timestamp.timestamp()))
         if "change_language" in self.canteens[refName]:
             lang = self.canteens[refName]["change_language"]
-            html = requests.get(f"https://{domain}/change_language/{lang}", headers={
+            html = get(f"https://{domain}/change_language/{lang}", headers={
                                 "Referer": f"https://{domain}{path}"}).text
         else:
-            html = requests.get(f"https://{domain}{path}").text
+            html = get(f"https://{domain}{path}").text
 
         lazyBuilder = StyledLazyBuilder()
-        document = BeautifulSoup(html, "html.parser")
+        document = parse_html(html, 'markas')
 
         # Log name
         logging.debug("\tReference: %s", refName)
@@ -4,17 +4,16 @@ import json
 import logging
 import urllib
 import re
-import json5
 
 
 try:
-    from util import xml_escape, weekdays_map
+    from util import xml_escape, weekdays_map, load_json5
     from .canteen import Canteen
 
 except ModuleNotFoundError:
     include = os.path.relpath(os.path.join(os.path.dirname(__file__), ".."))
     sys.path.insert(0, include)
-    from util import xml_escape, weekdays_map
+    from util import xml_escape, weekdays_map, load_json5
     from canteen import Canteen
 
 metaJson = os.path.join(os.path.dirname(__file__), "canteenDict.json")
@@ -85,8 +84,7 @@ class Parser:
         return '<openmensa xmlns="http://openmensa.org/open-mensa-v2" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" version="2.1" xsi:schemaLocation="http://openmensa.org/open-mensa-v2 http://openmensa.org/open-mensa-v2.xsd"/>'
 
     def __init__(self, urlTemplate):
-        with open(metaJson, "r", encoding="utf8") as f:
-            canteenDict = json5.load(f)
+        canteenDict = load_json5(metaJson)
 
         self.urlTemplate = urlTemplate
 
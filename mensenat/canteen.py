@@ -1,10 +1,12 @@
 from datetime import date, timedelta, datetime
-from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
 import json
 from pyopenmensa.feed import LazyBuilder
 import re
 
+from fetch import post
+
+graphqlUrl = "https://backend.mensen.at/api"
+
 
 class Canteen:
     def __init__(self, uri: str):
@@ -15,7 +17,7 @@ class Canteen:
             raise ValueError("No canteen id found in link: " + uri)
 
     def fetchWeekMenus(self):
-        query = gql("""
+        query = """
 query Location($locationUri: String!) {
       nodeByUri(uri: $locationUri) {
         ... on Location {
@@ -24,20 +26,19 @@ query Location($locationUri: String!) {
         }
       }
     }
-    """)
-
-        # Define the transport with the GraphQL endpoint
-        transport = RequestsHTTPTransport(url="https://backend.mensen.at/api")
-        client = Client(
-            transport=transport,
-            fetch_schema_from_transport=False,  # Disable schema fetching
-        )
+    """
 
         params = {
             "locationUri": f"standort/{self.location}"
         }
 
-        result = client.execute(query, variable_values=params)
+        # Plain GraphQL POST request through the shared HTTP layer
+        response = post(graphqlUrl, json={"query": query, "variables": params})
+        response.raise_for_status()
+        payload = response.json()
+        if payload.get("errors"):
+            raise RuntimeError(f"GraphQL errors: {payload['errors']}")
+        result = payload["data"]
 
         menuplanCurrentWeek = json.loads(result["nodeByUri"]["menuplanCurrentWeek"])
         menuPlanNextWeek = json.loads(result["nodeByUri"]["menuplanNextWeek"])
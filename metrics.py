@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+"""
+Counters, gauges and histograms of the feed runs in the Prometheus text format
+
+updateFeeds.py writes them to a file for the node_exporter textfile
+collector (-metrics) or serves them on /metrics in daemon mode (-metrics-port).
+"""
+
+import os
+import threading
+import contextlib
+import contextvars
+import http.server
+
+__all__ = ['Counter', 'Gauge', 'Histogram', 'render', 'write_textfile', 'serve', 'feed', 'observe_feed',
+           'http_requests', 'http_bytes', 'cache_requests', 'feed_meals', 'feed_days',
+           'canteen_duration', 'errors', 'files', 'last_run']
+
+_metrics = []
+_lock = threading.Lock()
+_feed = contextvars.ContextVar('feed', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        with _lock:
+            self._values.clear()
+
+    def _samples(self):
+        for key, value in self._values.items():
+            yield self.name, key, (), value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        with _lock:
+            for name, key, extra, value in self._samples():
+                lines.append(f'{name}{_format_labels(key, extra)} {value:g}')
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120)):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            counts, total, n = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            counts = [count + (value <= bound) for count, bound in zip(counts, self.buckets)]
+            self._values[key] = (counts, total + value, n + 1)
+
+    def _samples(self):
+        for key, (counts, total, n) in self._values.items():
+            for bound, count in zip(self.buckets, counts):
+                yield f'{self.name}_bucket', key, (('le', f'{bound:g}'),), count
+            yield f'{self.name}_bucket', key, (('le', '+Inf'),), n
+            yield f'{self.name}_sum', key, (), total
+            yield f'{self.name}_count', key, (), n
+
+
+http_requests = Counter('mensa_http_requests_total', 'HTTP requests by host and status code', ('host', 'status'))
+http_bytes = Counter('mensa_http_response_bytes_total', 'Downloaded bytes by host', ('host',))
+cache_requests = Counter('mensa_cache_requests_total',
+                         'get_cached() calls: hit (memory), revalidated (304) or miss', ('result',))
+feed_meals = Gauge('mensa_feed_meals', 'Meals in the last generated feed', ('parser', 'canteen', 'method'))
+feed_days = Gauge('mensa_feed_days', 'Days in the last generated feed', ('parser', 'canteen', 'method'))
+canteen_duration = Histogram('mensa_canteen_duration_seconds', 'Time to update all files of a canteen', ('parser',))
+errors = Counter('mensa_errors_total', 'Errors by parser and exception type', ('parser', 'type'))
+files = Gauge('mensa_files', 'Files of the last run that were changed, unchanged or failed', ('result',))
+last_run = Gauge('mensa_last_run_timestamp_seconds', 'End of the last run')
+
+
+@contextlib.contextmanager
+def feed(parser, canteen, method):
+    """Labels for observe_feed() while a feed is generated"""
+    token = _feed.set((parser, canteen, method))
+    try:
+        yield
+    finally:
+        _feed.reset(token)
+
+
+def observe_feed(meals, days):
+    """Record the size of the feed that is currently generated"""
+    labels = _feed.get()
+    if labels is None:
+        return
+    parser, canteen, method = labels
+    feed_meals.set(meals, parser=parser, canteen=canteen, method=method)
+    feed_days.set(days, parser=parser, canteen=canteen, method=method)
+
+
+def render():
+    return '\n'.join(metric.render() for metric in _metrics) + '\n'
+
+
+def write_textfile(filename):
+    """Write all metrics atomically, the textfile collector must not read a partial file"""
+    tmp = f'{filename}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf8', newline='\n') as f:
+        f.write(render())
+    os.replace(tmp, filename)
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port, host='127.0.0.1'):
+    """Serve /metrics in a background thread"""
+    server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
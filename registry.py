@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+"""
+The parsers of updateFeeds.py, described without importing them
+
+Each parser is listed with the file that defines its canteens, so that
+a run for a single canteen doesn't have to import and create every Parser
+to find the one that it belongs to.
+"""
+
+import os
+import json
+
+__all__ = ['allParsers', 'canteenFiles', 'mayHaveCanteen']
+
+canteenFiles = {
+    'kaiserslautern': 'kaiserslautern/canteenDict.json',
+    'mensenat': 'mensenat/canteenDict.json',
+    'koeln': 'koeln/koeln.json',
+    'eurest': 'eurest/canteens.json',
+    'markas': 'markas/canteenDict.json',
+    'mampf1a': 'mampf1a/canteenDict.json',
+    'inetmenue': 'inetmenue/canteenDict.json',
+    'greifswald': 'greifswald/canteenDict.json',
+    'wuerzburg': 'wuerzburg/canteenDict.json',
+}
+
+allParsers = list(canteenFiles)
+
+repo_path = os.path.dirname(__file__)
+
+
+def mayHaveCanteen(parserName, mensaReference):
+    """False if the canteen is certainly not defined by the parser"""
+    filename = canteenFiles.get(parserName)
+    if not filename:
+        return True
+    try:
+        with open(os.path.join(repo_path, filename), 'r', encoding='utf8') as f:
+            text = f.read()
+    except OSError:
+        return True
+    return mensaReference in text or json.dumps(mensaReference)[1:-1] in text
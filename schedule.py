@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""
+Cron-like schedules for the daemon mode of updateFeeds.py
+
+The schedule file maps parser names to the cron expressions (in UTC) of
+their "full" and "today" runs, "*" is the default for all parsers:
+
+    {
+        "parsers": {
+            "*": {"full": ["12 6 * * *"], "today": ["32 7-11 * * 1-5"]},
+            "koeln": {"today": ["*/30 7-11 * * 1-5"]}
+        },
+        "after": "git add docs && git commit -m 'Updated xml feeds' && git push"
+    }
+
+"after" is an optional shell command that runs after files were changed.
+"""
+
+import json
+
+__all__ = ['CronExpression', 'Schedule', 'kinds']
+
+kinds = ('full', 'today')
+
+_fieldRanges = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def _parseField(field, low, high):
+    values = set()
+    for part in field.split(','):
+        rangePart, _, step = part.partition('/')
+        if rangePart == '*':
+            start, end = low, high
+        elif '-' in rangePart:
+            start, end = (int(value) for value in rangePart.split('-'))
+        else:
+            start = end = int(rangePart)
+            if step:
+                end = high
+        if not low <= start <= end <= high:
+            raise ValueError(f"'{part}' is not in {low}-{high}")
+        values.update(range(start, end + 1, int(step) if step else 1))
+    return values
+
+
+class CronExpression:
+    """"minute hour day-of-month month day-of-week" with *, lists, ranges and steps"""
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Expected five fields in cron expression '{expression}'")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parseField(field, low, high) for field, (low, high) in zip(fields, _fieldRanges))
+        self.weekdays = {weekday % 7 for weekday in weekdays}  # 0 and 7 are sunday
+        # Like cron: if both day fields are restricted, either of them has to match
+        self.anyDay = fields[2] == '*' or fields[4] == '*'
+
+    def matches(self, dt):
+        if dt.minute not in self.minutes or dt.hour not in self.hours or dt.month not in self.months:
+            return False
+        dayMatches = dt.day in self.days
+        weekdayMatches = dt.isoweekday() % 7 in self.weekdays
+        if self.anyDay:
+            return dayMatches and weekdayMatches
+        return dayMatches or weekdayMatches
+
+    def __repr__(self):
+        return f"CronExpression('{self.expression}')"
+
+
+class Schedule:
+    def __init__(self, parsers, after=None):
+        self.after = after
+        self.entries = {}
+        for parserName, entry in parsers.items():
+            self.entries[parserName] = {kind: [CronExpression(expression) for expression in entry.get(kind, [])]
+                                        for kind in kinds if kind in entry}
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'r', encoding='utf8') as f:
+            data = json.load(f)
+        return cls(data.get('parsers', {}), data.get('after'))
+
+    def expressions(self, parserName, kind):
+        entry = self.entries.get(parserName, {})
+        if kind in entry:
+            return entry[kind]
+        return self.entries.get('*', {}).get(kind, [])
+
+    def due(self, parserNames, dt):
+        """{kind: [parserName, ...]} of the runs that are due in the minute `dt`"""
+        result = {}
+        for kind in kinds:
+            names = [parserName for parserName in parserNames
+                     if any(expression.matches(dt) for expression in self.expressions(parserName, kind))]
+            if names:
+                result[kind] = names
+        return result
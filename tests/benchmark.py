@@ -0,0 +1,158 @@
+"""
+Throughput of the parsers on recorded upstream responses
+
+Every parser runs in a fresh interpreter and generates meta, feed,
+feed_all and feed_today (whatever it has) for all of its canteens, with
+all HTTP requests answered from a fixture file of `updateFeeds.py -record`.
+The report shows canteens per second, peak RSS and the time per phase.
+
+    python updateFeeds.py -meta -feed -today -record fixtures.zip
+    python tests/benchmark.py -fixtures fixtures.zip -save baseline.json
+    python tests/benchmark.py -fixtures fixtures.zip -baseline baseline.json [-threshold 0.15]
+    python tests/benchmark.py -fixtures fixtures.zip -baseline baseline.json -html-parser lxml
+
+With -baseline, the exit code is 1 if a parser is slower or uses more
+memory than in the baseline by more than the threshold.
+"""
+
+import sys
+import os
+import io
+import json
+import time
+import argparse
+import traceback
+import subprocess
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+include = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, include)
+
+import timing  # noqa: E402
+from registry import allParsers  # noqa: E402
+
+feedMethods = ('meta', 'feed', 'feed_all', 'feed_today')
+resultPrefix = 'BENCHMARK '
+
+
+def peakRss():
+    """Peak resident set size of this process in kB"""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measureParser(parserName, fixturesPath, htmlParser=''):
+    """Runs in the worker process"""
+    import fetch
+    import util
+    import updateFeeds
+
+    fetch.set_fixtures(fixturesPath)
+    if htmlParser:
+        util.html_parsers[parserName] = htmlParser
+    timing.enabled = True
+    errors = 0
+    start = time.perf_counter()
+    parser = updateFeeds.loadParser(parserName, updateFeeds.base_url)[0]
+    for mensaReference in parser.canteens:
+        for feedMethod in feedMethods:
+            if not hasattr(parser, feedMethod):
+                continue
+            writer = getattr(parser, f"write_{feedMethod}", None)
+            with timing.record(parserName, mensaReference, feedMethod):
+                try:
+                    if writer:
+                        writer(mensaReference, io.StringIO())
+                    else:
+                        getattr(parser, feedMethod)(mensaReference)
+                except Exception:
+                    errors += 1
+                    if errors == 1:
+                        traceback.print_exc()
+    seconds = time.perf_counter() - start
+    phases = {name: round(sum(row[name] for row in timing.records()), 4) for name in timing.phases}
+    return {
+        "canteens": len(parser.canteens),
+        "seconds": round(seconds, 4),
+        "canteens_per_second": round(len(parser.canteens) / seconds, 2) if seconds else 0,
+        "peak_rss_kb": peakRss(),
+        "errors": errors,
+        "phases": phases,
+    }
+
+
+def runWorker(parserName, fixturesPath, htmlParser=''):
+    result = subprocess.run([sys.executable, __file__, '-worker', parserName, '-fixtures', fixturesPath,
+                             '-html-parser', htmlParser],
+                            cwd=include, capture_output=True, text=True)
+    for line in result.stdout.splitlines():
+        if line.startswith(resultPrefix):
+            return json.loads(line[len(resultPrefix):])
+    sys.stderr.write(result.stderr)
+    raise RuntimeError(f"Benchmark of {parserName} failed with exit code {result.returncode}")
+
+
+def regressions(results, baseline, threshold):
+    """Messages for all parsers that are worse than the baseline by more than `threshold`"""
+    messages = []
+    for parserName, result in results.items():
+        before = baseline.get(parserName)
+        if not before:
+            continue
+        if result["canteens_per_second"] < before["canteens_per_second"] * (1 - threshold):
+            messages.append(f"{parserName}: {result['canteens_per_second']} canteens/s, "
+                            f"baseline {before['canteens_per_second']}")
+        if result["peak_rss_kb"] and before.get("peak_rss_kb") and \
+                result["peak_rss_kb"] > before["peak_rss_kb"] * (1 + threshold):
+            messages.append(f"{parserName}: {result['peak_rss_kb']} kB peak RSS, baseline {before['peak_rss_kb']}")
+    return messages
+
+
+def run(parserNames, fixturesPath, baselinePath, savePath, threshold, htmlParser=''):
+    print(f"{'parser':<16}{'canteens':>9}{'canteens/s':>12}{'RSS MB':>8}{'errors':>7}  " +
+          ''.join(f"{name:>10}" for name in timing.phases))
+    results = {}
+    for parserName in parserNames:
+        result = results[parserName] = runWorker(parserName, fixturesPath, htmlParser)
+        rss = f"{result['peak_rss_kb'] / 1024:.0f}" if result['peak_rss_kb'] else "-"
+        print(f"{parserName:<16}{result['canteens']:>9}{result['canteens_per_second']:>12.1f}{rss:>8}"
+              f"{result['errors']:>7}  " + ''.join(f"{result['phases'][name]:>10.3f}" for name in timing.phases))
+
+    if savePath:
+        with open(savePath, 'w', encoding='utf8', newline='\n') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if baselinePath:
+        with open(baselinePath, 'r', encoding='utf8') as f:
+            baseline = json.load(f)
+        messages = regressions(results, baseline, threshold)
+        for message in messages:
+            print(f"Regression {message}")
+        if messages:
+            return 1
+        print(f"No regression above {threshold:.0%}")
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the parsers on recorded responses')
+    parser.add_argument('-fixtures', dest='fixturesPath', required=True, help='Zip file of updateFeeds.py -record')
+    parser.add_argument('-parser', dest='parserName', default='', help='Parser name')
+    parser.add_argument('-baseline', dest='baselinePath', default='', help='Compare with this result of -save')
+    parser.add_argument('-save', dest='savePath', default='', help='Save the result as a baseline')
+    parser.add_argument('-threshold', dest='threshold', type=float, default=0.15,
+                        help='Allowed regression relative to the baseline, default 0.15')
+    parser.add_argument('-html-parser', dest='htmlParser', default='',
+                        help='BeautifulSoup tree builder for all parsers, e.g. lxml or html.parser')
+    parser.add_argument('-worker', dest='worker', default='', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        print(resultPrefix + json.dumps(measureParser(args.worker, args.fixturesPath, args.htmlParser)))
+    else:
+        sys.exit(run([args.parserName] if args.parserName else allParsers, args.fixturesPath,
+                     args.baselinePath, args.savePath, args.threshold, args.htmlParser))
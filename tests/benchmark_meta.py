@@ -0,0 +1,65 @@
+"""
+Micro-benchmark of util.meta_from_xsl()
+
+Compares the cost of one meta feed when the stylesheet is parsed and
+compiled for every canteen (the old behaviour) with the cached stylesheet.
+
+    python tests/benchmark_meta.py [-n 500]
+"""
+
+import sys
+import os
+import argparse
+import timeit
+
+import lxml.etree
+
+include = os.path.relpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, include)
+
+import util  # noqa: E402
+from util import xml_str_param  # noqa: E402
+
+meta_xslt = os.path.join(include, "meta.xsl")
+
+
+def canteen_data():
+    return {
+        "name": xml_str_param("Mensa Musterstadt"),
+        "address": xml_str_param("Musterstraße 1, 12345 Musterstadt"),
+        "city": xml_str_param("Musterstadt"),
+        "phone": xml_str_param("0123 456789"),
+        "latitude": xml_str_param(50.0),
+        "longitude": xml_str_param(8.0),
+        "feed": xml_str_param("https://example.org/feed/musterstadt.xml"),
+        "source": xml_str_param("https://example.org/speiseplan"),
+        "times": "Mo-Do 11:00-14:00 Uhr, Fr 11:00 - 13:30",
+    }
+
+
+def meta_uncached(file_name, data):
+    """util.meta_from_xsl() without the stylesheet cache"""
+    compiled_xslt = util.compiled_xslt
+    util.compiled_xslt = lambda file_name: lxml.etree.XSLT(lxml.etree.parse(file_name))
+    try:
+        return util.meta_from_xsl(file_name, data)
+    finally:
+        util.compiled_xslt = compiled_xslt
+
+
+def run(number):
+    assert meta_uncached(meta_xslt, canteen_data()) == util.meta_from_xsl(meta_xslt, canteen_data())
+    results = {}
+    for name, function in (("uncached", meta_uncached), ("cached", util.meta_from_xsl)):
+        total = min(timeit.repeat(lambda: function(meta_xslt, canteen_data()), number=number, repeat=3))
+        results[name] = total / number
+        print(f"{name:>10}: {results[name] * 1e6:8.1f} µs per meta")
+    print(f"{'speedup':>10}: {results['uncached'] / results['cached']:8.1f}x")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark meta feed generation')
+    parser.add_argument('-n', dest='number', type=int, default=500,
+                        help='Number of meta feeds per measurement')
+    run(parser.parse_args().number)
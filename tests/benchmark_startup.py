@@ -0,0 +1,64 @@
+"""
+Startup time of updateFeeds.py and of each parser
+
+Every parser is imported and created in a fresh interpreter with
+`python -X importtime`. The report shows the time until the Parser
+exists and the modules with the highest import time.
+
+    python tests/benchmark_startup.py [-parser koeln] [-top 10]
+"""
+
+import sys
+import os
+import argparse
+import subprocess
+
+include = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, include)
+
+from registry import allParsers  # noqa: E402
+
+script = """
+import time
+start = time.perf_counter()
+import updateFeeds
+imported = time.perf_counter()
+parser = updateFeeds.loadParser({parserName!r}, updateFeeds.base_url)
+created = time.perf_counter()
+print("updateFeeds %.1f" % ((imported - start) * 1000))
+print("parser %.1f" % ((created - imported) * 1000))
+"""
+
+
+def measure(parserName):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', script.format(parserName=parserName)],
+                            cwd=include, capture_output=True, text=True, check=True)
+    times = dict(line.split() for line in result.stdout.splitlines())
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        selfTime, cumulative, name = line[len('import time:'):].split('|')
+        modules.append((int(selfTime), int(cumulative), name.strip()))
+    return float(times['updateFeeds']), float(times['parser']), modules
+
+
+def run(parserNames, top):
+    print(f"{'parser':<16}{'updateFeeds':>12}{'parser':>10}{'total':>10}  (ms)")
+    slowest = {}
+    for parserName in parserNames:
+        updateFeedsTime, parserTime, modules = measure(parserName)
+        print(f"{parserName:<16}{updateFeedsTime:>12.1f}{parserTime:>10.1f}{updateFeedsTime + parserTime:>10.1f}")
+        for selfTime, _, name in modules:
+            slowest[name] = max(slowest.get(name, 0), selfTime)
+    print("\nSlowest modules (self time, ms):")
+    for name, selfTime in sorted(slowest.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {selfTime / 1000:7.1f} {name}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark startup time')
+    parser.add_argument('-parser', dest='parserName', default='', help='Parser name')
+    parser.add_argument('-top', dest='top', type=int, default=10, help='Number of modules in the report')
+    args = parser.parse_args()
+    run([args.parserName] if args.parserName else allParsers, args.top)
@@ -0,0 +1,422 @@
+"""
+Local stand-in for the upstream servers of all parsers
+
+Serves synthetic menus in the formats of CloudMensa (koeln), mensen.at
+GraphQL, eurest XML, the kaiserslautern JSON, inetmenue, mampf1a, markas,
+greifswald, wuerzburg and restopolis HTML. A request for https://host/path
+is expected as http://127.0.0.1:PORT/host/path, which is what
+`updateFeeds.py -upstream http://127.0.0.1:PORT` and fetch.set_upstream() send.
+
+    python tests/mock_upstream.py [-port 8080] [-latency 0.2] [-jitter 0.3] [-error-rate 0.05] [-meals 6] [-days 14]
+    python updateFeeds.py -feed -today -upstream http://127.0.0.1:8080 -out /tmp/feeds/
+
+-latency and -jitter delay each response, -error-rate answers this fraction
+of the requests with 503, -meals is the number of meals per canteen and day
+and -days the number of days from today on that have meals (from monday of
+the current week on).
+"""
+
+import sys
+import os
+import re
+import json
+import time
+import random
+import argparse
+import datetime
+import threading
+import http.server
+import urllib.parse
+import http.cookies
+import collections
+from xml.sax.saxutils import escape, quoteattr
+
+include = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, include)
+
+from util import now_local  # noqa: E402
+
+germanMonths = ('Januar', 'Februar', 'März', 'April', 'Mai', 'Juni', 'Juli',
+                'August', 'September', 'Oktober', 'November', 'Dezember')
+germanWeekdays = ('Montag', 'Dienstag', 'Mittwoch', 'Donnerstag', 'Freitag', 'Samstag', 'Sonntag')
+dishes = ('Spaghetti Bolognese', 'Gemüsecurry mit Reis', 'Schnitzel mit Pommes', 'Linsensuppe',
+          'Ofenkartoffel mit Kräuterquark', 'Chili sin Carne', 'Lachsfilet auf Blattspinat', 'Käsespätzle')
+categories = ('Hauptgericht', 'Vegetarisch', 'Tagesangebot', 'Aktion', 'Suppe', 'Dessert')
+supabaseKey = 'mock-anon-key'
+
+
+def loadCanteens(parserName, fileName):
+    with open(os.path.join(include, parserName, fileName), 'r', encoding='utf8') as f:
+        return json.load(f)
+
+
+class Menus:
+    """Deterministic synthetic menus"""
+
+    def __init__(self, meals=6, days=14, seed=0):
+        self.meals = meals
+        self.days = days
+        self.seed = seed
+
+    def today(self):
+        return now_local().date()
+
+    def open(self, day):
+        """True if the canteens have meals on `day`: weekdays from monday of this week until `days` from today"""
+        today = self.today()
+        return day.weekday() < 5 and -today.weekday() <= (day - today).days < self.days
+
+    def week(self, offset=0, start=None):
+        """Monday to friday of the current week or `offset` weeks later"""
+        start = start or self.today()
+        monday = start - datetime.timedelta(days=start.weekday()) + datetime.timedelta(weeks=offset)
+        return [monday + datetime.timedelta(days=i) for i in range(5)]
+
+    def meals_for(self, key, day):
+        """[(category, name, price in cents), ...] for canteen `key`"""
+        if not self.open(day):
+            return []
+        rnd = random.Random(f"{self.seed}/{key}/{day}")
+        return [(categories[i % len(categories)], f"{rnd.choice(dishes)} {i + 1}", rnd.randint(150, 700))
+                for i in range(self.meals)]
+
+
+def euro(cents):
+    return f"{cents // 100},{cents % 100:02d}"
+
+
+def html(body):
+    return f'<!DOCTYPE html>\n<html><head><title>Mock</title></head><body>\n{body}\n</body></html>\n'
+
+
+def kaiserslautern(menus, path, query, body, cookies):
+    if path.endswith('/speiseplaene'):
+        return 'text/html', html('<script src="typo3temp/assets/prices.js"></script>')
+    if path.endswith('/prices.js'):
+        prices = {category: {"stu": "3,50 €", "bed": "5,00 €", "gas": "6,50 €"} for category in categories}
+        return 'application/javascript', f'var priceRelations = {json.dumps(prices, ensure_ascii=False)};'
+    if path.endswith('/load_db_speiseplan.php'):
+        rows = []
+        start = menus.today()
+        for canteen in loadCanteens('kaiserslautern', 'canteenDict.json').values():
+            for offset in range(int(query.get('days', ['30'])[0])):
+                day = start + datetime.timedelta(days=offset)
+                for category, name, _ in menus.meals_for(canteen['dportname'], day):
+                    rows.append({"dportname": canteen['dportname'], "proddatum": day.isoformat(),
+                                 "artname1": category, "dpartname": category, "artgebname": category,
+                                 "atextohnezsz1": name, "dpname": name, "zsnamen": "Gluten, Milch",
+                                 "frei1": "", "frei2": "", "frei3": ""})
+        return 'application/json', json.dumps(rows, ensure_ascii=False)
+
+
+def eurest(menus, path, query, body, cookies):
+    week = 1 if path.startswith('/NextWeek/') else 0
+    key = path.rsplit('/', 1)[-1]
+    lines = []
+    for day in menus.week(week):
+        menuLines = ''.join(
+            f'<MenuLine Name={quoteattr(category)}><SetMenu><Component><ComponentDetails>'
+            f'<GastDesc value={quoteattr(name)}/></ComponentDetails><AdditiveInfo><AdditiveGroup>'
+            f'<Additive name="Gluten"/></AdditiveGroup></AdditiveInfo></Component></SetMenu></MenuLine>'
+            for category, name, _ in menus.meals_for(key, day))
+        lines.append(f'<WeekDay Date="{day.isoformat()}">{menuLines}</WeekDay>')
+    return 'text/xml', f'<?xml version="1.0" encoding="utf-8"?>\n<NewDataSet>{"".join(lines)}</NewDataSet>\n'
+
+
+def mensenat(menus, path, query, body, cookies):
+    location = json.loads(body)['variables']['locationUri']
+
+    def week(offset):
+        days = menus.week(offset)
+        byCategory = collections.defaultdict(dict)
+        for weekday, day in enumerate(days, 1):
+            for category, name, price in menus.meals_for(location, day):
+                byCategory[category].setdefault(str(weekday), []).append(
+                    {"title_de": f"<p>{name}</p>", "allergens": ["A", "G"], "price": euro(price)})
+        return json.dumps({"available": True, "first_day": days[0].isoformat(),
+                           "menus": [{"name": category, "menus": meals} for category, meals in byCategory.items()]})
+
+    data = {"nodeByUri": {"menuplanCurrentWeek": week(0), "menuplanNextWeek": week(1)}}
+    return 'application/json', json.dumps({"data": data})
+
+
+def inetmenue(menus, path, query, body, cookies):
+    key = path
+    if path.startswith('/sf/'):
+        week = int(query.get('week', ['0'])[0])
+        days = menus.week(week)
+        nextWeek = '' if week else '<div id="day-tabs"><ul><li class="next_week"><a href="/sf/index.php?week=1">›</a></li></ul></div>'
+        header = ''.join(f'<th><span class="day_date">{day:%d.%m.%Y}</span></th>' for day in days)
+        rows = []
+        for index in range(menus.meals):
+            cells = []
+            for day in days:
+                meals = menus.meals_for(key, day)
+                if index < len(meals):
+                    category, name, _ = meals[index]
+                    cells.append(f'<td><div class="menu_box"><div class="menuinfo">{escape(category)}</div>'
+                                 f'<h4>{escape(name)}</h4></div></td>')
+                else:
+                    cells.append('<td></td>')
+            rows.append(f'<tr>{"".join(cells)}</tr>')
+        return 'text/html', html(f'{nextWeek}<table class="week_table"><thead><tr>{header}</tr></thead><tbody>'
+                                 f'<tr class="menutime"><td colspan="5">Mittag</td></tr>{"".join(rows)}</tbody></table>')
+    if path.startswith('/fs/menu/week'):
+        week = 1 if path.rstrip('/').endswith('/1') else 0
+        days = menus.week(week)
+        jump = '' if week else '<a class="jmp" href="/fs/menu/week/1"><i class="fa fa-caret-right"></i></a>'
+        header = ''.join(f'<div class="day"><span class="long"><small>{day:%d.%m.%Y}</small></span></div>'
+                         for day in days)
+        lines = []
+        for index in range(menus.meals):
+            cells = []
+            for day in days:
+                meals = menus.meals_for(key, day)
+                if index < len(meals):
+                    category, name, price = meals[index]
+                    cells.append(f'<div class="day"><header>{escape(category)}</header><div class="product">'
+                                 f'<h4>{escape(name)}</h4><span class="price">{euro(price)} €</span></div>'
+                                 f'<span class="allergens" title="Gluten, Milch"></span></div>')
+                else:
+                    cells.append('<div class="day no-menu"></div>')
+            lines.append(f'<div class="menu-line">{"".join(cells)}</div>')
+        return 'text/html', html(f'<div id="week-content"><h2>Mensa</h2><div class="day-header">{header}{jump}</div>'
+                                 f'{"".join(lines)}</div>')
+
+
+def mampf1a(menus, path, query, body, cookies):
+    key = path.split('/')[1]
+    days = menus.week()
+    legend = '<div style="padding-bottom: 8px;">A - Gluten</div><div style="padding-bottom: 8px;">G - Milch</div>'
+    header = '<tr><td></td>' + ''.join(f'<td>{germanWeekdays[day.weekday()][:2]} {day:%d.%m.}</td>' for day in days) + '</tr>'
+    rows = []
+    for index in range(menus.meals):
+        cells = []
+        category = categories[index % len(categories)]
+        for day in days:
+            meals = menus.meals_for(key, day)
+            if index < len(meals):
+                _, name, price = meals[index]
+                cells.append(f'<td class="zelle_inhalt"><a class="{"gruen" if index % 2 else "rot"}">'
+                             f'{escape(name)} {euro(price)} €<span class="additive"><img alt="A"></span></a></td>')
+            else:
+                cells.append('<td class="zelle_inhalt"></td>')
+        rows.append(f'<tr><td>{escape(category)}</td>{"".join(cells)}</tr>')
+    return 'text/html', html(f'{legend}<table class="std"><thead>{header}{"".join(rows)}</thead></table>')
+
+
+def markas(menus, path, query, body, cookies):
+    today = menus.today()
+    if today.weekday() == 6:
+        today += datetime.timedelta(days=1)
+    days = menus.week(start=today)
+    # /menu/{timestamp}/0/3783/: the same menu for every timestamp
+    key = re.sub(r'/menu/\d+/', '/menu/', path)
+    dayNumbers = ''.join(f'<div class="day">{day.day}</div>' for day in days)
+    rows = []
+    for index in range(menus.meals):
+        cells = []
+        for weekday, day in enumerate(days, 1):
+            meals = menus.meals_for(key, day)
+            name = escape(meals[index][1]) + ' *' if index < len(meals) else ''
+            cells.append(f'<td data-giorno="{weekday}">' + (f'<p class="piatto_inline">{name}</p>' if name else '') + '</td>')
+        rows.append(f'<tr><th>{escape(categories[index % len(categories)])}</th>{"".join(cells)}</tr>')
+    return 'text/html', html(f'<div class="days_container">{dayNumbers}</div><div id="settimana">'
+                             f'<table class="tabella_menu_settimanale">{"".join(rows)}</table></div>')
+
+
+def greifswald(menus, path, query, body, cookies):
+    day = datetime.date.fromisoformat(query.get('datum', [menus.today().isoformat()])[0])
+    rows = []
+    for category, name, price in menus.meals_for(path, day):
+        rows.append(f'<tr class="menu-table-row"><td>{escape(category)}</td></tr>'
+                    f'<tr><td>{escape(name)}</td><td>{euro(price)}&nbsp;€</td><td>{euro(price + 150)}&nbsp;€</td>'
+                    f'<td>{euro(price + 250)}&nbsp;€</td></tr>')
+    return 'text/html', html(f'<table class="menu-table">{"".join(rows)}</table>' if rows else '<p>Kein Angebot</p>')
+
+
+def wuerzburg(menus, path, query, body, cookies):
+    days = []
+    for offset in range(menus.days):
+        day = menus.today() + datetime.timedelta(days=offset)
+        articles = ''.join(
+            f'<article><h5>{escape(name)}</h5><span class="food-icon" title="{escape(category)}"></span>'
+            f'<div class="additive-list"><ul><li>Gluten</li></ul></div><div class="price" '
+            f'data-price-student="{euro(price)}" data-price-servant="{euro(price + 150)}" '
+            f'data-price-guest="{euro(price + 250)}"></div></article>'
+            for category, name, price in menus.meals_for(path, day))
+        if articles:
+            days.append(f'<div class="day-menu"><h3>{germanWeekdays[day.weekday()]}, {day.day}. '
+                        f'{germanMonths[day.month - 1]} {day.year}</h3>'
+                        f'<div class="day-menu-entries">{articles}</div></div>')
+    return 'text/html', html(''.join(days))
+
+
+def cloudmensa(menus, path, query, body, cookies):
+    if path.startswith('/menu/'):
+        return 'text/html', html('<script type="module" src="assets/index-mock.js"></script>')
+    if path.endswith('.js'):
+        return 'application/javascript', f'const e="https://mock.supabase.co",t="{supabaseKey}";'
+
+
+def supabase(menus, path, query, body, cookies):
+    payload = json.loads(body)
+    if path.endswith('/public_get_organization_by_slug'):
+        return 'application/json', json.dumps({
+            "id": "00000000-0000-0000-0000-000000000000", "name": "Mock", "logo_url": None,
+            "settings": {"public_menu_dedup_custom_fields": ["name_de", "location", "ort_id", ""],
+                         "public_menu_food_icon_legend": [{"icon_id": "VGT", "label_de": "Vegetarisch"}]}})
+    if path.endswith('/public_get_week_menu'):
+        start = datetime.date.fromisoformat(payload['p_start_date'])
+        end = datetime.date.fromisoformat(payload['p_end_date'])
+        canteens = loadCanteens('koeln', 'koeln.json')
+        result = []
+        for offset in range((end - start).days + 1):
+            day = start + datetime.timedelta(days=offset)
+            dishes = []
+            for key, canteen in canteens.items():
+                for index, (category, name, price) in enumerate(menus.meals_for(key, day)):
+                    fields = [{"field_id": "menu_type", "value": category},
+                              {"field_id": "price_2", "value": euro(price + 150)},
+                              {"field_id": "price_3", "value": euro(price + 250)},
+                              {"field_id": "allergens_names", "value": "1=Mit Farbstoff | contains colorants"},
+                              {"field_id": "food_icon", "value": "VGT"}]
+                    if canteen.get('ort_id'):
+                        fields.append({"field_id": "ort_id", "value": canteen['ort_id']})
+                    dishes.append({"id": f"{key}-{day}-{index}", "name_de": f"{name} (1)", "price": price / 100,
+                                   "category": category, "custom_fields": fields,
+                                   "screens": [{"location": canteen['screen_locations'][0]}]})
+            result.append({"date": day.isoformat(), "dishes": dishes})
+        return 'application/json', json.dumps(result, ensure_ascii=False)
+
+
+def restopolis(menus, path, query, body, cookies):
+    selected = cookies.get('CustomerServices.Restopolis.SelectedDate')
+    start = datetime.datetime.strptime(selected, '%d.%m.%Y').date() if selected else menus.today()
+    key = '{}/{}'.format(cookies.get('CustomerServices.Restopolis.SelectedRestaurant'),
+                         cookies.get('CustomerServices.Restopolis.SelectedService'))
+    days = menus.week(start=start)
+    buttons = ''.join(f'<button class="day" data-full-date="{day:%d.%m.%Y}"></button>' for day in days)
+    dayDivs = []
+    for day in days:
+        meals = menus.meals_for(key, day)
+        if not meals:
+            dayDivs.append('<div><div class="no-products"></div></div>')
+            continue
+        dayDivs.append('<div>' + ''.join(
+            f'<div class="course-name">{escape(category)}</div><div class="product-name">{escape(name)}</div>'
+            f'<div class="product-allergens">1, 7</div>' for category, name, _ in meals) + '</div>')
+    return 'text/html', html(f'<div class="date-selector-desktop">{buttons}</div>'
+                             f'<div class="daily-menu">{"".join(dayDivs)}</div>')
+
+
+markasDomains = ('.markas.info', '.epspacloud.it', '.ristocloud.it', '.ristocloud.net', '.compasscloud.it',
+                 '.operaunitn.cloud')
+
+
+def route(host):
+    """The handler function for `host`"""
+    if host.endswith('.supabase.co'):
+        return supabase
+    if host.endswith('.inetmenue.de'):
+        return inetmenue
+    if host.endswith(markasDomains):
+        return markas
+    return {
+        'www.studierendenwerk-kaiserslautern.de': kaiserslautern,
+        'menuplan.eurest.at': eurest,
+        'backend.mensen.at': mensenat,
+        'login.mampf1a.de': mampf1a,
+        'www.stw-greifswald.de': greifswald,
+        'www.swerk-wue.de': wuerzburg,
+        'app.cloudmensa.io': cloudmensa,
+        'ssl.education.lu': restopolis,
+    }.get(host)
+
+
+class MockHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def handle_request(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        host, _, rest = self.path.lstrip('/').partition('/')
+        parts = urllib.parse.urlsplit('/' + rest)
+        with server.lock:
+            server.requests[host] += 1
+            delay = server.latency + server.random.uniform(0, server.jitter)
+            failed = server.random.random() < server.error_rate
+        if delay:
+            time.sleep(delay)
+        if failed:
+            return self.respond(503, 'text/plain', 'Service Unavailable (mock)', {'Retry-After': '0'})
+        handler = route(host)
+        result = None
+        if handler:
+            cookies = {key: morsel.value for key, morsel in http.cookies.SimpleCookie(self.headers.get('Cookie', '')).items()}
+            result = handler(server.menus, urllib.parse.unquote(parts.path), urllib.parse.parse_qs(parts.query),
+                             body, cookies)
+        if result is None:
+            return self.respond(404, 'text/plain', f'No mock for {host}{parts.path}')
+        self.respond(200, *result)
+
+    def respond(self, status, contentType, text, headers=None):
+        data = text.encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', f'{contentType}; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = handle_request
+    do_POST = handle_request
+
+    def log_message(self, *args):
+        pass
+
+
+class MockUpstream(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0, jitter=0.0, error_rate=0.0, meals=6, days=14, seed=0):
+        super().__init__(('127.0.0.1', port), MockHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.menus = Menus(meals, days, seed)
+        self.random = random.Random(seed)
+        self.requests = collections.Counter()
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mock upstream server for all parsers')
+    parser.add_argument('-port', dest='port', type=int, default=8080, help='Port, default 8080')
+    parser.add_argument('-latency', dest='latency', type=float, default=0.0, help='Seconds before each response')
+    parser.add_argument('-jitter', dest='jitter', type=float, default=0.0, help='Additional random delay in seconds')
+    parser.add_argument('-error-rate', dest='error_rate', type=float, default=0.0,
+                        help='Fraction of requests that are answered with 503')
+    parser.add_argument('-meals', dest='meals', type=int, default=6, help='Meals per canteen and day')
+    parser.add_argument('-days', dest='days', type=int, default=14, help='Days with meals from today on')
+    parser.add_argument('-seed', dest='seed', type=int, default=0, help='Seed of the synthetic menus')
+    args = vars(parser.parse_args())
+    server = MockUpstream(**args)
+    print(f"Mock upstream on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(dict(server.requests))
@@ -0,0 +1,98 @@
+import sys
+import os
+import io
+import logging
+import random
+import datetime
+
+from pyopenmensa.feed import LazyBuilder
+
+include = os.path.relpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, include)
+
+from util import StyledLazyBuilder, xml_remove_invalid_chars  # noqa: E402
+
+isPyIdle = "idlelib" in sys.modules
+endVT = "" if isPyIdle else "\033[0m"
+greenVT = "" if isPyIdle else "\033[1;32m"
+greenOk = f"{greenVT}Ok{endVT}"
+
+
+def minidom_feed(builder):
+    """The feed as it was generated with pyopenmensa's minidom serializer"""
+    return xml_remove_invalid_chars('<?xml version="1.0" encoding="UTF-8"?>\n' +
+                                    builder.toXML().toprettyxml(indent='  '))
+
+
+def random_text(rnd):
+    alphabet = 'abc XYZ äöüß &<>"\'\t\r\n€\x00\x0b￾🍕'
+    return 'M' + ''.join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 30)))
+
+
+def test_same_as_minidom():
+    rnd = random.Random(7)
+    for _ in range(50):
+        builder = StyledLazyBuilder()
+        reference = LazyBuilder()
+        start = datetime.date(2024, 1, 1)
+        for offset in rnd.sample(range(14), rnd.randint(0, 10)):
+            date = start + datetime.timedelta(days=offset)
+            if rnd.random() < 0.2:
+                builder.setDayClosed(date)
+                reference.setDayClosed(date)
+                continue
+            for _ in range(rnd.randint(1, 6)):
+                category = random_text(rnd)
+                name = random_text(rnd)
+                notes = [random_text(rnd) for _ in range(rnd.randint(0, 3))]
+                prices = {role: rnd.randint(0, 1000) for role in rnd.sample(
+                    ['student', 'employee', 'other', 'pupil'], rnd.randint(0, 4))}
+                builder.addMeal(date, category, name, notes, prices)
+                # Invalid characters are removed before notes are sorted
+                reference.addMeal(date, xml_remove_invalid_chars(category), xml_remove_invalid_chars(name),
+                                  [xml_remove_invalid_chars(note) for note in notes], prices)
+        feed = builder.toXMLFeed(styles=None)
+        assert feed == minidom_feed(reference)
+        assert xml_remove_invalid_chars(feed) == feed
+        stream = io.StringIO()
+        builder.writeXMLFeed(stream, styles=None)
+        assert stream.getvalue() == feed
+
+
+def test_canteen_data():
+    builder = StyledLazyBuilder()
+    builder.name = 'Mensa'
+    builder.addMeal(datetime.date(2024, 1, 1), 'Essen', 'Pizza')
+    feed = builder.toXMLFeed(styles=None)
+    assert '<name>Mensa</name>' in feed
+    assert feed == minidom_feed(builder)
+
+
+def test_only_invalid_chars():
+    builder = StyledLazyBuilder()
+    builder.addMeal(datetime.date(2024, 1, 1), 'Essen', 'Pizza', ['\x0b', 'vegetarisch', '\x00￾'])
+    builder.addMeal(datetime.date(2024, 1, 1), '\x0b', 'Pasta')
+    builder.addMeal(datetime.date(2024, 1, 1), 'Essen', '\x00')
+    feed = builder.toXMLFeed(styles=None)
+    assert feed.count('<meal>') == 1
+    assert '<note>vegetarisch</note>' in feed
+    assert feed.count('<note>') == 1
+    for notes in ([''], None):
+        try:
+            builder.addMeal(datetime.date(2024, 1, 1), 'Essen', '' if notes is None else 'Pizza', notes)
+            assert False, "pyopenmensa rejects empty values"
+        except ValueError:
+            pass
+
+
+def run_all():
+    for fname, f in list(globals().items()):
+        if fname.startswith('test_'):
+            print(f"{fname}()...")
+            f()
+            print(f"...{fname}() -> {greenOk}.")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    run_all()
@@ -0,0 +1,251 @@
+import sys
+import os
+import time
+import logging
+import tempfile
+import threading
+import http.server
+
+include = os.path.relpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, include)
+
+import fetch  # noqa: E402
+
+isPyIdle = "idlelib" in sys.modules
+endVT = "" if isPyIdle else "\033[0m"
+greenVT = "" if isPyIdle else "\033[1;32m"
+greenOk = f"{greenVT}Ok{endVT}"
+
+
+class CountingHandler(http.server.BaseHTTPRequestHandler):
+    requests = []
+    version = "1"
+
+    def do_GET(self):
+        CountingHandler.requests.append((self.path, self.headers.get('User-Agent')))
+        if self.path.startswith('/busy') and len(CountingHandler.requests) <= 2:
+            self.send_response(503)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        etag = f'"{CountingHandler.version}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        body = f"<html>{self.path} v{CountingHandler.version}</html>".encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), CountingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def test_lru_cache():
+    cache = fetch.LRUCache(10)
+    cache.put('a', 'A', 4)
+    cache.put('b', 'B', 4)
+    assert cache.get('a') == 'A'
+    cache.put('c', 'C', 4)
+    # 'b' was the least recently used entry
+    assert cache.get('b') is None
+    assert cache.get('a') == 'A'
+    assert cache.get('c') == 'C'
+    assert cache.size == 8
+    cache.put('d', 'D', 11)
+    assert cache.get('d') is None
+    assert len(cache) == 2
+
+
+def test_get_cached():
+    server, base = serve()
+    CountingHandler.requests = []
+    fetch.clear_cache()
+    try:
+        first = fetch.get_cached(f"{base}/speiseplan")
+        second = fetch.get_cached(f"{base}/speiseplan")
+        assert first is second
+        assert first.text == "<html>/speiseplan v1</html>"
+        assert len(CountingHandler.requests) == 1
+        assert CountingHandler.requests[0][1] == fetch.user_agent
+        assert fetch.session(base) is fetch.session(f"{base}/other")
+    finally:
+        server.shutdown()
+        fetch.clear_cache()
+
+
+def test_conditional_requests():
+    server, base = serve()
+    CountingHandler.requests = []
+    CountingHandler.version = "1"
+    url = f"{base}/load_db_speiseplan.php?days=30"
+    with tempfile.TemporaryDirectory() as cacheDir:
+        fetch.set_cache_dir(cacheDir)
+        try:
+            with fetch.track_dependencies() as dependencies:
+                response = fetch.get_cached(url)
+            assert not getattr(response, 'not_modified', False)
+            assert dependencies.complete
+            assert list(dependencies.urls) == [url]
+
+            # Next run: the in-memory cache is gone, the server answers 304
+            fetch.clear_cache()
+            response = fetch.get_cached(url)
+            assert response.not_modified
+            assert response.text == "<html>/load_db_speiseplan.php?days=30 v1</html>"
+            assert fetch.unchanged(dependencies.urls)
+
+            # The page changes
+            fetch.clear_cache()
+            CountingHandler.version = "2"
+            assert not fetch.unchanged(dependencies.urls)
+            assert fetch.get_cached(url).text.endswith("v2</html>")
+            assert len(CountingHandler.requests) == 3
+
+            with fetch.track_dependencies() as dependencies:
+                fetch.get(url)
+            assert not dependencies.complete
+        finally:
+            fetch.set_cache_dir(None)
+            fetch.clear_cache()
+            server.shutdown()
+
+
+def test_prune_after_revalidation():
+    server, base = serve()
+    CountingHandler.requests = []
+    CountingHandler.version = "1"
+    url = f"{base}/speiseplan"
+    old = time.time() - 2 * fetch.disk_cache_max_age
+    with tempfile.TemporaryDirectory() as cacheDir:
+        fetch.set_cache_dir(cacheDir)
+        try:
+            fetch.get_cached(url)
+            for path in fetch._disk_paths(url):
+                os.utime(path, (old, old))
+
+            # A 304 keeps the entry, both the body and the meta file
+            fetch.clear_cache()
+            assert fetch.get_cached(url).not_modified
+            fetch.prune_cache()
+            assert all(os.path.exists(path) for path in fetch._disk_paths(url))
+
+            # The body is kept as long as its meta file is used
+            metaPath, bodyPath = fetch._disk_paths(url)
+            os.utime(bodyPath, (old, old))
+            fetch.prune_cache()
+            assert os.path.exists(bodyPath)
+            fetch.clear_cache()
+            assert fetch.get_cached(url).not_modified
+
+            for path in fetch._disk_paths(url):
+                os.utime(path, (old, old))
+            fetch.prune_cache()
+            assert not os.listdir(os.path.join(cacheDir, 'http'))
+            assert len(CountingHandler.requests) == 3
+        finally:
+            fetch.set_cache_dir(None)
+            fetch.clear_cache()
+            server.shutdown()
+
+
+def test_record_replay():
+    server, base = serve()
+    CountingHandler.requests = []
+    CountingHandler.version = "1"
+    url = f"{base}/CurrentWeek?date=2024-01-01"
+    with tempfile.TemporaryDirectory() as folder:
+        filename = os.path.join(folder, 'fixtures.zip')
+        try:
+            fetch.set_fixtures(filename, recording=True)
+            recorded = fetch.get(url)
+            # The body of a stream=True request can still be read from `raw`, e.g. by eurest
+            streamed = fetch.get(f"{base}/feed.xml", stream=True).raw.read()
+            assert streamed == b"<html>/feed.xml v1</html>"
+            fetch.close_fixtures()
+            server.shutdown()
+            server.server_close()
+
+            fetch.set_fixtures(filename)
+            replayed = fetch.get(url)
+            assert replayed.status_code == 200
+            assert replayed.text == recorded.text
+            assert replayed.headers['ETag'] == '"1"'
+            assert fetch.get(f"{base}/feed.xml", stream=True).raw.read() == streamed
+            # Another date in the query is answered with the recorded page
+            assert fetch.get(f"{base}/CurrentWeek?date=2024-01-08").text == recorded.text
+            try:
+                fetch.get(f"{base}/NextWeek")
+                assert False, "Expected ConnectionError"
+            except fetch.requests.ConnectionError:
+                pass
+            assert len(CountingHandler.requests) == 2
+        finally:
+            fetch.close_fixtures()
+            server.shutdown()
+
+
+def test_get_many():
+    server, base = serve()
+    CountingHandler.requests = []
+    CountingHandler.version = "1"
+    fetch.clear_cache()
+    try:
+        urls = [f"{base}/?datum=2024-01-0{day}" for day in range(1, 6)]
+        with fetch.track_dependencies() as dependencies:
+            responses = fetch.get_many(urls, cached=True)
+        assert [r.text for r in responses] == [f"<html>{url[len(base):]} v1</html>" for url in urls]
+        # Dependencies are tracked on the worker threads, too
+        assert sorted(dependencies.urls) == sorted(urls)
+        assert dependencies.complete
+        assert fetch.get_cached(urls[0]) is responses[0]
+        assert len(CountingHandler.requests) == len(urls)
+    finally:
+        server.shutdown()
+        fetch.clear_cache()
+
+
+def test_host_limits():
+    server, base = serve()
+    CountingHandler.requests = []
+    defaults = fetch.host_rate, fetch.host_max_in_flight
+    fetch.clear_cache()
+    try:
+        # 503 with Retry-After is retried
+        assert fetch.get(f"{base}/busy").status_code == 200
+        assert len(CountingHandler.requests) == 3
+
+        fetch.set_host_limits(rate=20, max_in_flight=1)
+        start = time.monotonic()
+        fetch.get_many([f"{base}/{i}" for i in range(5)])
+        # 5 requests with at least 1/20s between them
+        assert time.monotonic() - start >= 0.2
+    finally:
+        fetch.set_host_limits(*defaults)
+        server.shutdown()
+        fetch.clear_cache()
+
+
+def run_all():
+    for fname, f in list(globals().items()):
+        if fname.startswith('test_'):
+            print(f"{fname}()...")
+            f()
+            print(f"...{fname}() -> {greenOk}.")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    run_all()
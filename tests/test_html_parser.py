@@ -0,0 +1,131 @@
+"""
+Parity of the BeautifulSoup tree builders
+
+The feeds of the parsers that use util.parse_html() must be the same with
+html.parser and lxml before a parser is switched in util.html_parsers.
+The test uses the pages of tests/mock_upstream.py, with -fixtures the
+comparison runs on all canteens with the pages of `updateFeeds.py -record`:
+
+    python tests/test_html_parser.py [-fixtures fixtures.zip] [-parser inetmenue]
+"""
+
+import sys
+import os
+import locale
+import logging
+import argparse
+
+include = os.path.relpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, include)
+sys.path.insert(0, os.path.dirname(__file__))
+
+import fetch  # noqa: E402
+import util  # noqa: E402
+import updateFeeds  # noqa: E402
+from mock_upstream import MockUpstream  # noqa: E402
+
+isPyIdle = "idlelib" in sys.modules
+endVT = "" if isPyIdle else "\033[0m"
+greenVT = "" if isPyIdle else "\033[1;32m"
+greenOk = f"{greenVT}Ok{endVT}"
+
+htmlParserNames = ['inetmenue', 'mampf1a', 'greifswald', 'markas', 'wuerzburg']
+backends = ('html.parser', 'lxml')
+
+
+def feeds(parserName, backend, references=None):
+    """{(reference, feedMethod): feed} of the parser with the tree builder `backend`"""
+    configured = util.html_parsers.get(parserName)
+    util.html_parsers[parserName] = backend
+    try:
+        parser = updateFeeds.loadParser(parserName, updateFeeds.base_url)[0]
+        result = {}
+        for reference in references or parser.canteens:
+            for feedMethod in ('feed', 'feed_all'):
+                if hasattr(parser, feedMethod):
+                    try:
+                        result[(reference, feedMethod)] = getattr(parser, feedMethod)(reference)
+                    except Exception as e:
+                        result[(reference, feedMethod)] = f"{type(e).__name__}: {e}"
+        return result
+    finally:
+        if configured is None:
+            util.html_parsers.pop(parserName)
+        else:
+            util.html_parsers[parserName] = configured
+
+
+def differences(parserName, references=None):
+    """The (reference, feedMethod) keys whose feeds differ between the tree builders"""
+    fetch.clear_cache()
+    first, second = (feeds(parserName, backend, references) for backend in backends)
+    return [key for key in first if first[key] != second.get(key)]
+
+
+def can_run(parserName):
+    if parserName != 'wuerzburg':
+        return True
+    current = locale.setlocale(locale.LC_TIME)
+    try:
+        locale.setlocale(locale.LC_TIME, 'de_DE.UTF-8')
+        return True
+    except locale.Error:
+        return False
+    finally:
+        locale.setlocale(locale.LC_TIME, current)
+
+
+def test_same_feeds():
+    server = MockUpstream(meals=4, days=10).start()
+    fetch.set_upstream(server.url)
+    try:
+        for parserName in htmlParserNames:
+            if not can_run(parserName):
+                continue
+            parser = updateFeeds.loadParser(parserName, updateFeeds.base_url)[0]
+            references = list(parser.canteens)[:3]
+            first, second = (feeds(parserName, backend, references) for backend in backends)
+            assert all('<meal>' in feed for feed in first.values()), parserName
+            assert first == second, parserName
+    finally:
+        fetch.set_upstream(None)
+        fetch.clear_cache()
+        server.stop()
+
+
+def test_subtrees():
+    markup = ('<html><head><title>Menu</title><script>var x;</script></head><body><nav><a>Home</a></nav>'
+              '<div id="week-content"><h2>A</h2></div>footer<table class="std wide"><tr><td>B</td></tr></table>'
+              '<div style="padding-bottom: 8px;">C</div></body></html>')
+    selectors = ('#week-content', 'table.std', 'div[style="padding-bottom: 8px;"]')
+    for backend in backends:
+        util.html_parsers['test'] = backend
+        document = util.parse_html(markup, 'test', selectors)
+        assert [tag.name for tag in document.children] == ['div', 'table', 'div'], backend
+        assert document.text == 'ABC', backend
+    util.html_parsers.pop('test')
+
+
+def run_all():
+    for fname, f in list(globals().items()):
+        if fname.startswith('test_'):
+            print(f"{fname}()...")
+            f()
+            print(f"...{fname}() -> {greenOk}.")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description='Compare the feeds of html.parser and lxml')
+    parser.add_argument('-fixtures', dest='fixturesPath', default='', help='Zip file of updateFeeds.py -record')
+    parser.add_argument('-parser', dest='parserName', default='', help='Parser name')
+    args = parser.parse_args()
+    if not args.fixturesPath:
+        run_all()
+    else:
+        fetch.set_fixtures(args.fixturesPath)
+        for parserName in [args.parserName] if args.parserName else htmlParserNames:
+            different = differences(parserName)
+            print(f"{parserName}: {len(different)} different feeds {greenOk if not different else ''}")
+            for reference, feedMethod in different:
+                print(f"  {reference} {feedMethod}")
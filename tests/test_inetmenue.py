@@ -0,0 +1,87 @@
+import sys
+import os
+import random
+import logging
+
+include = os.path.relpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, include)
+
+from util import StyledLazyBuilder  # noqa: E402
+from inetmenue import CategoryIndex, Parser  # noqa: E402
+
+isPyIdle = "idlelib" in sys.modules
+endVT = "" if isPyIdle else "\033[0m"
+greenVT = "" if isPyIdle else "\033[1;32m"
+greenOk = f"{greenVT}Ok{endVT}"
+
+nudelbuffet = "https://cdn.inetmenue.de/media%2F00017709%2Fc6b053e7e3b5eca2162f8a7db28d2ef13d4a650b.jpg"
+
+
+def linear_lookup(rules, category_img):
+    """The category lookup of parseMealsFS before CategoryIndex: last matching rule wins"""
+    if category_img in rules:
+        return rules[category_img]
+    category_name = None
+    for query in rules:
+        if query.startswith("$") and category_img.endswith(query[1:]):
+            category_name = rules[query]
+        if query.startswith("^") and category_img.startswith(query[1:]):
+            category_name = rules[query]
+        if query.startswith("*") and query[1:] in category_img:
+            category_name = rules[query]
+    return category_name
+
+
+def test_same_as_linear_lookup():
+    rnd = random.Random(1)
+    for _ in range(3000):
+        rules = {}
+        for i in range(rnd.randint(0, 8)):
+            rules[rnd.choice('$^*') + ''.join(rnd.choice('abc') for _ in range(rnd.randint(0, 3)))] = str(i)
+        rules[''.join(rnd.choice('abc') for _ in range(3))] = 'exact'
+        index = CategoryIndex(rules)
+        for _ in range(20):
+            category_img = ''.join(rnd.choice('abc') for _ in range(rnd.randint(0, 5)))
+            assert index.resolve(category_img) == linear_lookup(rules, category_img), (rules, category_img)
+
+    parser = Parser("http://localhost/")
+    for ref in parser.canteens:
+        rules = parser.canteens[ref].get("categories", {}) | parser.global_categories
+        for category_img in list(rules) + [query[1:] for query in rules]:
+            assert parser.category_index(ref).resolve(category_img) == linear_lookup(rules, category_img)
+
+
+def day(name, image):
+    return (f'<div class="day"><div class="product"><div class="image" style="background-image: url({image})">'
+            f'</div><h4>{name}</h4></div></div>')
+
+
+def test_image_categories():
+    parser = Parser("http://localhost/")
+    ref = next(iter(parser.canteens))
+    html = ('<html><body><div id="week-content"><div class="day-header">'
+            '<div class="day"><span class="long"><small>19.10.2026</small></span></div>'
+            '<div class="day"><span class="long"><small>20.10.2026</small></span></div></div>'
+            f'<div class="menu-line">{day("Spaghetti", nudelbuffet)}{day("Penne", "https://x/unknown.jpg")}</div>'
+            f'<div class="menu-line">{day("Reis", "https://x/a_dummy%2Bklein.jpg")}'
+            f'{day("Suppe", "https://x/b.jpg")}</div>'
+            '</div></body></html>')
+    builder = StyledLazyBuilder()
+    parser.parseMeals(ref, builder, html)
+    feed = builder.toXMLFeed()
+    # An unknown image keeps the category of the previous day in the same line
+    assert feed.count('<category name="Nudelbuffet">') == 2, feed
+    assert feed.count('<category name="Essen 02">') == 2, feed
+
+
+def run_all():
+    for fname, f in list(globals().items()):
+        if fname.startswith('test_'):
+            print(f"{fname}()...")
+            f()
+            print(f"...{fname}() -> {greenOk}.")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    run_all()
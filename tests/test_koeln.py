@@ -0,0 +1,100 @@
+import sys
+import os
+import json
+import random
+import logging
+
+include = os.path.relpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, include)
+
+import koeln  # noqa: E402
+from koeln.cloudmensa import custom_fields_to_dict  # noqa: E402
+
+isPyIdle = "idlelib" in sys.modules
+endVT = "" if isPyIdle else "\033[0m"
+greenVT = "" if isPyIdle else "\033[1;32m"
+greenOk = f"{greenVT}Ok{endVT}"
+
+
+def matches_canteen(dish, canteen):
+    """The routing of a single dish before _routing_index: one dish against one canteen"""
+    customFields = custom_fields_to_dict(dish.get("custom_fields"))
+    dishOrtId = str(customFields.get("ort_id") or "").strip()
+    if dishOrtId:
+        if str(canteen.get("ort_id") or "").strip() != dishOrtId:
+            return False
+    elif not (koeln._canteen_screen_set(canteen) & koeln._dish_screen_set(dish, customFields)):
+        return False
+    return bool(koeln._pick_meal_name(dish, customFields))
+
+
+def random_canteens(rnd, screens):
+    canteens = {}
+    for i in range(rnd.randint(1, 6)):
+        canteens[f"mensa{i}"] = {
+            "ort_id": rnd.choice(["", None, " 201", "201", "202", "203"]),
+            "screen_locations": rnd.sample(screens, rnd.randint(0, 3)),
+        }
+    return canteens
+
+
+def random_dish(rnd, screens):
+    customFields = []
+    if rnd.random() < 0.5:
+        customFields.append({"field_id": "ort_id", "value": rnd.choice(["", "201", "202 ", "204"])})
+    if rnd.random() < 0.3:
+        customFields.append({"field_id": "location", "value": rnd.choice(screens).upper()})
+    if rnd.random() < 0.7:
+        customFields.append({"field_id": "dish_ger_1", "value": rnd.choice(["Pizza (A)", "Salat", ""])})
+    return {
+        "id": rnd.randint(1, 1000),
+        "name_de": rnd.choice(["", "Nudeln (1, 2)", "Beilage"]),
+        "screens": [{"location": f" {rnd.choice(screens)}"} for _ in range(rnd.randint(0, 2))],
+        "custom_fields": customFields,
+    }
+
+
+def assert_same_routing(menuData, canteens):
+    index = koeln._routing_index(menuData, canteens)
+    occurrences = iter(index["occurrences"])
+    expected = {canteenKey: [] for canteenKey in canteens}
+    for day in menuData:
+        for dish in day["dishes"]:
+            canteenKeys = [key for key, canteen in canteens.items() if matches_canteen(dish, canteen)]
+            assert next(occurrences)[5] == canteenKeys, (dish, canteens)
+            for canteenKey in canteenKeys:
+                expected[canteenKey].append(dish)
+    assert {key: [dish for _, dish, _, _ in dishes] for key, dishes in index["byCanteen"].items()} == expected
+
+
+def test_same_as_single_dish_matching():
+    rnd = random.Random(3)
+    screens = ["MZS - EG Nord 1", "Mensa Deutz", "Robert-Koch", "cafe"]
+    for _ in range(500):
+        canteens = random_canteens(rnd, screens)
+        menuData = [{"date": f"2026-10-{day:02d}", "dishes": [random_dish(rnd, screens) for _ in range(rnd.randint(0, 8))]}
+                    for day in range(19, 24)]
+        assert_same_routing(menuData, canteens)
+
+    with open(koeln.metaJson, 'r', encoding='utf8') as f:
+        canteens = json.load(f)
+    screens = sorted({screen for canteen in canteens.values() for screen in canteen.get("screen_locations", [])})
+    menuData = [{"date": "2026-10-19", "dishes": [random_dish(rnd, screens) for _ in range(300)]}]
+    for dish in menuData[0]["dishes"]:
+        for field in dish["custom_fields"]:
+            if field["field_id"] == "ort_id" and field["value"]:
+                field["value"] = rnd.choice([canteen.get("ort_id") or "" for canteen in canteens.values()])
+    assert_same_routing(menuData, canteens)
+
+
+def run_all():
+    for fname, f in list(globals().items()):
+        if fname.startswith('test_'):
+            print(f"{fname}()...")
+            f()
+            print(f"...{fname}() -> {greenOk}.")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    run_all()
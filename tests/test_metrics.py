@@ -0,0 +1,74 @@
+import sys
+import os
+import logging
+import datetime
+import urllib.request
+
+include = os.path.relpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, include)
+
+import metrics  # noqa: E402
+from util import StyledLazyBuilder  # noqa: E402
+
+isPyIdle = "idlelib" in sys.modules
+endVT = "" if isPyIdle else "\033[0m"
+greenVT = "" if isPyIdle else "\033[1;32m"
+greenOk = f"{greenVT}Ok{endVT}"
+
+
+def test_exposition():
+    counter = metrics.Counter('test_requests_total', 'Requests', ('host',))
+    histogram = metrics.Histogram('test_duration_seconds', 'Duration', buckets=(1, 5))
+    try:
+        counter.inc(host='a"b')
+        counter.inc(2, host='a"b')
+        histogram.observe(0.5)
+        histogram.observe(3)
+        text = metrics.render()
+        assert '# TYPE test_requests_total counter\ntest_requests_total{host="a\\"b"} 3\n' in text
+        assert 'test_duration_seconds_bucket{le="1"} 1\n' in text
+        assert 'test_duration_seconds_bucket{le="5"} 2\n' in text
+        assert 'test_duration_seconds_bucket{le="+Inf"} 2\n' in text
+        assert 'test_duration_seconds_sum 3.5\ntest_duration_seconds_count 2\n' in text
+    finally:
+        metrics._metrics.remove(counter)
+        metrics._metrics.remove(histogram)
+
+
+def test_feed_size():
+    builder = StyledLazyBuilder()
+    builder.addMeal(datetime.date(2024, 1, 1), 'Essen', 'Pizza')
+    builder.addMeal(datetime.date(2024, 1, 1), 'Essen', 'Pasta')
+    builder.setDayClosed(datetime.date(2024, 1, 2))
+    with metrics.feed('parser', 'canteen', 'feed'):
+        builder.toXMLFeed(styles=None)
+    labels = (('parser', 'parser'), ('canteen', 'canteen'), ('method', 'feed'))
+    assert metrics.feed_meals._values[labels] == 2
+    assert metrics.feed_days._values[labels] == 2
+    metrics.feed_meals.clear()
+    metrics.feed_days.clear()
+
+
+def test_serve():
+    server = metrics.serve(0)
+    try:
+        url = f'http://127.0.0.1:{server.server_address[1]}/metrics'
+        with urllib.request.urlopen(url) as response:
+            assert response.headers['Content-Type'].startswith('text/plain')
+            assert '# TYPE mensa_http_requests_total counter' in response.read().decode('utf8')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def run_all():
+    for fname, f in list(globals().items()):
+        if fname.startswith('test_'):
+            print(f"{fname}()...")
+            f()
+            print(f"...{fname}() -> {greenOk}.")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    run_all()
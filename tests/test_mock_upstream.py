@@ -0,0 +1,142 @@
+import sys
+import os
+import locale
+import tempfile
+import time
+import logging
+
+include = os.path.relpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, include)
+sys.path.insert(0, os.path.dirname(__file__))
+
+import fetch  # noqa: E402
+import updateFeeds  # noqa: E402
+from registry import allParsers  # noqa: E402
+from mock_upstream import MockUpstream  # noqa: E402
+
+isPyIdle = "idlelib" in sys.modules
+endVT = "" if isPyIdle else "\033[0m"
+greenVT = "" if isPyIdle else "\033[1;32m"
+greenOk = f"{greenVT}Ok{endVT}"
+
+
+def has_german_locale():
+    current = locale.setlocale(locale.LC_TIME)
+    try:
+        locale.setlocale(locale.LC_TIME, 'de_DE.UTF-8')
+        return True
+    except locale.Error:
+        return False
+    finally:
+        locale.setlocale(locale.LC_TIME, current)
+
+
+def test_all_parsers_offline():
+    """The first canteen of every parser has meals with the mock server as upstream"""
+    server = MockUpstream(meals=3, days=10).start()
+    fetch.set_upstream(server.url)
+    try:
+        for parserName in allParsers:
+            if parserName == 'wuerzburg' and not has_german_locale():
+                print(f"  {parserName}: skipped, no de_DE locale")
+                continue
+            parser = updateFeeds.loadParser(parserName, updateFeeds.base_url)[0]
+            mensaReference = next(iter(parser.canteens))
+            feedMethod = 'feed' if hasattr(parser, 'feed') else 'feed_all'
+            feed = getattr(parser, feedMethod)(mensaReference)
+            assert '<meal>' in feed, f"{parserName}/{mensaReference}: no meals in {feedMethod}"
+        assert not any(host.startswith('127.0.0.1') for host in server.requests)
+    finally:
+        fetch.set_upstream(None)
+        fetch.clear_cache()
+        server.stop()
+
+
+def test_koeln_menu_window():
+    """feed_today is answered from the two weeks of feed_all, also in the next run"""
+    import koeln
+    server = MockUpstream(meals=3, days=10).start()
+    fetch.set_upstream(server.url)
+    with tempfile.TemporaryDirectory() as cacheDir:
+        fetch.set_cache_dir(cacheDir)
+        try:
+            koeln._menuWindows.clear()
+            koeln._menuWindowsLoaded = False
+            parser = updateFeeds.loadParser('koeln', updateFeeds.base_url)[0]
+            mensaReference = next(iter(parser.canteens))
+            assert '<meal>' in parser.feed_all(mensaReference)
+            rpcs = sum(count for host, count in server.requests.items() if host.endswith('.supabase.co'))
+            assert '<meal>' in parser.feed_today(mensaReference)
+
+            # Next run
+            koeln._menuWindows.clear()
+            koeln._menuWindowsLoaded = False
+            assert '<meal>' in parser.feed_today(mensaReference)
+            assert rpcs == sum(count for host, count in server.requests.items() if host.endswith('.supabase.co'))
+        finally:
+            fetch.set_cache_dir(None)
+            fetch.set_upstream(None)
+            fetch.clear_cache()
+            server.stop()
+
+
+def test_koeln_api_config():
+    """The API configuration from the website is reused by the next run"""
+    import koeln
+    server = MockUpstream(meals=3, days=10).start()
+    fetch.set_upstream(server.url)
+    with tempfile.TemporaryDirectory() as cacheDir:
+        fetch.set_cache_dir(cacheDir)
+        try:
+            koeln._apiConfigCache = None
+            config = koeln._get_api_config()
+            website = server.requests['app.cloudmensa.io']
+            assert website
+
+            # Next run
+            koeln._apiConfigCache = None
+            assert koeln._get_api_config() == config
+            assert server.requests['app.cloudmensa.io'] == website
+        finally:
+            fetch.set_cache_dir(None)
+            fetch.set_upstream(None)
+            fetch.clear_cache()
+            server.stop()
+
+
+def test_koeln_api_config_backoff():
+    """A failed discovery is not repeated on every call"""
+    import koeln
+    attempts = []
+
+    def unavailable(slug):
+        attempts.append(slug)
+        raise RuntimeError("unavailable")
+
+    get_organization_data = koeln.get_organization_data
+    koeln.get_organization_data = unavailable
+    try:
+        koeln._apiConfigCache = None
+        koeln._apiConfigFetched = koeln._apiConfigAttempted = 0
+        for _ in range(20):
+            assert koeln._get_api_config()["organization_id"]
+        assert koeln._get_api_config(refresh=True)
+        time.sleep(0.2)  # a background refresh would have started by now
+        assert len(attempts) == 1
+    finally:
+        koeln.get_organization_data = get_organization_data
+        koeln._apiConfigCache = None
+        koeln._apiConfigFetched = koeln._apiConfigAttempted = 0
+
+
+def run_all():
+    for fname, f in list(globals().items()):
+        if fname.startswith('test_'):
+            print(f"{fname}()...")
+            f()
+            print(f"...{fname}() -> {greenOk}.")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    run_all()
@@ -0,0 +1,61 @@
+import sys
+import os
+import logging
+import datetime
+
+include = os.path.relpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, include)
+
+from schedule import CronExpression, Schedule  # noqa: E402
+
+isPyIdle = "idlelib" in sys.modules
+endVT = "" if isPyIdle else "\033[0m"
+greenVT = "" if isPyIdle else "\033[1;32m"
+greenOk = f"{greenVT}Ok{endVT}"
+
+
+def test_cron_expression():
+    today = CronExpression("32 7-11 * * 1-5")
+    assert today.matches(datetime.datetime(2024, 1, 8, 7, 32))  # monday
+    assert today.matches(datetime.datetime(2024, 1, 12, 11, 32))  # friday
+    assert not today.matches(datetime.datetime(2024, 1, 13, 7, 32))  # saturday
+    assert not today.matches(datetime.datetime(2024, 1, 8, 12, 32))
+    assert not today.matches(datetime.datetime(2024, 1, 8, 7, 33))
+
+    sunday = CronExpression("59 23 * * 7")
+    assert sunday.matches(datetime.datetime(2024, 1, 14, 23, 59))
+
+    every = CronExpression("*/15 * 1,15 * *")
+    assert every.matches(datetime.datetime(2024, 2, 15, 3, 45))
+    assert not every.matches(datetime.datetime(2024, 2, 16, 3, 45))
+
+    try:
+        CronExpression("60 * * * *")
+    except ValueError:
+        pass
+    else:
+        assert False, "Minute 60 should not be accepted"
+
+
+def test_schedule():
+    schedule = Schedule({
+        "*": {"full": ["12 6 * * *"], "today": ["32 7-11 * * 1-5"]},
+        "koeln": {"today": ["*/30 7-11 * * 1-5"]},
+    })
+    parsers = ["koeln", "markas"]
+    assert schedule.due(parsers, datetime.datetime(2024, 1, 8, 6, 12)) == {"full": parsers}
+    assert schedule.due(parsers, datetime.datetime(2024, 1, 8, 7, 30)) == {"today": ["koeln"]}
+    assert schedule.due(parsers, datetime.datetime(2024, 1, 8, 7, 32)) == {"today": ["markas"]}
+
+
+def run_all():
+    for fname, f in list(globals().items()):
+        if fname.startswith('test_'):
+            print(f"{fname}()...")
+            f()
+            print(f"...{fname}() -> {greenOk}.")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    run_all()
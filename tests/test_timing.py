@@ -0,0 +1,76 @@
+import sys
+import os
+import logging
+import time
+import tempfile
+
+include = os.path.relpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, include)
+
+import timing  # noqa: E402
+
+isPyIdle = "idlelib" in sys.modules
+endVT = "" if isPyIdle else "\033[0m"
+greenVT = "" if isPyIdle else "\033[1;32m"
+greenOk = f"{greenVT}Ok{endVT}"
+
+
+class FakeClock:
+    """Stands in for the time module in timing, sleep() advances the clock"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def perf_counter(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_phases():
+    timing.enabled = True
+    timing.clear()
+    clock = timing.time = FakeClock()
+    try:
+        with timing.record('parser', 'canteen', 'feed'):
+            clock.sleep(0.02)
+            with timing.phase('write'):
+                clock.sleep(0.01)
+                # Inner phases are not counted for the outer phase
+                with timing.phase('serialize'):
+                    clock.sleep(0.02)
+        with timing.phase('fetch'):
+            # Outside of a record
+            pass
+        row, = timing.records()
+        assert row['parse'] == 0.02
+        assert row['write'] == 0.01
+        assert row['serialize'] == 0.02
+        assert row['fetch'] == 0
+        assert row['total'] == 0.05
+
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'timings.csv')
+            timing.write_report(filename)
+            with open(filename, encoding='utf8') as f:
+                header, line = f.read().splitlines()
+            assert header == 'parser,canteen,method,fetch,parse,build,serialize,write,total'
+            assert line.startswith('parser,canteen,feed,0.0,')
+    finally:
+        timing.time = time
+        timing.enabled = False
+        timing.clear()
+
+
+def run_all():
+    for fname, f in list(globals().items()):
+        if fname.startswith('test_'):
+            print(f"{fname}()...")
+            f()
+            print(f"...{fname}() -> {greenOk}.")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    run_all()
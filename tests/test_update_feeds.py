@@ -0,0 +1,167 @@
+import sys
+import os
+import io
+import re
+import json
+import logging
+import shutil
+import random
+import tempfile
+
+include = os.path.relpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, include)
+sys.path.insert(0, os.path.dirname(__file__))
+
+import fetch  # noqa: E402
+import updateFeeds  # noqa: E402
+from mock_upstream import MockUpstream  # noqa: E402
+
+isPyIdle = "idlelib" in sys.modules
+endVT = "" if isPyIdle else "\033[0m"
+greenVT = "" if isPyIdle else "\033[1;32m"
+greenOk = f"{greenVT}Ok{endVT}"
+
+# Parsers with several canteens on the same host, wuerzburg fails without de_DE locale
+parserNames = ['markas', 'greifswald', 'kaiserslautern', 'eurest', 'wuerzburg']
+
+
+def run(basePath, **kwargs):
+    """updateFeeds() into `basePath`, returns (log, manifest, {filename: content})"""
+    logFile = io.StringIO()
+    previous, updateFeeds.log_file = updateFeeds.log_file, logFile
+    fetch.clear_cache()
+    kwargs.setdefault('updateIndex', False)
+    kwargs.setdefault('manifestPath', os.path.join(basePath, 'manifest.json'))
+    try:
+        updateFeeds.updateFeeds(basePath=basePath, cachePath='', **kwargs)
+    finally:
+        updateFeeds.log_file = previous
+        fetch.set_upstream(None)
+        fetch.clear_cache()
+    with open(kwargs['manifestPath'], 'r', encoding='utf8') as f:
+        manifest = json.loads(f.read().replace(basePath, 'docs/'))
+    files = {}
+    for folder in ('meta', 'feed'):
+        if not os.path.isdir(os.path.join(basePath, folder)):
+            continue
+        for filename in os.listdir(os.path.join(basePath, folder)):
+            with open(os.path.join(basePath, folder, filename), 'r', encoding='utf8') as f:
+                files[f"{folder}/{filename}"] = f.read()
+    return logFile.getvalue().replace(basePath, 'docs/'), manifest, files
+
+
+def test_jobs_same_output():
+    """-jobs and -host-jobs write the same files and the same log in the same order"""
+    server = MockUpstream(meals=3, days=10).start()
+    try:
+        results = []
+        for jobs, hostJobs in ((1, 1), (4, 3)):
+            with tempfile.TemporaryDirectory() as folder:
+                results.append(run(folder + os.sep, selectedParser=parserNames, upstream=server.url,
+                                   jobs=jobs, hostJobs=hostJobs))
+    finally:
+        server.stop()
+    (log, manifest, files), (parallelLog, parallelManifest, parallelFiles) = results
+    assert files and parallelFiles == files
+    assert parallelLog == log
+    assert log.index('🗳️ markas') < log.index('🗳️ greifswald') < log.index('🗳️ wuerzburg')
+    assert set(parallelManifest.pop('durations')) == set(manifest.pop('durations'))
+    assert parallelManifest == manifest
+
+
+def test_first_canteen_fails():
+    """An IOError in the first canteen skips the rest of the parser, also with -host-jobs"""
+    server = MockUpstream().start()
+    server.stop()
+    for jobs in (1, 4):
+        with tempfile.TemporaryDirectory() as folder:
+            log, manifest, files = run(folder + os.sep, selectedParser=['markas', 'greifswald'],
+                                       upstream=server.url, updateMeta=False, jobs=jobs, hostJobs=4)
+        assert not files
+        assert log.count('🏫') == 2, log
+        assert [error for error in manifest['errors'] if error.endswith(':')] == ['markas:', 'greifswald:']
+
+
+def all_shards(count, durations, names=parserNames):
+    return [updateFeeds.shardUnits(names, (index, count), durations, updateFeeds.base_url)
+            for index in range(1, count + 1)]
+
+
+def test_shards_partition():
+    """The shards are disjoint and together contain every canteen, also of a parser that can't be loaded"""
+    names = parserNames + ['no_such_parser']
+    units = all_shards(1, {}, names)[0]
+    assert ('no_such_parser', None) in units
+    assert ('markas', 'sulmona.infanzia') in units
+    for count in (2, 3, 7):
+        shards = all_shards(count, {}, names)
+        assert sum(len(shard) for shard in shards) == len(units)
+        assert set().union(*shards) == units
+        # Without durations every canteen costs the same
+        assert max(map(len, shards)) - min(map(len, shards)) <= 1
+        # Every shard computes the same partition
+        assert all_shards(count, {}, names) == shards
+
+
+def test_shards_balanced():
+    """Weighted with -costs, no shard is more than the most expensive canteen above another one"""
+    rnd = random.Random(11)
+    units = all_shards(1, {})[0]
+    for count in (2, 3, 5):
+        durations = {f"{parserName}/{reference}": rnd.choice([0.01, 0.1, rnd.uniform(0, 5)])
+                     for parserName, reference in units if rnd.random() < 0.9}
+        known = sorted(durations.values())
+        median = known[len(known) // 2]
+
+        def cost(unit):
+            return durations.get(f"{unit[0]}/{unit[1]}", median)
+
+        loads = [sum(cost(unit) for unit in shard) for shard in all_shards(count, durations)]
+        assert max(loads) - min(loads) <= max(map(cost, units)) + 1e-9, loads
+
+
+def test_merge_shards():
+    """The -merge manifest and index.html of three shards are those of an unsharded run"""
+    names = ['markas', 'greifswald', 'kaiserslautern', 'eurest']
+    server = MockUpstream(meals=3, days=10).start()
+    with tempfile.TemporaryDirectory() as folder:
+        try:
+            full = os.path.join(folder, 'full') + os.sep
+            fullLog, fullManifest, fullFiles = run(full, selectedParser=names, upstream=server.url, updateIndex=True)
+            merged = os.path.join(folder, 'merged') + os.sep
+            manifests = []
+            for index in (1, 2, 3):
+                basePath = os.path.join(folder, f'shard{index}') + os.sep
+                manifests.append(os.path.join(folder, f'manifest-{index}.json'))
+                log, manifest, files = run(basePath, selectedParser=names, upstream=server.url,
+                                           shard=(index, 3), manifestPath=manifests[-1])
+                assert manifest['shard'] == f'{index}/3'
+                assert files and not os.path.exists(os.path.join(basePath, 'index.html'))
+                shutil.copytree(basePath, merged, dirs_exist_ok=True)
+        finally:
+            server.stop()
+
+        log, manifest, files = run(merged, mergePaths=manifests, updateIndex=True)
+        assert files == fullFiles
+        # The shards list the files in their own output directory
+        manifest = {key: sorted(re.sub(r'^.*?shard\d' + re.escape(os.sep), 'docs/', name) for name in value)
+                    if isinstance(value, list) else value for key, value in manifest.items()}
+        assert set(manifest.pop('durations')) == set(fullManifest.pop('durations'))
+        assert manifest == fullManifest
+        with open(os.path.join(merged, 'index.html'), 'r', encoding='utf8') as f:
+            index = f.read()
+        with open(os.path.join(full, 'index.html'), 'r', encoding='utf8') as f:
+            assert f.read() == index
+
+
+def run_all():
+    for fname, f in list(globals().items()):
+        if fname.startswith('test_'):
+            print(f"{fname}()...")
+            f()
+            print(f"...{fname}() -> {greenOk}.")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    run_all()
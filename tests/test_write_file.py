@@ -0,0 +1,44 @@
+import sys
+import os
+import logging
+import tempfile
+
+include = os.path.relpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, include)
+
+import updateFeeds  # noqa: E402
+
+isPyIdle = "idlelib" in sys.modules
+endVT = "" if isPyIdle else "\033[0m"
+greenVT = "" if isPyIdle else "\033[1;32m"
+greenOk = f"{greenVT}Ok{endVT}"
+
+
+def test_stream_and_write_agree():
+    """writeFile() and streamFile() treat whitespace between tags the same way"""
+    original = '<openmensa>\n  <canteen>\n    <day date="2024-01-01"/>\n  </canteen>\n</openmensa>\n'
+    reformatted = '<openmensa><canteen>\r\n<day date="2024-01-01"/></canteen></openmensa>'
+    changed = original.replace('2024-01-01', '2024-01-02')
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'feed', 'test.xml')
+        assert updateFeeds.writeFile(filename, original)
+        assert not updateFeeds.writeFile(filename, reformatted)
+        assert not updateFeeds.streamFile(filename, lambda f: f.write(reformatted))
+        with open(filename, 'r', encoding='utf8', newline='') as f:
+            assert f.read() == original
+        assert updateFeeds.streamFile(filename, lambda f: f.write(changed))
+        assert not updateFeeds.writeFile(filename, changed)
+        assert os.listdir(os.path.dirname(filename)) == ['test.xml']
+
+
+def run_all():
+    for fname, f in list(globals().items()):
+        if fname.startswith('test_'):
+            print(f"{fname}()...")
+            f()
+            print(f"...{fname}() -> {greenOk}.")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    run_all()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+"""
+Time spent per phase of each generated file
+
+updateFeeds.py opens a record() for each (parser, canteen, feed method).
+Inside of it, phase() measures the time of fetch, parse, build, serialize
+and write. A phase that runs inside another phase is only counted for the
+inner phase, so the phases of a record add up to its total time.
+Time that is not in any other phase, e.g. BeautifulSoup in the parser, is "parse".
+"""
+
+import csv
+import json
+import time
+import threading
+import contextlib
+import contextvars
+
+__all__ = ['phases', 'enabled', 'record', 'phase', 'records', 'clear', 'write_report']
+
+phases = ('fetch', 'parse', 'build', 'serialize', 'write')
+enabled = False
+
+_current = contextvars.ContextVar('timing', default=None)
+_records = []
+_lock = threading.Lock()
+
+
+class _Record:
+    def __init__(self, labels):
+        self.labels = labels
+        self.phases = dict.fromkeys(phases, 0.0)
+
+    def add(self, name, seconds):
+        with _lock:
+            self.phases[name] += seconds
+
+
+class _Frame:
+    """Running phase, collects the time of the phases inside of it"""
+    __slots__ = ('record', 'inner')
+
+    def __init__(self, record):
+        self.record = record
+        self.inner = 0.0
+
+
+class phase:
+    """Context manager that adds its time to the phase `name` of the current record"""
+    __slots__ = ('name', 'frame', 'parent', 'token', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.parent = _current.get()
+        if self.parent is None:
+            return self
+        self.frame = _Frame(self.parent.record)
+        self.token = _current.set(self.frame)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.parent is None:
+            return
+        elapsed = time.perf_counter() - self.start
+        _current.reset(self.token)
+        self.frame.record.add(self.name, max(0.0, elapsed - self.frame.inner))
+        with _lock:
+            self.parent.inner += elapsed
+
+
+@contextlib.contextmanager
+def record(parser, canteen, method):
+    """Measure the phases of one generated file"""
+    if not enabled:
+        yield
+        return
+    current = _Record({"parser": parser, "canteen": canteen, "method": method})
+    token = _current.set(_Frame(current))
+    try:
+        with phase('parse'):
+            yield
+    finally:
+        _current.reset(token)
+    with _lock:
+        _records.append(current)
+
+
+def records():
+    """The measurements of all records as a list of dicts, times in seconds"""
+    with _lock:
+        result = []
+        for item in _records:
+            row = dict(item.labels)
+            row.update((name, round(seconds, 4)) for name, seconds in item.phases.items())
+            row["total"] = round(sum(item.phases.values()), 4)
+            result.append(row)
+        return result
+
+
+def clear():
+    with _lock:
+        _records.clear()
+
+
+def write_report(filename):
+    """Write all records to a .csv file, or to a JSON file for any other extension"""
+    rows = records()
+    if filename.lower().endswith('.csv'):
+        with open(filename, 'w', encoding='utf8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=["parser", "canteen", "method", *phases, "total"])
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        totals = {name: round(sum(row[name] for row in rows), 4) for name in (*phases, "total")}
+        with open(filename, 'w', encoding='utf8', newline='\n') as f:
+            json.dump({"totals": totals, "records": rows}, f, indent=2)
@@ -6,29 +6,160 @@ import traceback
 import argparse
 import urllib3
 import string
-
-allParsers = ['kaiserslautern', 'mensenat', 'koeln',
-              'eurest', 'markas', 'mampf1a', 'inetmenue',
-              'greifswald', 'wuerzburg']
+import threading
+import contextlib
+import concurrent.futures
+import hashlib
+import glob
+import json
+import re
+import tempfile
+import time
+import datetime
+import subprocess
+
+import fetch
+import timing
+import metrics
+from registry import allParsers, canteenFiles, mayHaveCanteen
+from schedule import Schedule
 
 repo_path = os.path.dirname(__file__)
 filename_template = "{base}{{metaOrFeed}}/{parserName}_{{mensaReference}}.xml"
 base_url = "https://cvzi.github.io/mensa/"
 base_repo = "https://github.com/cvzi/mensa/"
 base_path = "docs/"
+cache_path = ".cache/"
+schedule_path = "schedule.json"
 
 
 log_file = None
+# Output file -> URLs (with content fingerprints) that the file was generated from
+feedDependencies = {}
+# Files of the current run, see writeFile() and outputFile()
+runManifest = {"changed": [], "unchanged": [], "failed": []}
+# Seconds per "parser/canteen" of the current run, used to balance shards
+canteenDurations = {}
+# (parserName, urlTemplate) -> (parser, sourceVersion, metaVersion) that are kept between runs
+loadedParsers = {}
 greenOk = "Ok" if "idlelib" in sys.modules else "\033[1;32mOk\033[0m"
 redError = "Error" if "idlelib" in sys.modules else "\033[1;31m⚠️ Error\033[0m"
 
 
+_logBuffer = threading.local()
+
+
 def log(*objects, sep=' ', end='\n', file=sys.stdout, flush=False):
+    chunks = getattr(_logBuffer, 'chunks', None)
+    if chunks is not None:
+        # Inside a worker thread: keep the output until it's this worker's turn
+        chunks.append((file, sep.join(str(obj) for obj in objects) + end))
+        return
     print(*objects, sep=sep, end=end, file=file, flush=flush)
     if log_file and not log_file.closed:
         print(*objects, sep=sep, end=end, file=log_file, flush=flush)
 
 
+@contextlib.contextmanager
+def bufferedLog():
+    """Collect all log() calls of the current thread instead of printing them"""
+    previous = getattr(_logBuffer, 'chunks', None)
+    _logBuffer.chunks = []
+    try:
+        yield _logBuffer.chunks
+    finally:
+        _logBuffer.chunks = previous
+
+
+def flushLog(chunks):
+    for file, text in chunks:
+        log(text, end='', file=file, flush=True)
+
+
+_interTagWhitespace = re.compile(rb'>\s+<')
+
+
+def contentHash(data):
+    """Hash of the content, ignoring whitespace between tags and line endings"""
+    data = data.replace(b'\r\n', b'\n').strip()
+    return hashlib.sha256(_interTagWhitespace.sub(b'><', data)).hexdigest()
+
+
+def sameContent(path, otherPath):
+    """True if both files have the same contentHash()"""
+    with open(path, 'rb') as f, open(otherPath, 'rb') as other:
+        return contentHash(f.read()) == contentHash(other.read())
+
+
+def writeFile(filename, content):
+    """Write `content` to the file, unless the file already has the same content.
+    Returns True if the file was written."""
+    data = content if isinstance(content, bytes) else content.encode('utf8')
+    path = os.path.join(repo_path, filename)
+    try:
+        with open(path, 'rb') as f:
+            unchanged = contentHash(f.read()) == contentHash(data)
+    except OSError:
+        unchanged = False
+    if unchanged:
+        runManifest["unchanged"].append(filename)
+        return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    runManifest["changed"].append(filename)
+    return True
+
+
+def streamFile(filename, write):
+    """Like writeFile(), but write(fileobj) writes the content to a temporary
+    text file that replaces the file only if the content changed"""
+    path = os.path.join(repo_path, filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with io.open(fd, 'w', encoding='utf8', newline='') as f:
+            # The parser runs inside of write(), only the file operations are "write"
+            with timing.phase('parse'):
+                write(f)
+        if os.path.isfile(path) and sameContent(tmp, path):
+            os.remove(tmp)
+            runManifest["unchanged"].append(filename)
+            return False
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        raise
+    runManifest["changed"].append(filename)
+    return True
+
+
+@contextlib.contextmanager
+def outputFile(filename):
+    """Record the file as failed in the manifest if generating it raises an exception"""
+    try:
+        yield
+    except BaseException:
+        runManifest["failed"].append(filename)
+        raise
+
+
+def logWritten(written):
+    log(f"  {greenOk}" if written else f"  {greenOk} (unchanged)")
+
+
+def writeManifest(filename, errors, shard=None):
+    manifest = {key: sorted(files) for key, files in runManifest.items()}
+    manifest["errors"] = errors
+    manifest["durations"] = dict(sorted(canteenDurations.items()))
+    if shard:
+        manifest["shard"] = "%d/%d" % shard
+    with io.open(filename, 'w', encoding='utf8', newline='\n') as f:
+        json.dump(manifest, f, indent=2)
+
+
 def generateIndexHtml(baseUrl, basePath, errors=None):
     files = []
 
@@ -75,8 +206,299 @@ def generateIndexHtml(baseUrl, basePath, errors=None):
     if errors:
         status += '\n<pre>' + '\n'.join(errors) + '</pre>'
 
-    with io.open(os.path.join(repo_path, basePath, 'index.html'), 'w', encoding='utf8', newline='\n') as f:
-        f.write(template.substitute(content=content, status=status))
+    return writeFile(os.path.join(basePath, 'index.html'), template.substitute(content=content, status=status))
+
+
+def sourceFingerprint(module, parserName=None):
+    """Fingerprint of the parser's code and data files, e.g. the canteen json,
+    so results of an older version are not reused"""
+    digest = hashlib.sha1()
+    parserDir = os.path.dirname(module.__file__)
+    files = set()
+    for pattern in ('*.py', '*.json', '*.json5'):
+        files.update(glob.glob(os.path.join(parserDir, pattern)))
+    if parserName in canteenFiles:
+        files.add(os.path.join(repo_path, canteenFiles[parserName]))
+    files = sorted({os.path.abspath(file) for file in files})
+    files.append(os.path.join(repo_path, 'util.py'))
+    for file in files:
+        with open(file, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def metaFingerprint(module, parser, urlTemplate, sourceVersion):
+    """Fingerprint of the parts that all meta files of a parser are generated from:
+    parser code, XSLT/XML template and the url template"""
+    digest = hashlib.sha1(f"{sourceVersion}\n{urlTemplate}\n".encode('utf8'))
+    template = getattr(parser, 'meta_xslt', None) or getattr(module, 'metaTemplateFile', None)
+    if template and os.path.isfile(template):
+        with open(template, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def canteenFingerprint(metaVersion, canteen):
+    """Fingerprint of a meta file: the parser's meta fingerprint and the canteen entry"""
+    digest = hashlib.sha1(metaVersion.encode('utf8'))
+    digest.update(json.dumps(canteen, sort_keys=True, default=str).encode('utf8'))
+    return digest.hexdigest()
+
+
+def feedUpToDate(filename, sourceVersion):
+    """True if the file exists and all upstream pages it was generated from are unchanged"""
+    entry = feedDependencies.get(filename)
+    if not entry or entry["source"] != sourceVersion:
+        return False
+    if not os.path.isfile(os.path.join(repo_path, filename)):
+        return False
+    return fetch.unchanged(entry["urls"])
+
+
+def generateFile(filename, version, generate, force=False, static=False, write=None):
+    """Call generate() and write the result to the file, unless the
+    recorded inputs of the file are unchanged.
+    `static` files may have no upstream requests at all, e.g. meta files.
+    If `write` is given, write(fileobj) streams the content to the file instead."""
+    with outputFile(filename):
+        if not force and fetch.cache_dir and feedUpToDate(filename, version):
+            runManifest["unchanged"].append(filename)
+            log(f"  {greenOk} (not modified)")
+            return
+        with fetch.track_dependencies() as dependencies:
+            if write:
+                with timing.phase('write'):
+                    written = streamFile(filename, write)
+            else:
+                content = generate()
+                with timing.phase('write'):
+                    written = writeFile(filename, content)
+    if dependencies.complete and (static or dependencies.urls):
+        feedDependencies[filename] = {
+            "source": version, "urls": dependencies.urls}
+    else:
+        feedDependencies.pop(filename, None)
+    logWritten(written)
+
+
+def updateCanteen(parser, parserName, mensaReference, updateMeta, updateFeed, updateToday, basePath,
+                  force=False, sourceVersion=None, metaVersion=None):
+    log(f"  - 🏫 {mensaReference}")
+    if updateMeta:
+        filename = filename_template.format(base=basePath, parserName=parserName).format(
+            metaOrFeed='meta', mensaReference=mensaReference)
+        log(f"    - 🈺 {filename}", end="", flush=True)
+        # Fingerprint before calling meta(), some parsers modify the canteen entry
+        version = canteenFingerprint(metaVersion, parser.canteens[mensaReference])
+        with timing.record(parserName, mensaReference, 'meta'), metrics.feed(parserName, mensaReference, 'meta'):
+            generateFile(filename, version, lambda: parser.meta(mensaReference),
+                         force=force, static=True)
+    if updateFeed or updateToday:
+        if updateToday:
+            feedMethods = [feedMethod for feedMethod in [
+                "feed_today"] if hasattr(parser, feedMethod)]
+            if not feedMethods and not updateMeta:
+                log("\033[F\033[K", end="")
+        else:
+            feedMethods = [feedMethod for feedMethod in [
+                "feed", "feed_today", "feed_all", "feed_full"] if hasattr(parser, feedMethod)]
+        for feedMethod in feedMethods:
+            fileTitle = "today" if feedMethod == "feed_today" else "feed"
+            filename = filename_template.format(base=basePath, parserName=parserName).format(
+                metaOrFeed=fileTitle, mensaReference=mensaReference)
+            log(f"    - 🍱 {filename}", end="", flush=True)
+            writer = getattr(parser, f"write_{feedMethod}", None)
+            with timing.record(parserName, mensaReference, feedMethod), \
+                    metrics.feed(parserName, mensaReference, feedMethod):
+                generateFile(filename, sourceVersion,
+                             lambda: getattr(parser, feedMethod)(mensaReference), force=force,
+                             write=writer and (lambda f: writer(mensaReference, f)))
+
+
+def updateCanteenSafe(parser, parserName, mensaReference, isFirst, errors, **kwargs):
+    startTime = time.perf_counter()
+    try:
+        updateCanteen(parser, parserName, mensaReference, **kwargs)
+    except KeyboardInterrupt as e:
+        raise e
+    except (IOError, urllib3.exceptions.HTTPError) as e:
+        if isFirst:
+            # Assumption: this errors affects the whole parser, skip the whole parser
+            raise e
+        else:
+            metrics.errors.inc(parser=parserName, type=type(e).__name__)
+            log(f"  {redError}")
+            log(traceback.format_exc(), end="", file=sys.stderr)
+    except BaseException as e:
+        metrics.errors.inc(parser=parserName, type=type(e).__name__)
+        log(f"  {redError}")
+        log(traceback.format_exc(), end="", file=sys.stderr)
+        errors.append(f"{parserName}/{mensaReference}:")
+        errors.append(traceback.format_exc())
+    finally:
+        duration = time.perf_counter() - startTime
+        canteenDurations[f"{parserName}/{mensaReference}"] = round(duration, 3)
+        metrics.canteen_duration.observe(duration, parser=parserName)
+
+
+def bufferedCanteen(*args, **kwargs):
+    """Run updateCanteenSafe() in a worker thread and collect its log output and errors"""
+    errors = []
+    with bufferedLog() as chunks:
+        updateCanteenSafe(*args, errors=errors, **kwargs)
+    return chunks, errors
+
+
+def loadParser(parserName, baseUrl, reuse=False):
+    """Import the parser module and create the Parser.
+    With `reuse`, the Parser is kept for the next run and only its caches are cleared."""
+    urlTemplate = filename_template.format(base=baseUrl, parserName=parserName)
+    key = (parserName, urlTemplate)
+    if reuse and key in loadedParsers:
+        parser = loadedParsers[key][0]
+        if hasattr(parser, 'clear_cache'):
+            parser.clear_cache()
+        return loadedParsers[key]
+    module = importlib.import_module(parserName)
+    parser = module.Parser(urlTemplate)
+    sourceVersion = sourceFingerprint(module, parserName)
+    entry = (parser, sourceVersion, metaFingerprint(module, parser, urlTemplate, sourceVersion))
+    if reuse:
+        loadedParsers[key] = entry
+    return entry
+
+
+def updateParser(parserName, errors, jobs, hostJobs, updateJson, selectedMensa, baseUrl, basePath,
+                 shardUnits=None, reuseParsers=False, **kwargs):
+    log(f"🗳️ {parserName}")
+    try:
+        parser, kwargs["sourceVersion"], kwargs["metaVersion"] = loadParser(
+            parserName, baseUrl, reuseParsers)
+
+        if shardUnits is not None:
+            # The json file belongs to the shard of the first canteen
+            updateJson = updateJson and (parserName, next(iter(parser.canteens), None)) in shardUnits
+
+        if updateJson:
+            filename = os.path.join(basePath, f'{parserName}.json')
+            log(f" - 🐏 {filename}", end="", flush=True)
+            with outputFile(filename):
+                logWritten(writeFile(filename, parser.json()))
+
+        mensaReferences = [mensaReference for mensaReference in parser.canteens
+                           if (not selectedMensa or selectedMensa == mensaReference) and
+                           (shardUnits is None or (parserName, mensaReference) in shardUnits)]
+        if jobs <= 1 or hostJobs <= 1 or len(mensaReferences) < 2:
+            for canteenCounter, mensaReference in enumerate(mensaReferences):
+                updateCanteenSafe(parser, parserName, mensaReference,
+                                  canteenCounter == 0, errors, basePath=basePath, **kwargs)
+        else:
+            # The first canteen runs alone, so that an IOError can still skip the whole parser
+            updateCanteenSafe(parser, parserName, mensaReferences[0],
+                              True, errors, basePath=basePath, **kwargs)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=hostJobs) as executor:
+                futures = [executor.submit(bufferedCanteen, parser, parserName, mensaReference,
+                                           False, basePath=basePath, **kwargs)
+                           for mensaReference in mensaReferences[1:]]
+                for future in futures:
+                    chunks, canteenErrors = future.result()
+                    flushLog(chunks)
+                    errors.extend(canteenErrors)
+
+    except KeyboardInterrupt as e:
+        raise e
+    except BaseException as e:
+        metrics.errors.inc(parser=parserName, type=type(e).__name__)
+        log(f"  {redError}")
+        errors.append(f"{parserName}:")
+        errors.append(traceback.format_exc())
+        log(traceback.format_exc(), end="", file=sys.stderr)
+
+
+def parseShard(value):
+    """Parse "i/N" to (i, N)"""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got '{value}'")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"shard {index} is not between 1 and {count}")
+    return index, count
+
+
+def loadDurations(filename):
+    """Durations per canteen from the manifest of an earlier run"""
+    try:
+        with open(filename, 'r', encoding='utf8') as f:
+            return json.load(f).get("durations", {})
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+
+def shardUnits(parserNames, shard, durations, baseUrl):
+    """The (parserName, mensaReference) pairs of this shard.
+
+    All canteens are distributed with the longest-processing-time rule, weighted
+    with the durations of an earlier run, so every shard computes the same partition.
+    A parser that cannot be loaded is a single unit (parserName, None)."""
+    units = []
+    for parserName in parserNames:
+        try:
+            module = importlib.import_module(parserName)
+            parser = module.Parser(filename_template.format(base=baseUrl, parserName=parserName))
+            units.extend((parserName, mensaReference) for mensaReference in parser.canteens)
+        except Exception:
+            units.append((parserName, None))
+
+    known = sorted(durations.values())
+    defaultCost = known[len(known) // 2] if known else 1.0
+
+    def cost(unit):
+        return durations.get(f"{unit[0]}/{unit[1]}", defaultCost)
+
+    index, count = shard
+    loads = [0.0] * count
+    selected = set()
+    for unit in sorted(units, key=lambda unit: (-cost(unit), unit[0], unit[1] or '')):
+        target = min(range(count), key=lambda i: (loads[i], i))
+        loads[target] += cost(unit)
+        if target == index - 1:
+            selected.add(unit)
+    return selected
+
+
+def mergeManifests(filenames, manifestPath, updateIndex, baseUrl, basePath):
+    """Combine the manifests of all shards and rebuild index.html once.
+    The output directories of the shards must already be copied to `basePath`."""
+    errors = []
+    for files in runManifest.values():
+        files.clear()
+    canteenDurations.clear()
+    for filename in filenames:
+        log(f" - 🧩 {filename}")
+        with open(filename, 'r', encoding='utf8') as f:
+            manifest = json.load(f)
+        for key, files in runManifest.items():
+            files.extend(manifest.get(key, []))
+        errors.extend(manifest.get("errors", []))
+        canteenDurations.update(manifest.get("durations", {}))
+
+    if updateIndex:
+        log(" - 📄 index.html", end="", flush=True)
+        logWritten(generateIndexHtml(baseUrl=baseUrl, basePath=basePath, errors=errors))
+
+    if manifestPath:
+        writeManifest(manifestPath, errors)
+
+    return min(0, len(errors))
+
+
+def bufferedParser(*args, **kwargs):
+    """Run updateParser() in a worker thread and collect its log output and errors"""
+    errors = []
+    with bufferedLog() as chunks:
+        updateParser(*args, errors=errors, **kwargs)
+    return chunks, errors
 
 
 def updateFeeds(force=None,
@@ -88,103 +510,191 @@ def updateFeeds(force=None,
                 selectedParser='',
                 selectedMensa='',
                 baseUrl=base_url,
-                basePath=base_path):
+                basePath=base_path,
+                cachePath=cache_path,
+                manifestPath='',
+                jobs=1,
+                hostJobs=2,
+                rate=None,
+                maxInFlight=4,
+                shard=None,
+                costsPath='',
+                mergePaths=None,
+                reuseParsers=False,
+                timingsPath='',
+                metricsPath='',
+                recordPath='',
+                replayPath='',
+                upstream='',
+                htmlParser=''):
+
+    if mergePaths:
+        return mergeManifests(mergePaths, manifestPath, updateIndex, baseUrl, basePath)
 
     errors = []
-
-    for parserName in allParsers:
-        if not updateJson and not updateMeta and not updateFeed and not updateToday:
-            continue
-        if selectedParser and parserName != selectedParser:
-            continue
-        log(f"🗳️ {parserName}")
-        try:
-            module = importlib.import_module(parserName)
-            parser = module.Parser(filename_template.format(
-                base=baseUrl, parserName=parserName))
-
-            if updateJson:
-                filename = os.path.join(basePath, f'{parserName}.json')
-                log(f" - 🐏 {filename}", end="", flush=True)
-                os.makedirs(os.path.dirname(filename), exist_ok=True)
-                content = parser.json()
-                with io.open(os.path.join(repo_path, filename), 'w', encoding='utf8', newline='\n') as f:
-                    f.write(content)
-                log(f"  {greenOk}")
-
-            canteenCounter = 0
-            for mensaReference in parser.canteens:
-                if selectedMensa and selectedMensa != mensaReference:
-                    continue
-                log(f"  - 🏫 {mensaReference}")
+    for files in runManifest.values():
+        files.clear()
+    canteenDurations.clear()
+    timing.enabled = bool(timingsPath)
+    timing.clear()
+
+    fetch.set_host_limits(rate or None, maxInFlight or None)
+    fetch.set_upstream(upstream or None)
+    if htmlParser:
+        import util
+        util.default_html_parser = htmlParser
+    if recordPath or replayPath:
+        fetch.set_fixtures(recordPath or replayPath, recording=bool(recordPath))
+
+    if cachePath:
+        fetch.set_cache_dir(os.path.join(repo_path, cachePath))
+        feedDependencies.update(fetch.load_state('feeds', {}))
+
+    if isinstance(selectedParser, str):
+        selectedParser = [selectedParser] if selectedParser else []
+    parserNames = [parserName for parserName in allParsers
+                   if not selectedParser or parserName in selectedParser]
+    if selectedMensa:
+        parserNames = [parserName for parserName in parserNames
+                       if mayHaveCanteen(parserName, selectedMensa)]
+    if not updateJson and not updateMeta and not updateFeed and not updateToday:
+        parserNames = []
+
+    units = None
+    if shard:
+        units = shardUnits(parserNames, shard, loadDurations(costsPath) if costsPath else {}, baseUrl)
+        parserNames = [parserName for parserName in parserNames
+                       if any(unit[0] == parserName for unit in units)]
+        # index.html is generated once by the merge step
+        updateIndex = False
+        if not manifestPath:
+            manifestPath = "manifest-%d-of-%d.json" % shard
+
+    kwargs = {
+        "jobs": jobs,
+        "hostJobs": hostJobs,
+        "updateJson": updateJson,
+        "updateMeta": updateMeta,
+        "updateFeed": updateFeed,
+        "updateToday": updateToday,
+        "selectedMensa": selectedMensa,
+        "baseUrl": baseUrl,
+        "basePath": basePath,
+        "shardUnits": units,
+        "reuseParsers": reuseParsers,
+        "force": bool(force)
+    }
+
+    try:
+        if jobs <= 1:
+            for parserName in parserNames:
+                updateParser(parserName, errors, **kwargs)
+        else:
+            # Parsers run concurrently, the output is printed in the order of allParsers
+            with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+                futures = [executor.submit(bufferedParser, parserName, **kwargs)
+                           for parserName in parserNames]
                 try:
-                    if updateMeta:
-                        filename = filename_template.format(base=basePath, parserName=parserName).format(
-                            metaOrFeed='meta', mensaReference=mensaReference)
-                        log(f"    - 🈺 {filename}", end="", flush=True)
-                        os.makedirs(os.path.dirname(filename), exist_ok=True)
-                        content = parser.meta(mensaReference)
-                        with io.open(os.path.join(repo_path, filename), 'w', encoding='utf8', newline='\n') as f:
-                            f.write(content)
-                        log(f"  {greenOk}")
-                    if updateFeed or updateToday:
-                        if updateToday:
-                            feedMethods = [feedMethod for feedMethod in [
-                                "feed_today"] if hasattr(parser, feedMethod)]
-                            if not feedMethods and not updateMeta:
-                                log("\033[F\033[K", end="")
-                        else:
-                            feedMethods = [feedMethod for feedMethod in [
-                                "feed", "feed_today", "feed_all", "feed_full"] if hasattr(parser, feedMethod)]
-                        for feedMethod in feedMethods:
-                            fileTitle = "today" if feedMethod == "feed_today" else "feed"
-                            filename = filename_template.format(base=basePath, parserName=parserName).format(
-                                metaOrFeed=fileTitle, mensaReference=mensaReference)
-                            log(f"    - 🍱 {filename}", end="", flush=True)
-                            os.makedirs(os.path.dirname(
-                                filename), exist_ok=True)
-                            content = getattr(parser, feedMethod)(
-                                mensaReference)
-                            if type(content) is bytes:
-                                with open(os.path.join(repo_path, filename), 'wb') as f:
-                                    f.write(content)
-                            else:
-                                with io.open(os.path.join(repo_path, filename), 'w', encoding='utf8', newline='\n') as f:
-                                    f.write(content)
-                            log(f"  {greenOk}")
+                    for future in futures:
+                        chunks, parserErrors = future.result()
+                        flushLog(chunks)
+                        errors.extend(parserErrors)
                 except KeyboardInterrupt as e:
+                    executor.shutdown(wait=False, cancel_futures=True)
                     raise e
-                except (IOError, urllib3.exceptions.HTTPError) as e:
-                    if canteenCounter == 0:
-                        # Assumption: this errors affects the whole parser, skip the whole parser
-                        raise e
-                    else:
-                        log(f"  {redError}")
-                        traceback.print_exc()
-                except BaseException:
-                    log(f"  {redError}")
-                    traceback.print_exc()
-                    errors.append(f"{parserName}/{mensaReference}:")
-                    errors.append(traceback.format_exc())
-                canteenCounter += 1
-
-        except KeyboardInterrupt:
-            log(" [Control-C]")
-            return 130
-        except BaseException:
-            log(f"  {redError}")
-            errors.append(f"{parserName}:")
-            errors.append(traceback.format_exc())
-            traceback.print_exc()
+    except KeyboardInterrupt:
+        log(" [Control-C]")
+        return 130
+    finally:
+        if recordPath:
+            log(f" - 📼 {recordPath}", end="", flush=True)
+            fetch.close_fixtures()
+            log(f"  {greenOk}")
+        elif replayPath:
+            fetch.close_fixtures()
+
+    if cachePath:
+        fetch.save_state('feeds', feedDependencies)
+        fetch.prune_cache()
 
     if updateIndex:
         log(" - 📄 index.html", end="", flush=True)
-        generateIndexHtml(baseUrl=baseUrl, basePath=basePath, errors=errors)
+        logWritten(generateIndexHtml(baseUrl=baseUrl, basePath=basePath, errors=errors))
+
+    if manifestPath:
+        writeManifest(manifestPath, errors, shard)
+
+    if timingsPath:
+        log(f" - ⏱️ {timingsPath}", end="", flush=True)
+        timing.write_report(timingsPath)
+        log(f"  {greenOk}")
+
+    for result, files in runManifest.items():
+        metrics.files.set(len(files), result=result)
+    metrics.last_run.set(time.time())
+    if metricsPath:
+        log(f" - 📈 {metricsPath}", end="", flush=True)
+        metrics.write_textfile(metricsPath)
         log(f"  {greenOk}")
 
     return min(0, len(errors))
 
 
+def daemonRun(kind, parserNames, after, options):
+    """One scheduled run of the daemon, `kind` is "full" or "today"."""
+    fetch.clear_cache()
+    flags = {
+        "updateJson": kind == "full",
+        "updateMeta": kind == "full",
+        "updateFeed": kind == "full",
+        "updateToday": kind == "today",
+    }
+    exitCode = updateFeeds(**dict(options, selectedParser=parserNames, reuseParsers=True, **flags))
+    if exitCode == 130:
+        raise KeyboardInterrupt
+    if after and runManifest["changed"]:
+        log(f" - 🚚 {after}", end="", flush=True)
+        result = subprocess.run(after, shell=True, cwd=repo_path or None)
+        log(f"  {greenOk}" if result.returncode == 0 else f"  {redError} (exit code {result.returncode})")
+
+
+def runDaemon(schedulePath=schedule_path, metricsPort=0, **options):
+    """Keep the parsers, sessions and caches in this process and
+    run the parsers whenever their schedule (in UTC) is due"""
+    schedule = Schedule.load(schedulePath)
+    if metricsPort:
+        metrics.serve(metricsPort)
+        log(f"📈 Metrics on http://127.0.0.1:{metricsPort}/metrics")
+    selectedParser = options.pop("selectedParser", "")
+    parserNames = [parserName for parserName in allParsers
+                   if not selectedParser or parserName == selectedParser]
+    log(f"🕰️ Daemon with schedule {schedulePath}")
+
+    def utcMinute():
+        return datetime.datetime.now(datetime.timezone.utc).replace(second=0, microsecond=0)
+
+    lastMinute = utcMinute() - datetime.timedelta(minutes=1)
+    try:
+        while True:
+            now = utcMinute()
+            # Include the minutes that passed during a long run, at most one hour
+            minute = max(lastMinute, now - datetime.timedelta(hours=1))
+            due = {}
+            while minute < now:
+                minute += datetime.timedelta(minutes=1)
+                for kind, names in schedule.due(parserNames, minute).items():
+                    due.setdefault(kind, [])
+                    due[kind].extend(name for name in names if name not in due[kind])
+            lastMinute = now
+            for kind, names in due.items():
+                log(f"🕰️ {now:%Y-%m-%d %H:%M} UTC {kind}: {', '.join(names)}")
+                daemonRun(kind, names, schedule.after, options)
+            time.sleep(max(1, 60 - time.time() % 60))
+    except KeyboardInterrupt:
+        log(" [Control-C]")
+        return 130
+
+
 def startFromTerminal(exitAfterwards=True):
     # Arguments
     parser = argparse.ArgumentParser(
@@ -251,10 +761,118 @@ def startFromTerminal(exitAfterwards=True):
         dest='basePath',
         default=base_path,
         help='Output directory')
+    parser.add_argument(
+        '-cache',
+        dest='cachePath',
+        default=cache_path,
+        help='Directory for the persistent HTTP cache, empty string to disable it')
+    parser.add_argument(
+        '-manifest',
+        dest='manifestPath',
+        default='',
+        help='Write a JSON list of changed, unchanged and failed files to this file')
+    parser.add_argument(
+        '-jobs',
+        dest='jobs',
+        type=int,
+        default=1,
+        help='Number of parsers to run concurrently')
+    parser.add_argument(
+        '-host-jobs',
+        dest='hostJobs',
+        type=int,
+        default=2,
+        help='Number of canteens of one parser (i.e. one upstream host) to run concurrently, only with -jobs')
+    parser.add_argument(
+        '-rate',
+        dest='rate',
+        type=float,
+        default=0,
+        help='Maximum number of requests per second to one host, 0 for no limit')
+    parser.add_argument(
+        '-max-in-flight',
+        dest='maxInFlight',
+        type=int,
+        default=4,
+        help='Maximum number of concurrent requests to one host, 0 for no limit')
+    parser.add_argument(
+        '-shard',
+        dest='shard',
+        type=parseShard,
+        default=None,
+        help='Only run the i-th of N parts of all canteens, e.g. 1/4. Writes a manifest per shard')
+    parser.add_argument(
+        '-costs',
+        dest='costsPath',
+        default='',
+        help='Manifest of an earlier run, its durations are used to balance the shards')
+    parser.add_argument(
+        '-merge',
+        dest='mergePaths',
+        nargs='+',
+        default=None,
+        help='Merge the manifests of all shards and rebuild index.html instead of updating feeds')
 
-    args = parser.parse_args()
-
-    exitCode = updateFeeds(**vars(args))
+    parser.add_argument(
+        '-timings',
+        dest='timingsPath',
+        default='',
+        help='Write the time of fetch, parse, build, serialize and write per canteen and feed to this .json or .csv file')
+    parser.add_argument(
+        '-metrics',
+        dest='metricsPath',
+        default='',
+        help='Write Prometheus metrics in the textfile collector format to this file, e.g. mensa.prom')
+    parser.add_argument(
+        '-metrics-port',
+        dest='metricsPort',
+        type=int,
+        default=0,
+        help='Daemon mode: serve Prometheus metrics on http://127.0.0.1:PORT/metrics')
+    parser.add_argument(
+        '-record',
+        dest='recordPath',
+        default='',
+        help='Record all HTTP requests and responses of the run to this .zip file')
+    parser.add_argument(
+        '-replay',
+        dest='replayPath',
+        default='',
+        help='Answer all HTTP requests from a .zip file of -record instead of the network')
+    parser.add_argument(
+        '-upstream',
+        dest='upstream',
+        default='',
+        help='Send all requests to this server instead, e.g. http://127.0.0.1:8080 of tests/mock_upstream.py')
+    parser.add_argument(
+        '-html-parser',
+        dest='htmlParser',
+        default='',
+        help='BeautifulSoup tree builder of the parsers that have none in util.html_parsers, e.g. lxml')
+    parser.add_argument(
+        '-daemon', '--daemon',
+        dest='daemon',
+        action='store_const',
+        const=True,
+        default=False,
+        help='Keep running and update the feeds on the schedules from -schedule')
+    parser.add_argument(
+        '-schedule',
+        dest='schedulePath',
+        default=schedule_path,
+        help='JSON file with the cron schedules of the daemon')
+
+    args = vars(parser.parse_args())
+    daemon = args.pop('daemon')
+    schedulePath = args.pop('schedulePath')
+    metricsPort = args.pop('metricsPort')
+
+    if daemon:
+        for key in ('updateJson', 'updateMeta', 'updateFeed', 'updateToday', 'shard', 'mergePaths'):
+            args.pop(key)
+        exitCode = runDaemon(schedulePath, metricsPort, **args)
+    else:
+        exitCode = updateFeeds(**args)
 
     if exitAfterwards:
         sys.exit(exitCode)
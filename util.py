@@ -1,15 +1,26 @@
 #!/usr/bin/env python
 
+import os
 import re
+import json
+import logging
+import hashlib
 import datetime
+import functools
+import threading
 from zoneinfo import ZoneInfo
+import xml.dom.minidom
 import lxml
 import lxml.etree
-from pyopenmensa.feed import LazyBuilder
+from pyopenmensa.feed import BaseBuilder, LazyBuilder
+
+import timing
+import metrics
 
 
 __all__ = ['xml_escape', 'xml_remove_invalid_chars', 'StyledLazyBuilder',
-           'now_local', 'xml_str_param', 'meta_from_xsl', 'weekdays_map']
+           'now_local', 'xml_str_param', 'compiled_xslt', 'meta_from_xsl', 'load_json5', 'weekdays_map',
+           'parse_html', 'html_subtrees', 'html_parsers']
 
 default_style_sheets = ('https://cdn.jsdelivr.net/npm/om-style@1.0.0/basic.css',
                         'https://cdn.jsdelivr.net/npm/om-style@1.0.0/lightgreen.css')
@@ -24,22 +35,149 @@ def xml_escape(s, escape_double_quotes=False):
     return s
 
 
-def xml_remove_invalid_chars(s):
+_opening_times_pattern = re.compile(
+    r"([A-Z][a-z])(\s*-\s*([A-Z][a-z]))?\s*(\d{1,2})[:\.](\d{2})\s*[-–]\s*(\d{1,2})[:\.](\d{2})(?:\s*Uhr)?", flags=re.IGNORECASE)
+
+# lxml's XSLT objects must not be shared between threads, so each thread
+# compiles a stylesheet once and keeps it as long as the file doesn't change
+_xslt_cache = threading.local()
+
+
+@functools.cache
+def _restricted_chars():
     # https://www.w3.org/TR/xml/#char32
-    restricted_chars = re.compile(
+    # Compiling this character class takes ~10ms, so it is only compiled when a feed is generated
+    return re.compile(
         r'[^\u0009\u000A\u000D\u0020-\uD7FF\uE000-\uFFFD\u10000-\u10FFFF]')
-    return restricted_chars.sub('', s)
 
 
-class StyledLazyBuilder(LazyBuilder):
+def xml_remove_invalid_chars(s):
+    return _restricted_chars().sub('', s)
+
+
+def _minidom_escape_tables():
+    """Translation tables for text and attribute values that reproduce the
+    escaping of the installed xml.dom.minidom (it changed in Python 3.13)"""
+    document = xml.dom.minidom.Document()
+    text, attr = {}, {}
+    for c in '&<>"\'\r\n\t':
+        element = document.createElement('e')
+        element.setAttribute('a', c)
+        element.appendChild(document.createTextNode(c))
+        attr_value, text_value = element.toxml()[len('<e a="'):-len('</e>')].split('">', 1)
+        if attr_value != c:
+            attr[ord(c)] = attr_value
+        if text_value != c:
+            text[ord(c)] = text_value
+    return text, attr
+
+
+_text_escape, _attr_escape = _minidom_escape_tables()
+
+_openmensa_start_tag = ('<openmensa version="2.1" xmlns="http://openmensa.org/open-mensa-v2" '
+                        'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                        'xsi:schemaLocation="http://openmensa.org/open-mensa-v2 '
+                        'http://openmensa.org/open-mensa-v2.xsd">\n')
+
+
+class _ValidCharsBuilder(BaseBuilder):
+    """Removes characters that are not allowed in XML from each meal
+    when it is added, instead of from the whole feed"""
+
+    def addMeal(self, date, category, name, notes=None, prices=None):
+        valid_category = xml_remove_invalid_chars(category)
+        valid_name = xml_remove_invalid_chars(name)
+        if (category and not valid_category) or (name and not valid_name):
+            # Nothing left but invalid characters, pyopenmensa would reject the empty value
+            logging.debug("Skipped meal with invalid characters only: %r %r", category, name)
+            return
+        if notes:
+            valid_notes = [xml_remove_invalid_chars(note) for note in notes]
+            # Empty notes are still rejected, notes that only had invalid characters are dropped
+            notes = [valid for note, valid in zip(notes, valid_notes) if valid or not note]
+        super().addMeal(date, valid_category, valid_name, notes, prices)
+
+
+class StyledLazyBuilder(LazyBuilder, _ValidCharsBuilder):
+    def addMeal(self, *args, **kwargs):
+        with timing.phase('build'):
+            super().addMeal(*args, **kwargs)
+
     def toXMLFeed(self, styles=default_style_sheets):
-        feed = self.toXML()
+        self._observe()
+        with timing.phase('serialize'):
+            return self._toXMLFeed(styles)
+
+    def _toXMLFeed(self, styles):
+        xml_header = self._xml_header(styles)
+        if self._has_canteen_data():
+            # Canteen data is not set by addMeal(), use pyopenmensa's serializer
+            return xml_remove_invalid_chars(xml_header + self.toXML().toprettyxml(indent='  '))
+        return xml_header + ''.join(self._iter_feed())
+
+    def writeXMLFeed(self, fileobj, styles=default_style_sheets):
+        """Write the same content as toXMLFeed() day by day to a text file"""
+        self._observe()
+        with timing.phase('serialize'):
+            self._writeXMLFeed(fileobj, styles)
+
+    def _writeXMLFeed(self, fileobj, styles):
+        if self._has_canteen_data():
+            fileobj.write(self._toXMLFeed(styles))
+            return
+        fileobj.write(self._xml_header(styles))
+        for chunk in self._iter_feed():
+            fileobj.write(chunk)
+
+    @staticmethod
+    def _xml_header(styles):
         xml_header = '<?xml version="1.0" encoding="UTF-8"?>\n'
         if styles:
             for style in styles:
                 xml_header += '<?xml-stylesheet href="' + \
                     xml_escape(style, True) + '" type="text/css"?>\n'
-        return xml_remove_invalid_chars(xml_header + feed.toprettyxml(indent='  '))
+        return xml_header
+
+    def _observe(self):
+        meals = sum(len(meals) for day in self._days.values() if day for meals in day.values())
+        metrics.observe_feed(meals, len(self._days))
+
+    def _has_canteen_data(self):
+        return (self.version is not None or self.feeds or
+                any(value is not None for value in (self._name, self._address, self._city, self._phone,
+                                                    self._email, self._location, self._availability)))
+
+    def _iter_feed(self):
+        """Yield the <openmensa> element in the same format as
+        minidom's toprettyxml(indent='  ') without building a DOM"""
+        yield _openmensa_start_tag
+        if not self._days:
+            yield '  <canteen/>\n</openmensa>\n'
+            return
+        yield '  <canteen>\n'
+        for date in sorted(self._days.keys()):
+            day = self._days[date]
+            date = str(date).translate(_attr_escape)
+            if day is False:
+                yield f'    <day date="{date}">\n      <closed/>\n    </day>\n'
+                continue
+            if not day:
+                yield f'    <day date="{date}"/>\n'
+                continue
+            yield f'    <day date="{date}">\n'
+            for category, meals in day.items():
+                yield f'      <category name="{category.translate(_attr_escape)}">\n'
+                for name, notes, prices in meals:
+                    yield f'        <meal>\n          <name>{name.translate(_text_escape)}</name>\n'
+                    for note in sorted(notes):
+                        yield f'          <note>{note.translate(_text_escape)}</note>\n'
+                    for role in sorted(prices):
+                        yield (f'          <price role="{role.translate(_attr_escape)}">'
+                               f'{prices[role] // 100}.{prices[role] % 100:0>2}</price>\n')
+                    yield '        </meal>\n'
+                yield '      </category>\n'
+            yield '    </day>\n'
+        yield '  </canteen>\n</openmensa>\n'
 
 
 def now_local():
@@ -52,14 +190,114 @@ def xml_str_param(s):
     return lxml.etree.XSLT.strparam(str(s))
 
 
+def compiled_xslt(file_name):
+    """Return the compiled XSLT stylesheet from `file_name`, cached per thread"""
+    cache = getattr(_xslt_cache, 'stylesheets', None)
+    if cache is None:
+        cache = _xslt_cache.stylesheets = {}
+    key = (os.path.abspath(file_name), os.stat(file_name).st_mtime_ns)
+    xslt = cache.get(key)
+    if xslt is None:
+        xslt = lxml.etree.XSLT(lxml.etree.parse(file_name))
+        cache[key] = xslt
+    return xslt
+
+
+# BeautifulSoup tree builder per parser, e.g. {"inetmenue": "lxml"}, see tests/test_html_parser.py
+html_parsers = {"wuerzburg": "lxml"}
+default_html_parser = 'html.parser'
+
+
+_selector_pattern = re.compile(r'^([\w-]*)(?:#([\w-]+))?(?:\.([\w-]+))?(?:\[([\w-]+)="([^"]*)"\])?$')
+
+
+@functools.lru_cache(maxsize=None)
+def html_subtrees(*selectors):
+    """Filter for parse_html() that only builds the elements matching one of the
+    `selectors` and everything inside them. Only simple selectors are supported:
+    'tag', '#id', '.class', 'tag.class' and 'tag[attr="value"]'"""
+    from bs4.filter import ElementFilter
+
+    rules = []
+    for selector in selectors:
+        m = _selector_pattern.match(selector)
+        if not m or not any(m.groups()):
+            raise ValueError(f"Unsupported selector {selector!r}")
+        rules.append(m.groups())
+
+    def matches(name, attrs):
+        for tag, id_, class_, attr, value in rules:
+            if tag and tag != name:
+                continue
+            if id_ and attrs.get('id') != id_:
+                continue
+            if class_:
+                classes = attrs.get('class') or ''
+                if class_ not in (classes.split() if isinstance(classes, str) else classes):
+                    continue
+            if attr and attrs.get(attr) != value:
+                continue
+            return True
+        return False
+
+    class Subtrees(ElementFilter):
+        includes_everything = False
+
+        def allow_tag_creation(self, nsprefix, name, attrs):
+            return matches(name, attrs or {})
+
+        def allow_string_creation(self, string):
+            # Text outside of the matching elements
+            return False
+
+        def __repr__(self):
+            return f"html_subtrees{selectors!r}"
+
+    return Subtrees()
+
+
+def parse_html(markup, parser_name=None, parse_only=None):
+    """BeautifulSoup document with the tree builder of `parser_name` in html_parsers.
+    `parse_only` is a SoupStrainer or a tuple of selectors for html_subtrees()"""
+    import bs4  # not all parsers need it
+    if isinstance(parse_only, tuple):
+        parse_only = html_subtrees(*parse_only)
+    return bs4.BeautifulSoup(markup, html_parsers.get(parser_name, default_html_parser), parse_only=parse_only)
+
+
+def load_json5(file_name):
+    """Load a JSON5 file. Parsing JSON5 is slow, so the result is
+    cached as plain JSON in __pycache__ until the file changes"""
+    with open(file_name, 'rb') as f:
+        content = f.read()
+    cache_dir = os.path.join(os.path.dirname(file_name), '__pycache__')
+    cache_file = os.path.join(cache_dir, '%s.%s.json' % (
+        os.path.basename(file_name), hashlib.sha1(content).hexdigest()[:16]))
+    try:
+        with open(cache_file, 'r', encoding='utf8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    import json5
+    data = json5.loads(content.decode('utf8'))
+    tmp_file = '%s.%d.%d.tmp' % (cache_file, os.getpid(), threading.get_ident())
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(tmp_file, 'w', encoding='utf8') as f:
+            json.dump(data, f)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        pass
+    return data
+
+
 def meta_from_xsl(file_name, data):
     """Generate an openmensa XML meta feed using XSLT"""
 
     if "times" in data:
         opening_times = {}
-        pattern = re.compile(
-            r"([A-Z][a-z])(\s*-\s*([A-Z][a-z]))?\s*(\d{1,2})[:\.](\d{2})\s*[-–]\s*(\d{1,2})[:\.](\d{2})(?:\s*Uhr)?", flags=re.IGNORECASE)
-        m = re.findall(pattern, data["times"])
+        m = _opening_times_pattern.findall(data["times"])
 
         for result in m:
             from_day, _, to_day, from_time_hours, from_time_minutes, to_time_hours, to_time_minutes = result
@@ -82,12 +320,12 @@ def meta_from_xsl(file_name, data):
         data["times"] = xml_str_param(True)
 
     # Generate xml
-    xslt_tree = lxml.etree.parse(file_name)
-    xslt = lxml.etree.XSLT(xslt_tree)
-    return lxml.etree.tostring(xslt(lxml.etree.Element("foobar"), **data),
-                               pretty_print=True,
-                               xml_declaration=True,
-                               encoding="utf-8").decode("utf-8")
+    with timing.phase('serialize'):
+        xslt = compiled_xslt(file_name)
+        return lxml.etree.tostring(xslt(lxml.etree.Element("foobar"), **data),
+                                   pretty_print=True,
+                                   xml_declaration=True,
+                                   encoding="utf-8").decode("utf-8")
 
 
 weekdays_map = [
@@ -5,17 +5,15 @@ import os
 import json
 import logging
 import urllib
-import requests
-from bs4 import BeautifulSoup as parse
 
 try:
-    from version import __version__, useragentname, useragentcomment
-    from util import StyledLazyBuilder, xml_escape, meta_from_xsl, xml_str_param
+    from fetch import get_cached
+    from util import StyledLazyBuilder, xml_escape, meta_from_xsl, xml_str_param, parse_html
 except ModuleNotFoundError:
     include = os.path.relpath(os.path.join(os.path.dirname(__file__), '..'))
     sys.path.insert(0, include)
-    from version import __version__, useragentname, useragentcomment
-    from util import StyledLazyBuilder, xml_escape, meta_from_xsl, xml_str_param
+    from fetch import get_cached
+    from util import StyledLazyBuilder, xml_escape, meta_from_xsl, xml_str_param, parse_html
 
 
 class Parser:
@@ -29,7 +27,7 @@ class Parser:
         builder = StyledLazyBuilder()
         locale.setlocale(locale.LC_TIME, 'de_DE.UTF-8')
 
-        document = parse(self._get_cached(self.canteens[ref]["canteen_url"]+"/menu").text, 'lxml')
+        document = parse_html(get_cached(self.canteens[ref]["canteen_url"]+"/menu").text, 'wuerzburg')
         
         for day in document.find_all('div', class_='day-menu'):
             try:
@@ -95,7 +93,7 @@ class Parser:
         }
 
         # Fetch opening Times from website
-        document = parse(self._get_cached(self.canteens[ref]["canteen_url"]+"/menu").text, 'lxml')
+        document = parse_html(get_cached(self.canteens[ref]["canteen_url"]+"/menu").text, 'wuerzburg')
         times = ""
         openingData = document.find('div', class_='opening-time_listing-all')
         if openingData:
@@ -125,23 +123,6 @@ class Parser:
                 self.canteens[canteen_reference]["canteen_url"] = f"https://www.swerk-wue.de/{canteen_city}/essen-trinken/mensen-speiseplaene/{canteen_reference}"
 
         self.url_template = url_template
-        self.session = requests.Session()
-        self.session.headers = {
-            'User-Agent': f'{useragentname}/{__version__} ({useragentcomment}) {requests.utils.default_user_agent()}',
-            'Accept-Encoding': 'utf-8'
-        }
-        self._cache = []
-
-    def _get_cached(self, url):
-        for key, content in self._cache:
-            if key == url:
-                logging.debug("Retrieved from cache: %s", url)
-                return content
-        content = self.session.get(url)
-        self._cache.append((url, content))
-        if len(self._cache) > 20:
-            self._cache.pop(0)
-        return content
 
     def json(self):
         tmp = {}